@@ -0,0 +1,121 @@
+"""
+Compares export image codecs on synthetic zfs send streams.
+
+Every codec writes the same stream through ArchiveWriter, the way
+`iocage export` does, and reads it back the way `iocage import` does. The
+stream mixes text, binary-like, already compressed and zero filled blocks to
+resemble a typical jail dataset.
+
+    python benchmarks/export_codecs.py --size 512 --threads 1 4 8
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from iocage_lib.archive import (
+    ArchiveWriter, CODECS, EXTENSIONS, HashingWriter, read_streams
+)
+
+BLOCK = 128 * 1024
+WORDS = (
+    b'jail', b'release', b'vnet', b'bridge0', b'/usr/local/etc', b'pkg',
+    b'interface', b'ZFS', b'sshd_enable="YES"', b'root', b'devfs', b'\n',
+)
+
+
+def synthetic_stream(size, seed=0):
+    """Returns size bytes of send stream like data."""
+    rnd = random.Random(seed)
+    kinds = ('text', 'binary', 'random', 'zero')
+    buf = bytearray()
+
+    while len(buf) < size:
+        kind = rnd.choices(kinds, weights=(4, 3, 2, 1))[0]
+        if kind == 'text':
+            block = b' '.join(rnd.choices(WORDS, k=BLOCK // 6))[:BLOCK]
+        elif kind == 'binary':
+            alphabet = bytes(rnd.sample(range(256), 24))
+            block = bytes(rnd.choices(alphabet, k=BLOCK))
+        elif kind == 'random':
+            block = rnd.getrandbits(BLOCK * 8).to_bytes(BLOCK, 'little')
+        else:
+            block = bytes(BLOCK)
+        buf += block
+
+    return bytes(buf[:size])
+
+
+class Source:
+
+    def __init__(self, data):
+        self.view = memoryview(data)
+        self.offset = 0
+
+    def read(self, size):
+        chunk = self.view[self.offset:self.offset + size]
+        self.offset += len(chunk)
+        return bytes(chunk)
+
+
+def run(codec, threads, data, directory):
+    path = os.path.join(directory, f'bench.{EXTENSIONS[codec]}')
+
+    start = time.monotonic()
+    with open(path, 'wb') as raw:
+        with ArchiveWriter.open(HashingWriter(raw), codec, threads) as archive:
+            archive.add_stream('bench', Source(data))
+    compress = time.monotonic() - start
+    size = os.path.getsize(path)
+
+    start = time.monotonic()
+    for _, chunks in read_streams(path):
+        for _ in chunks:
+            pass
+    decompress = time.monotonic() - start
+
+    os.remove(path)
+    return compress, decompress, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        '--size', type=int, default=256, help='Stream size in MiB'
+    )
+    parser.add_argument(
+        '--threads', type=int, nargs='+', default=[1, os.cpu_count() or 1]
+    )
+    parser.add_argument(
+        '--codecs', nargs='+', default=list(EXTENSIONS),
+        choices=list(EXTENSIONS)
+    )
+    args = parser.parse_args()
+
+    data = synthetic_stream(args.size * 1024 * 1024)
+    mib = len(data) / 1024 / 1024
+
+    print(
+        f'{"codec":<8}{"threads":>8}{"export MiB/s":>14}'
+        f'{"import MiB/s":>14}{"ratio":>8}'
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for codec in args.codecs:
+            if codec in CODECS and not CODECS[codec].available():
+                print(f'{codec:<8}{"not installed":>22}')
+                continue
+
+            # zip is always single threaded
+            for threads in ([1] if codec == 'zip' else args.threads):
+                compress, decompress, size = run(
+                    codec, threads, data, directory
+                )
+                print(
+                    f'{codec:<8}{threads:>8}{mib / compress:>14.1f}'
+                    f'{mib / decompress:>14.1f}{len(data) / size:>8.2f}'
+                )
+
+
+if __name__ == '__main__':
+    main()
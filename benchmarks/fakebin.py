@@ -0,0 +1,480 @@
+"""
+Stand-ins for the FreeBSD tools iocage runs, for benchmarking without a
+real host.
+
+fakehost.py installs this script as zfs, zpool, jls, jail, jexec, ifconfig,
+devfs, rctl, sysctl and a few more. Every tool acts on the JSON state file
+named by FAKEHOST_STATE and appends its command line to FAKEHOST_LOG, so
+callers can count what iocage ran. Only the subset of each tool iocage uses
+is understood, anything else succeeds without output.
+"""
+import contextlib
+import fcntl
+import json
+import os
+import sys
+import time
+import zlib
+
+NUMERIC = ('used', 'available', 'referenced', 'quota', 'reservation')
+DATASET_DEFAULTS = {
+    'type': 'filesystem', 'used': 0, 'available': 100 * 2 ** 30,
+    'referenced': 0, 'quota': 0, 'reservation': 0, 'compression': 'lz4',
+    'compressratio': '1.00x', 'exec': 'on', 'readonly': 'off',
+    'jailed': 'off', 'mounted': 'yes', 'origin': '-', 'aclmode':
+    'passthrough', 'aclinherit': 'passthrough', 'creation': 1577836800,
+}
+SNAPSHOT_DEFAULTS = {
+    'type': 'snapshot', 'used': 0, 'referenced': 0, 'creation': 1577836800,
+}
+
+
+class Fail(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def state(write=False):
+    path = os.environ['FAKEHOST_STATE']
+    with open(f'{path}.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+        with open(path) as f:
+            data = json.load(f)
+        yield data
+        if write:
+            with open(f'{path}.tmp', 'w') as f:
+                json.dump(data, f)
+            os.replace(f'{path}.tmp', path)
+
+
+def log(argv):
+    path = os.environ.get('FAKEHOST_LOG')
+    if path:
+        line = json.dumps([os.path.basename(argv[0]), *argv[1:]])
+        # One write per line keeps concurrent appends whole
+        with open(path, 'a') as f:
+            f.write(line + '\n')
+
+
+def getopts(args, flags, valued):
+    """
+    Splits BSD style options from operands, flags can be bundled (-rHo).
+    """
+    opts = {}
+    args = list(args)
+    while args and args[0].startswith('-') and args[0] != '-':
+        arg = args.pop(0)
+        if arg == '--':
+            break
+        if arg.startswith('--'):
+            key, _, value = arg.partition('=')
+            opts[key] = value or (args.pop(0) if key in valued else True)
+            continue
+        for i, c in enumerate(arg[1:], 1):
+            if c in valued:
+                opts[c] = arg[i + 1:] or args.pop(0)
+                break
+            opts[c] = True
+    return opts, args
+
+
+def human(value):
+    value = float(value)
+    for unit in ('B', 'K', 'M', 'G', 'T'):
+        if value < 1024 or unit == 'T':
+            return f'{value:.3g}{unit}' if unit != 'B' else f'{int(value)}B'
+        value /= 1024
+
+
+def emit(rows, header, scripted):
+    if scripted:
+        for row in rows:
+            print('\t'.join(str(c) for c in row))
+        return
+
+    rows = [[c.upper() for c in header]] + [[str(c) for c in r] for r in rows]
+    widths = [max(len(r[i]) for r in rows) for i in range(len(header))]
+    for row in rows:
+        print('  '.join(c.ljust(w) for c, w in zip(row, widths)).rstrip())
+
+
+# zfs and zpool
+
+def properties(st, name):
+    if '@' in name:
+        props = {**SNAPSHOT_DEFAULTS, **st['snapshots'][name]}
+    else:
+        props = {**DATASET_DEFAULTS, **st['datasets'][name]}
+    props['name'] = name
+    props.setdefault('guid', str(zlib.crc32(name.encode())))
+    return props
+
+
+def value(props, prop, parsable):
+    v = props.get(prop, '-')
+    if prop in NUMERIC and not parsable:
+        return '-' if prop in ('quota', 'reservation') and not v else human(v)
+    if prop == 'creation' and not parsable:
+        return time.strftime('%a %b %d %H:%M %Y', time.localtime(v))
+    return v
+
+
+def resolve(st, target):
+    if target in st['datasets'] or target in st['snapshots']:
+        return target
+    if target.startswith('/'):
+        for name, props in st['datasets'].items():
+            if props.get('mountpoint') == target.rstrip('/'):
+                return name
+    raise Fail(f"cannot open '{target}': dataset does not exist")
+
+
+def select(st, targets, recursive, depth, types):
+    types = types.split(',') if types else None
+    names = []
+    kinds = {'filesystem': 'datasets', 'volume': 'datasets',
+             'snapshot': 'snapshots', 'snap': 'snapshots'}
+    pools = sorted(st['datasets'])
+
+    if not targets:
+        targets = [n for n in pools if '/' not in n]
+        recursive = True
+        # Without targets, zfs list shows filesystems only
+        types = types or ['filesystem']
+
+    for target in targets:
+        name = resolve(st, target)
+        if not recursive and depth is None:
+            names.append(name)
+            continue
+
+        base = len(name.split('/'))
+        for kind in ('datasets', 'snapshots'):
+            if types and 'all' not in types and not any(
+                kinds.get(t) == kind for t in types
+            ):
+                continue
+            for n in st[kind]:
+                ds = n.split('@')[0]
+                if ds != name and not ds.startswith(f'{name}/'):
+                    continue
+                if depth is not None and (
+                    len(ds.split('/')) - base > int(depth)
+                ):
+                    continue
+                names.append(n)
+
+    return list(dict.fromkeys(names))
+
+
+def zfs_list(st, args):
+    opts, targets = getopts(args, 'Hrp', 'odts')
+    fields = opts.get('o', 'name,used,available,referenced,mountpoint')
+    fields = fields.split(',')
+    names = select(st, targets, opts.get('r'), opts.get('d'), opts.get('t'))
+    if targets and not opts.get('r') and opts.get('d') is None and \
+            opts.get('t') == 'snapshot':
+        # zfs list -t snapshot pool/ds lists that dataset's snapshots
+        names = [n for n in st['snapshots'] if n.split('@')[0] in names]
+
+    rows = [
+        [value(properties(st, n), f, opts.get('p')) for f in fields]
+        for n in names
+    ]
+    if opts.get('s'):
+        i = fields.index(opts['s'])
+        rows.sort(key=lambda r: r[i])
+    emit(rows, fields, opts.get('H'))
+
+
+def zfs_get(st, args, kind='zfs'):
+    opts, rest = getopts(args, 'Hrp', 'odts')
+    props, targets = rest[0].split(','), rest[1:]
+    fields = opts.get('o', 'name,property,value,source').split(',')
+    if kind == 'zpool':
+        names = targets or sorted(st['pools'])
+        lookup = lambda n: {'name': n, **st['pools'][n]}  # noqa: E731
+    else:
+        names = select(
+            st, targets, opts.get('r'), opts.get('d'), opts.get('t')
+        )
+        lookup = lambda n: properties(st, n)  # noqa: E731
+
+    rows = []
+    for name in names:
+        data = lookup(name)
+        for prop in (sorted(data) if props == ['all'] else props):
+            if prop == 'name' and props == ['all']:
+                continue
+            row = {
+                'name': name, 'property': prop,
+                'value': value(data, prop, opts.get('p')),
+                'source': 'local' if ':' in prop else 'default',
+            }
+            rows.append([row[f] for f in fields])
+    emit(rows, fields, opts.get('H'))
+
+
+def zfs_set(st, args, kind='datasets'):
+    assignment, name = args[-2:]
+    prop, _, val = assignment.partition('=')
+    st[kind][resolve(st, name) if kind == 'datasets' else name][prop] = val
+
+
+def zfs_create(st, args):
+    opts, rest = getopts(args, 'p', 'o')
+    name = rest[0]
+    parents = name.split('/')
+    for i in range(1, len(parents) + 1):
+        ds = '/'.join(parents[:i])
+        if ds not in st['datasets']:
+            if i < len(parents) and not opts.get('p'):
+                raise Fail(f"cannot create '{name}': parent does not exist")
+            parent = st['datasets'].get('/'.join(parents[:i - 1]), {})
+            st['datasets'][ds] = {
+                'mountpoint': f"{parent.get('mountpoint', '')}/{parents[i - 1]}"
+            }
+            os.makedirs(st['datasets'][ds]['mountpoint'], exist_ok=True)
+
+
+def zfs_destroy(st, args):
+    opts, rest = getopts(args, 'rRfn', '')
+    name = rest[0]
+    for kind in ('datasets', 'snapshots'):
+        for n in list(st[kind]):
+            if n == name or opts.get('r') and (
+                n.startswith(f'{name}/') or n.startswith(f'{name}@')
+            ):
+                del st[kind][n]
+
+
+def zfs_snapshot(st, args):
+    opts, rest = getopts(args, 'r', 'o')
+    ds, _, snap = rest[0].partition('@')
+    for name in list(st['datasets']):
+        if name == ds or opts.get('r') and name.startswith(f'{ds}/'):
+            st['snapshots'][f'{name}@{snap}'] = {
+                'creation': int(time.time())
+            }
+
+
+def zfs(argv):
+    command, args = argv[0], argv[1:]
+    writes = {
+        'set': zfs_set, 'create': zfs_create, 'destroy': zfs_destroy,
+        'snapshot': zfs_snapshot,
+        'inherit': lambda st, a: st['datasets'][resolve(st, a[-1])].pop(
+            a[-2], None
+        ),
+    }
+    if command in writes:
+        with state(write=True) as st:
+            writes[command](st, args)
+    elif command in ('list', 'get'):
+        with state() as st:
+            (zfs_list if command == 'list' else zfs_get)(st, args)
+    # mount, umount, jail, unjail, rename, ... just succeed
+
+
+def zpool(argv):
+    command, args = argv[0], argv[1:]
+    with state(write=command == 'set') as st:
+        if command == 'list':
+            opts, names = getopts(args, 'Hp', 'o')
+            fields = opts.get('o', 'name,health').split(',')
+            rows = [
+                [{'name': n, **st['pools'][n]}.get(f, '-') for f in fields]
+                for n in (names or sorted(st['pools']))
+            ]
+            emit(rows, fields, opts.get('H'))
+        elif command == 'get':
+            zfs_get(st, args, 'zpool')
+        elif command == 'set':
+            zfs_set(st, args, 'pools')
+
+
+# Jails
+
+def jail_name(name):
+    return name[4:].replace('_', '.') if name.startswith('ioc-') else name
+
+
+def jls(argv):
+    opts, params, libxo = {}, [], False
+    args = list(argv)
+    while args:
+        arg = args.pop(0)
+        if arg.startswith('--libxo'):
+            libxo = True
+            if '=' not in arg:
+                args.pop(0)
+        elif arg == '-j':
+            opts['j'] = args.pop(0)
+        elif arg.startswith('-'):
+            opts[arg[1:]] = True
+        else:
+            params.append(arg)
+
+    with state() as st:
+        jails = [
+            {'jid': j['jid'], 'name': n, 'path': j['path'],
+             'hostname': jail_name(n), 'devfs_ruleset': 4,
+             'ipv4': '', 'ip4.addr': ''}
+            for n, j in sorted(st['jails'].items(), key=lambda i: i[1]['jid'])
+            if 'j' not in opts or opts['j'] in (n, str(j['jid']))
+        ]
+
+    if 'j' in opts and not jails:
+        print(f'jls: jail "{opts["j"]}" not found', file=sys.stderr)
+        sys.exit(1)
+
+    if libxo:
+        print(json.dumps({
+            '__version': '2', 'jail-information': {'jail': [
+                {p: j.get(p, '') for p in params} if params else j
+                for j in jails
+            ]}
+        }))
+    elif params:
+        for j in jails:
+            print(' '.join(str(j.get(p, '')) for p in params))
+    else:
+        print('   JID  IP Address      Hostname                      Path')
+        for j in jails:
+            print(f"{j['jid']:>6}  -               {j['hostname']:<29} "
+                  f"{j['path']}")
+
+
+def jail(argv):
+    opts, params = getopts(argv, 'crmvq', 'fJ')
+    with state(write=True) as st:
+        if opts.get('c'):
+            conf = {}
+            with contextlib.suppress(OSError, KeyError):
+                with open(opts['f']) as f:
+                    conf = parse_jail_conf(f.read())
+            name = conf.get('name') or next(
+                (p.split('=', 1)[1] for p in params if p.startswith('name=')),
+                None
+            )
+            st['last_jid'] = st.get('last_jid', 0) + 1
+            st['jails'][name] = {
+                'jid': st['last_jid'], 'path': conf.get('path', '/'),
+            }
+        elif opts.get('r'):
+            st['jails'].pop(params[0], None)
+
+
+def parse_jail_conf(text):
+    name = text.split('{', 1)[0].strip().strip('"')
+    conf = {'name': name}
+    for line in text.split('{', 1)[-1].splitlines():
+        key, sep, val = line.strip().rstrip(';').partition('=')
+        if sep and key.strip() == 'path':
+            conf['path'] = val.strip().strip('"')
+    return conf
+
+
+# Resource accounting and the rest of the host
+
+def rctl(argv):
+    opts, params = getopts(argv, 'hnu', '')
+    if not opts.get('u'):
+        return
+    with state() as st:
+        name = params[0].split(':', 1)[-1] if params else ''
+        if name not in st['jails']:
+            sys.exit(1)
+        jid = st['jails'][name]['jid']
+    usage = {
+        'cputime': jid, 'datasize': 0, 'stacksize': 0, 'coredumpsize': 0,
+        'memoryuse': jid * 2 ** 20, 'memorylocked': 0, 'maxproc': 3,
+        'openfiles': 20, 'vmemoryuse': jid * 2 ** 22, 'pseudoterminals': 0,
+        'swapuse': 0, 'nthr': 3, 'msgqqueued': 0, 'msgqsize': 0, 'nmsgq': 0,
+        'nsem': 0, 'nsemop': 0, 'nshm': 0, 'shmsize': 0, 'wallclock': jid,
+        'pcpu': 0, 'readbps': 0, 'writebps': 0, 'readiops': 0,
+        'writeiops': 0,
+    }
+    print(','.join(f'{k}={v}' for k, v in usage.items()))
+
+
+SYSCTLS = {
+    'vfs.zfs.version.spa': '5000',
+    'kern.osrelease': '13.2-RELEASE',
+    'hw.ncpu': '8',
+    'kern.ostype': 'FreeBSD',
+    'security.jail.param.name': '',
+    'security.jail.param.host.hostname': '',
+    'security.jail.param.allow.raw_sockets': '0',
+    'security.jail.param.allow.set_hostname': '0',
+    'security.jail.param.securelevel': '0',
+}
+
+
+def sysctl(argv):
+    opts, names = getopts(argv, 'nqid', '')
+    for name in names:
+        name, sep, val = name.partition('=')
+        matches = [
+            n for n in SYSCTLS if n == name or n.startswith(f'{name}.')
+        ]
+        if not matches and not sep:
+            print(f'sysctl: unknown oid \'{name}\'', file=sys.stderr)
+            sys.exit(1)
+        for match in matches or [name]:
+            value = val if sep else SYSCTLS[match]
+            if opts.get('d'):
+                value = 'benchmark'
+            print(value if opts.get('n') else f'{match}: {value}')
+
+
+def ifconfig(argv):
+    if len(argv) == 2 and argv[1] == 'create':
+        # ifconfig epair create
+        print(f'{argv[0]}0a')
+    elif argv == ['-l']:
+        print('lo0 em0 bridge0')
+    elif argv and argv[0] == 'bridge0' and len(argv) == 1:
+        print('bridge0: flags=8843<UP,BROADCAST,RUNNING,SIMPLEX,MULTICAST> '
+              'metric 0 mtu 1500')
+
+
+def netstat(argv):
+    if '-r' in argv and 'json' in argv:
+        print(json.dumps({'statistics': {'route-information': {
+            'route-table': {'rt-family': [
+                {'address-family': 'Internet', 'rt-entry': [{
+                    'destination': 'default', 'gateway': '10.0.0.1',
+                    'interface-name': 'em0',
+                }]},
+                {'address-family': 'Internet6', 'rt-entry': []},
+            ]}
+        }}}))
+
+
+def freebsd_version(argv):
+    print(SYSCTLS['kern.osrelease'])
+
+
+TOOLS = {
+    'zfs': zfs, 'zpool': zpool, 'jls': jls, 'jail': jail, 'rctl': rctl,
+    'sysctl': sysctl, 'ifconfig': ifconfig, 'netstat': netstat,
+    'freebsd-version': freebsd_version,
+}
+
+
+def main(argv):
+    log(argv)
+    tool = TOOLS.get(os.path.basename(argv[0]))
+    if tool is None:
+        # jexec, devfs, mount, umount, setfib, cpuset, ... succeed silently
+        return
+    try:
+        tool(argv[1:])
+    except Fail as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,304 @@
+"""
+Synthetic FreeBSD hosts for benchmarking iocage.
+
+A FakeHost is a directory holding a JSON description of a pool with any
+number of jails and snapshots, the jail directories and configs iocage
+reads, and a bin directory with a fakebin.py stand-in for every tool iocage
+runs. Running iocage through this script makes it manage that host, and
+FakeHost.commands() tells which external commands it ran.
+
+    host = FakeHost('/tmp/host')
+    host.generate(jails=1000, snapshots=2, running=100)
+    subprocess.run(host.iocage('list'), env=host.env())
+    print(host.commands())
+"""
+import collections
+import contextlib
+import json
+import locale
+import os
+import shutil
+import subprocess
+import sys
+
+from unittest import mock
+
+FAKEBIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fakebin.py')
+TOOLS = (
+    'zfs', 'zpool', 'jls', 'jail', 'jexec', 'ifconfig', 'devfs', 'rctl',
+    'sysctl', 'freebsd-version', 'mount', 'umount', 'setfib', 'cpuset',
+    'kldload', 'netstat', 'pfctl', 'route', 'sysrc', 'pkill', 'service',
+)
+POOL = 'tank'
+RELEASE = '13.2-RELEASE'
+CONFIG_VERSION = '29'
+
+
+class FakeHost:
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.bin = os.path.join(self.root, 'bin')
+        self.mnt = os.path.join(self.root, 'mnt')
+        self.state_path = os.path.join(self.root, 'state.json')
+        self.log_path = os.path.join(self.root, 'commands.log')
+
+    @property
+    def iocroot(self):
+        return os.path.join(self.mnt, POOL, 'iocage')
+
+    @staticmethod
+    def jail_name(i):
+        return f'jail{i:05d}'
+
+    def install(self):
+        """Puts a stand-in for every tool in TOOLS into bin."""
+        os.makedirs(self.bin, exist_ok=True)
+        for tool in TOOLS:
+            path = os.path.join(self.bin, tool)
+            with open(path, 'w') as f:
+                # -S: site-packages aren't needed and slow start-up down.
+                # iocage runs some commands with a clean environment, so the
+                # state and log paths are baked in.
+                f.write(
+                    f'#!{sys.executable} -S\n'
+                    'import os\n'
+                    'import sys\n'
+                    f'os.environ["FAKEHOST_STATE"] = {self.state_path!r}\n'
+                    f'os.environ["FAKEHOST_LOG"] = {self.log_path!r}\n'
+                    f'sys.path.insert(0, {os.path.dirname(FAKEBIN)!r})\n'
+                    'import fakebin\n'
+                    'fakebin.main(sys.argv)\n'
+                )
+            os.chmod(path, 0o755)
+
+    def iocage(self, *args):
+        """Command line running iocage args against this host."""
+        return [sys.executable, os.path.abspath(__file__), self.root, *args]
+
+    def env(self, **extra):
+        return {
+            **os.environ,
+            'PATH': f'{self.bin}:{os.environ.get("PATH", "/usr/bin:/bin")}',
+            # Never talk to an iocaged of the real host
+            'IOCAGE_SOCKET': os.path.join(self.root, 'iocaged.sock'),
+            'IOCAGE_LOGFILE': os.path.join(self.root, 'iocage.log'),
+            **extra,
+        }
+
+    def dataset(self, datasets, name, **props):
+        mountpoint = os.path.join(self.mnt, name)
+        datasets[name] = {'mountpoint': mountpoint, **props}
+        os.makedirs(mountpoint, exist_ok=True)
+
+    def generate(self, jails, snapshots=0, running=0, boot=0):
+        """
+        Creates a host with jails jails and snapshots snapshots of each.
+        The first running jails are running, the last boot jails are
+        started at boot.
+        """
+        if os.path.exists(self.root):
+            shutil.rmtree(self.root)
+        os.makedirs(self.root)
+        self.install()
+
+        datasets = {}
+        snaps = {}
+        running_jails = {}
+        self.dataset(datasets, POOL, **{'org.freebsd.ioc:active': 'yes'})
+        for ds in (
+            'iocage', 'iocage/download', 'iocage/images', 'iocage/jails',
+            'iocage/log', 'iocage/releases', 'iocage/templates',
+            f'iocage/releases/{RELEASE}', f'iocage/releases/{RELEASE}/root',
+        ):
+            self.dataset(datasets, f'{POOL}/{ds}')
+
+        release_root = os.path.join(self.iocroot, 'releases', RELEASE, 'root')
+        os.makedirs(os.path.join(release_root, 'bin'))
+        with open(os.path.join(release_root, 'bin', 'freebsd-version'), 'w') \
+                as f:
+            f.write(f'#!/bin/sh\necho {RELEASE}\n')
+
+        try:
+            with open('/etc/hostid') as f:
+                hostid = f.read().strip()
+        except OSError:
+            hostid = None
+
+        for i in range(jails):
+            name = self.jail_name(i)
+            jail = f'{POOL}/iocage/jails/{name}'
+            self.dataset(datasets, jail, used=i * 2 ** 20)
+            self.dataset(
+                datasets, f'{jail}/root',
+                origin=f'{POOL}/iocage/releases/{RELEASE}/root@{name}',
+                used=i * 2 ** 20, referenced=i * 2 ** 20,
+            )
+            for s in range(snapshots):
+                for ds in (jail, f'{jail}/root'):
+                    snaps[f'{ds}@bench{s}'] = {
+                        'creation': 1577836800 + s * 3600,
+                        'used': 2 ** 16, 'referenced': i * 2 ** 20,
+                    }
+
+            root = os.path.join(self.iocroot, 'jails', name, 'root')
+            for d in ('etc', 'dev', 'tmp', 'bin'):
+                os.makedirs(os.path.join(root, d), exist_ok=True)
+            with open(os.path.join(root, 'etc', 'hosts'), 'w') as f:
+                f.write(f'127.0.0.1 localhost {name}\n')
+            open(os.path.join(self.iocroot, 'jails', name, 'fstab'), 'w').close()
+
+            config = {
+                'CONFIG_VERSION': CONFIG_VERSION,
+                'host_hostuuid': name,
+                'host_hostname': name,
+                'host_hostid': hostid,
+                'release': RELEASE,
+                'cloned_release': RELEASE,
+                'jail_zfs_dataset': f'iocage/jails/{name}/data',
+                'boot': 1 if i >= jails - boot else 0,
+                'priority': i % 99 + 1,
+                'vnet': 0,
+                'ip4_addr': f'em0|10.{i // 65536 % 256}.{i // 256 % 256}.'
+                            f'{i % 256 + 1}/8',
+                'basejail': 0,
+                'type': 'jail',
+                'notes': 'benchmark',
+            }
+            with open(
+                os.path.join(self.iocroot, 'jails', name, 'config.json'), 'w'
+            ) as f:
+                json.dump(config, f, indent=4, sort_keys=True)
+
+            if i < running:
+                running_jails[f'ioc-{name}'] = {'jid': i + 1, 'path': root}
+
+        with open(self.state_path, 'w') as f:
+            json.dump({
+                'pools': {POOL: {
+                    'health': 'ONLINE', 'guid': '1', 'size': 2 ** 40,
+                    'allocated': 2 ** 39, 'free': 2 ** 39, 'comment': '-',
+                }},
+                'datasets': datasets,
+                'snapshots': snaps,
+                'jails': running_jails,
+                'last_jid': running,
+            }, f)
+        self.reset_commands()
+
+    def reset_commands(self):
+        open(self.log_path, 'w').close()
+
+    def commands(self, reset=True):
+        """Returns a Counter of the commands run since the last reset."""
+        with open(self.log_path) as f:
+            calls = [json.loads(line) for line in f if line.strip()]
+        if reset:
+            self.reset_commands()
+        return collections.Counter(c[0] for c in calls)
+
+    def command_lines(self):
+        with open(self.log_path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+@contextlib.contextmanager
+def emulate(host):
+    """
+    Makes this process believe it runs on host: os.uname() reports
+    FreeBSD and every tool in TOOLS resolves to its stand-in, also when
+    called by absolute path or with a PATH of its own.
+
+    Yields the list of every command this process runs meanwhile, stand-in
+    or not.
+    """
+    calls = []
+    popen_init = subprocess.Popen.__init__
+    setlocale = locale.setlocale
+
+    def init(self, args, *pargs, **kwargs):
+        if isinstance(args, (list, tuple)) and args:
+            args = [str(a) for a in args]
+            calls.append(args)
+            tool = os.path.basename(args[0])
+            if tool in TOOLS:
+                args = [os.path.join(host.bin, tool), *args[1:]]
+        else:
+            calls.append([str(args)])
+        popen_init(self, args, *pargs, **kwargs)
+
+    def fallback_setlocale(category, name=None):
+        try:
+            return setlocale(category, name)
+        except locale.Error:
+            # Linux boxes often lack en_US.UTF-8, which FreeBSD always has
+            return setlocale(category, 'C.UTF-8')
+
+    import iocage_lib.ioc_fstab
+
+    with contextlib.ExitStack() as stack:
+        def patch(target, attr, new):
+            stack.enter_context(mock.patch.object(target, attr, new))
+
+        patch(subprocess.Popen, '__init__', init)
+        patch(os, 'uname', lambda: os.uname_result((
+            'FreeBSD', 'fakehost', RELEASE, f'FreeBSD {RELEASE} GENERIC',
+            'amd64'
+        )))
+        patch(locale, 'setlocale', fallback_setlocale)
+        if not hasattr(iocage_lib.ioc_fstab.LIBC, 'setfstab'):
+            patch(
+                iocage_lib.ioc_fstab, 'LIBC',
+                FstabLibc(iocage_lib.ioc_fstab.LIBC)
+            )
+        yield calls
+
+
+class FstabLibc:
+
+    """
+    The fstab(5) and vis(3) functions of FreeBSD's libc glibc lacks, enough
+    for the empty fstabs FakeHost generates.
+    """
+
+    def __init__(self, libc):
+        self.libc = libc
+        self.path = None
+
+    def __getattr__(self, attr):
+        return getattr(self.libc, attr)
+
+    def setfstab(self, path):
+        self.path = path
+        return 1
+
+    def getfstab(self):
+        return self.path
+
+    def getfsent(self):
+        return None
+
+    def endfsent(self):
+        pass
+
+    @staticmethod
+    def strvis(dst, src, flags):
+        dst.value = src
+        return len(src)
+
+    strunvis = strvis
+
+
+def main(argv):
+    # Benchmark the checkout this script is part of
+    sys.path.insert(0, os.path.dirname(os.path.dirname(FAKEBIN)))
+    from iocage_cli import cli
+
+    # iocage looks at sys.argv itself
+    sys.argv = ['iocage', *argv[1:]]
+    with emulate(FakeHost(argv[0])):
+        cli(prog_name='iocage')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,90 @@
+"""
+Measures validating plugin manifests against the manifest schema.
+
+Compares building a validator from the schema for every manifest, which is
+what starting a pluginv2 jail used to do, with the validator compiled once
+per process. Every manifest is validated after a cache reset, the way each
+start of a jail during boot would see it.
+
+    python benchmarks/plugin_manifests.py --manifests 100 1000
+"""
+import argparse
+import json
+import os
+import time
+
+import jsonschema
+
+from iocage_lib.cache import cache
+from iocage_lib.ioc_common import validate_plugin_manifests
+
+SCHEMA_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+    'iocage_lib', 'plugin_manifest.json'
+)
+
+
+def manifest(i):
+    return {
+        'name': f'plugin{i}',
+        'release': '13.2-RELEASE',
+        'pkgs': [f'pkg{i}', 'ca_root_nss', 'python39'],
+        'packagesite': 'http://pkg.FreeBSD.org/${ABI}/latest',
+        'fingerprints': {
+            'iocage-plugins': [{'function': 'sha256', 'fingerprint': 'a' * 64}]
+        },
+        'artifact': f'https://github.com/ix-plugin-hub/plugin{i}.git',
+        'properties': {'nat': 1},
+        'devfs_ruleset': {'paths': {'bpf*': None}, 'includes': []},
+    }
+
+
+def per_manifest(manifests):
+    for m in manifests:
+        cache.reset()
+        with open(SCHEMA_PATH, 'r') as f:
+            schema = json.load(f)
+        list(jsonschema.Draft7Validator(schema).iter_errors(m))
+
+
+def compiled(manifests):
+    for m in manifests:
+        cache.reset()
+        validate_plugin_manifests({m['name']: m})
+
+
+def batch(manifests):
+    validate_plugin_manifests({m['name']: m for m in manifests})
+
+
+def timed(func, manifests, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.monotonic()
+        func(manifests)
+        elapsed = time.monotonic() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--manifests', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{"manifests":>10}{"per manifest ms":>18}{"compiled ms":>14}{"batch ms":>11}')
+    for count in args.manifests:
+        manifests = [manifest(i) for i in range(count)]
+        results = [
+            timed(func, manifests, args.repeat) * 1000
+            for func in (per_manifest, compiled, batch)
+        ]
+        print(f'{count:>10}' + ''.join(
+            f'{r:>{w}.1f}' for r, w in zip(results, (18, 14, 11))
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""
+Measures how iocage commands scale with the number of jails.
+
+Every jail count gets a synthetic host (see fakehost.py) with that many
+jails, a number of snapshots per jail and some of the jails running. Each
+command runs against it a few times, recording the median wall time, the
+peak RSS of the iocage process and the external commands it ran. Results
+can be saved and compared against a run on another commit.
+
+    python benchmarks/scale.py --jails 10 100 1000 --output before.json
+    git checkout my-branch
+    python benchmarks/scale.py --jails 10 100 1000 --compare before.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from fakehost import FakeHost
+
+RESULTS_VERSION = 1
+# name: (arguments, arguments restoring the host afterwards)
+COMMANDS = {
+    'list': (['list'], None),
+    'list -l': (['list', '-l'], None),
+    'get all -r': (['get', '-r', 'all'], None),
+    'df': (['df'], None),
+    'snaplist': (['snaplist', '{jail}'], None),
+    'start': (['start', '{stopped}'], ['stop', '{stopped}']),
+    'stop': (['stop', '{running}'], ['start', '{running}']),
+    'start --rc': (['start', '--rc'], ['stop', '--rc']),
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, cwd=os.path.dirname(__file__),
+            check=True
+        ).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(host, args):
+    """Returns (returncode, seconds, peak RSS in KiB, stderr) of iocage."""
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        proc = subprocess.Popen(
+            host.iocage(*args), env=host.env(), stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL, stderr=stderr
+        )
+        # wait4 gives the resource usage of this one child
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - start
+        proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) \
+            else -os.WTERMSIG(status)
+
+        stderr.seek(0)
+        return proc.returncode, elapsed, usage.ru_maxrss, stderr.read()
+
+
+def measure(host, name, args, restore, repeat):
+    times, rss = [], []
+    for _ in range(repeat):
+        host.reset_commands()
+        rc, elapsed, maxrss, stderr = run(host, args)
+        commands = host.commands()
+        if rc:
+            return {
+                'command': name, 'error': stderr.decode(errors='replace')
+                .strip().splitlines()[-1:],
+            }
+        times.append(elapsed)
+        rss.append(maxrss)
+        if restore:
+            run(host, restore)
+
+    return {
+        'command': name,
+        'wall': statistics.median(times),
+        'wall_min': min(times),
+        'rss_kib': max(rss),
+        'commands': dict(sorted(commands.items())),
+        'total_commands': sum(commands.values()),
+    }
+
+
+def benchmark(args):
+    root = args.workdir or tempfile.mkdtemp(prefix='iocage-bench-')
+    results = []
+    try:
+        for jails in args.jails:
+            host = FakeHost(os.path.join(root, str(jails)))
+            running = max(1, int(jails * args.running))
+            host.generate(
+                jails, snapshots=args.snapshots, running=running,
+                boot=min(args.boot, jails)
+            )
+            # Creating defaults.json, the jail catalog and the dataset check
+            # stamp only happens once per host.
+            run(host, ['list'])
+
+            names = {
+                'jail': host.jail_name(0),
+                'running': host.jail_name(0),
+                'stopped': host.jail_name(jails - 1),
+            }
+            for name in args.commands:
+                command, restore = COMMANDS[name]
+                result = measure(
+                    host, name, [a.format(**names) for a in command],
+                    restore and [a.format(**names) for a in restore],
+                    args.repeat
+                )
+                result.update(jails=jails, snapshots=args.snapshots)
+                results.append(result)
+                report(result)
+
+            if not args.workdir:
+                shutil.rmtree(host.root)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(root, ignore_errors=True)
+
+    return results
+
+
+def report(result, baseline=None):
+    label = f'{result["jails"]:>6} {result["command"]:<12}'
+    if 'error' in result:
+        print(f'{label} FAILED {" ".join(result["error"])}')
+        return
+
+    line = (
+        f'{label}{result["wall"]:>9.3f}s{result["rss_kib"] / 1024:>9.1f}M'
+        f'{result["total_commands"]:>8}  '
+        + ' '.join(f'{k}={v}' for k, v in result['commands'].items())
+    )
+    if baseline and 'error' not in baseline:
+        line += (
+            f'\n{"":<19}{result["wall"] / baseline["wall"]:>9.2f}x'
+            f'{(result["rss_kib"] - baseline["rss_kib"]) / 1024:>+9.1f}M'
+            f'{result["total_commands"] - baseline["total_commands"]:>+8}'
+        )
+    print(line, flush=True)
+
+
+def compare(results, path):
+    with open(path) as f:
+        baseline = {
+            (r['jails'], r['command']): r for r in json.load(f)['results']
+        }
+
+    print(f'\nCompared to {path}:')
+    for result in results:
+        report(result, baseline.get((result['jails'], result['command'])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        '--jails', type=int, nargs='+', default=[10, 100, 1000, 5000]
+    )
+    parser.add_argument(
+        '--snapshots', type=int, default=2, help='Snapshots per jail'
+    )
+    parser.add_argument(
+        '--running', type=float, default=0.1,
+        help='Fraction of the jails which are running'
+    )
+    parser.add_argument(
+        '--boot', type=int, default=10,
+        help='Stopped jails started by start --rc'
+    )
+    parser.add_argument(
+        '--commands', nargs='+', default=list(COMMANDS),
+        choices=list(COMMANDS)
+    )
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument(
+        '--workdir', help='Keep the generated hosts in this directory'
+    )
+    parser.add_argument('--output', help='Save the results as JSON')
+    parser.add_argument('--compare', help='Results of an earlier run')
+    args = parser.parse_args()
+
+    print(
+        f'{"jails":>6} {"command":<12}{"wall":>10}{"rss":>10}{"execs":>8}'
+        '  external commands'
+    )
+    results = benchmark(args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'version': RESULTS_VERSION,
+                'commit': git_commit(),
+                'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'args': {
+                    k: v for k, v in vars(args).items()
+                    if k not in ('output', 'compare', 'workdir')
+                },
+                'results': results,
+            }, f, indent=4)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
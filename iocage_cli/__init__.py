@@ -34,33 +34,49 @@ import subprocess as su
 import sys
 
 import click
-import coloredlogs
-import iocage_lib.ioc_check as ioc_check
 # This prevents it from getting in our way.
 from click import core
-from iocage_lib.ioc_common import set_interactive
+
+# Everything iocage_lib needs is only imported once a command runs, so
+# --help and shell completion stay fast.
 
 core._verify_python3_env = lambda: None
-locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
 
-sys.stdout = open(sys.stdout.fileno(), mode='w', encoding='utf8', buffering=1)
-sys.stderr = open(sys.stderr.fileno(), mode='w', encoding='utf8', buffering=1)
-set_interactive(True)
 
-# @formatter:off
-# Sometimes SIGINT won't be installed.
-# http://stackoverflow.com/questions/40775054/capturing-sigint-using-keyboardinterrupt-exception-works-in-terminal-not-in-scr/40785230#40785230
-signal.signal(signal.SIGINT, signal.default_int_handler)
-# If a utility decides to cut off the pipe, we don't care (IE: head)
-signal.signal(signal.SIGPIPE, signal.SIG_DFL)
-# @formatter:on
+def setup_console():
+    """Prepares the process for running a command."""
+    from iocage_lib.ioc_common import set_interactive
+
+    locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+
+    sys.stdout = open(
+        sys.stdout.fileno(), mode='w', encoding='utf8', buffering=1
+    )
+    sys.stderr = open(
+        sys.stderr.fileno(), mode='w', encoding='utf8', buffering=1
+    )
+    set_interactive(True)
+
+    # @formatter:off
+    # Sometimes SIGINT won't be installed.
+    # http://stackoverflow.com/questions/40775054/capturing-sigint-using-keyboardinterrupt-exception-works-in-terminal-not-in-scr/40785230#40785230
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    # If a utility decides to cut off the pipe, we don't care (IE: head)
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+    # @formatter:on
 
-try:
-    su.check_call(
-        ["sysctl", "vfs.zfs.version.spa"], stdout=su.PIPE, stderr=su.PIPE)
-except su.CalledProcessError:
-    sys.exit("ZFS is required to use iocage.\n"
-             "Try calling 'kldload zfs' as root.")
+
+def check_zfs():
+    # zfs.ko creates /dev/zfs, which saves running sysctl every time
+    if os.path.exists('/dev/zfs'):
+        return
+
+    try:
+        su.check_call(
+            ["sysctl", "vfs.zfs.version.spa"], stdout=su.PIPE, stderr=su.PIPE)
+    except (su.CalledProcessError, FileNotFoundError):
+        sys.exit("ZFS is required to use iocage.\n"
+                 "Try calling 'kldload zfs' as root.")
 
 
 def print_version(ctx, param, value):
@@ -68,7 +84,8 @@ def print_version(ctx, param, value):
 
     if not value or ctx.resilient_parsing:
         return
-    print("Version\t1.2")
+    import iocage_lib
+    print(f"Version\t{iocage_lib.__version__}")
     sys.exit()
 
 
@@ -147,6 +164,8 @@ class IOCLogger(object):
         if os.geteuid() == 0:
             logging.config.dictConfig(default_logging)
 
+        import coloredlogs
+
         handler = InfoHandler()
         handler.setFormatter(coloredlogs.ColoredFormatter(
             fmt="%(message)s",
@@ -159,6 +178,9 @@ class IOCLogger(object):
 
 
 cmd_folder = os.path.abspath(os.path.dirname(__file__))
+# iocaged answers these, everything else may change state it caches
+DAEMON_CMDS = ('get', 'list')
+READ_ONLY_CMDS = DAEMON_CMDS + ('df', 'snaplist', 'debug', 'metrics', 'top')
 
 
 class IOCageCLI(click.MultiCommand):
@@ -219,6 +241,11 @@ class IOCageCLI(click.MultiCommand):
     help="Log debug output to the console.")
 def cli(version, force, debug):
     """A jail manager."""
+    import iocage_lib.daemon as daemon
+    import iocage_lib.ioc_check as ioc_check
+
+    check_zfs()
+    setup_console()
     os.environ['IOCAGE_DEBUG'] = 'FALSE'
     logger = IOCLogger()
 
@@ -255,6 +282,18 @@ def cli(version, force, debug):
                 os.environ["IOCAGE_SKIP"] = "TRUE"
                 ioc_check.IOCCheck(silent=True)
 
+        ctx = click.get_current_context()
+        if ctx.invoked_subcommand == "check":
+            # It runs the check itself
+            skip_check = True
+
+        client = daemon.Client()
+        if ctx.invoked_subcommand in DAEMON_CMDS and not skip_check:
+            # It checked the datasets when it started
+            skip_check = client.available()
+        elif ctx.invoked_subcommand not in READ_ONLY_CMDS:
+            ctx.call_on_close(client.invalidate)
+
         if not skip_check:
             ioc_check.IOCCheck()
     except RuntimeError as err:
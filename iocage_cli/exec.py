@@ -22,6 +22,8 @@
 # IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 """exec module for the cli."""
+import threading
+
 import click
 import iocage_lib.ioc_common as ioc_common
 import iocage_lib.iocage as ioc
@@ -29,6 +31,71 @@ import iocage_lib.iocage as ioc
 __rootcmd__ = True
 
 
+def parse_filters(filters):
+    props = {}
+    for _filter in filters:
+        prop, sep, value = _filter.partition('=')
+        if not sep or not prop:
+            ioc_common.logit({
+                'level': 'EXCEPTION',
+                'message': f'Invalid filter: {_filter}, use property=value'
+            })
+        props[prop] = value
+    return props
+
+
+def exec_parallel(command, jail, host_user, jail_user, force, jobs, filters,
+                  output):
+    lock = threading.Lock()
+
+    def on_output(uuid, stream, line):
+        with lock:
+            click.echo(
+                f'{uuid}: {line.decode(errors="replace")}',
+                err=stream == 'stderr'
+            )
+
+    def on_result(result):
+        with lock:
+            if output == 'grouped':
+                click.echo(
+                    f'==> {result["jail"]} (rc: {result["rc"]}, '
+                    f'{result["duration"]:.1f}s) <=='
+                )
+                for stream in ('stdout', 'stderr'):
+                    text = result[stream].decode(errors='replace')
+                    if text:
+                        click.echo(
+                            text, err=stream == 'stderr',
+                            nl=not text.endswith('\n')
+                        )
+            if result['error']:
+                click.echo(f'{result["jail"]}: {result["error"]}', err=True)
+
+    results = ioc.IOCage(jail=jail).exec_many(
+        command, host_user, jail_user, start_jail=force, jobs=jobs or 1,
+        filters=filters,
+        # Interleaved output is printed as it arrives, nothing to keep
+        max_output=0 if output == 'interleaved' else None,
+        on_output=on_output if output == 'interleaved' else None,
+        on_result=on_result
+    )
+
+    failed = [r['jail'] for r in results if r['rc'] != 0]
+    if not results:
+        ioc_common.logit({
+            'level': 'EXCEPTION',
+            'message': 'No jails match the given filters!'
+        })
+    elif failed:
+        ioc_common.logit({
+            'level': 'ERROR',
+            'message': f'Command failed in {len(failed)} of {len(results)} '
+                       f'jails: {", ".join(failed)}'
+        })
+        exit(1)
+
+
 @click.command(
     context_settings=dict(ignore_unknown_options=True, ),
     name="exec",
@@ -40,7 +107,17 @@ __rootcmd__ = True
 @click.argument("command", nargs=-1, type=click.UNPROCESSED)
 @click.option('--force', '-f', default=False, is_flag=True,
               help='Start the jail if it\'s not running.')
-def cli(command, jail, host_user, jail_user, force):
+@click.option('--jobs', '-j', type=click.IntRange(1),
+              help='Run the command in this many jails at once.')
+@click.option('--filter', '-F', 'filters', multiple=True,
+              help='Only run in jails whose property matches, as'
+                   ' property=value. Can be given multiple times.')
+@click.option('--output', '-o',
+              type=click.Choice(['interleaved', 'grouped']),
+              help='Print lines as they arrive prefixed with the jail, or'
+                   ' all output of a jail once it is done. Interleaved'
+                   ' by default.')
+def cli(command, jail, host_user, jail_user, force, jobs, filters, output):
     """Runs the command given inside the specified jail as the supplied
     user."""
     # We may be getting ';', '&&' and so forth. Adding the shell for safety.
@@ -60,6 +137,13 @@ def cli(command, jail, host_user, jail_user, force):
     # unsetting the convenience default
     host_user = "" if jail_user and host_user == "root" else host_user
 
+    if jobs or filters or output:
+        exec_parallel(
+            command, jail, host_user, jail_user, force, jobs,
+            parse_filters(filters), output or 'interleaved'
+        )
+        return
+
     try:
         ioc.IOCage(jail=jail).exec(
             command,
@@ -24,19 +24,72 @@
 """export module for the cli."""
 import click
 
+import iocage_lib.ioc_common as ioc_common
 import iocage_lib.iocage as ioc
 
+from iocage_lib.archive import EXTENSIONS
+
 __rootcmd__ = True
 
 
 @click.command(name="export", help="Exports a specified jail.")
+@click.option(
+    '--bundle', '-b', default=None, metavar='NAME',
+    help='Export all the jails given into one image called NAME, sending '
+         'what they were cloned from only once.'
+)
 @click.option(
     '--compression', '-c',
     default='zip',
+    type=click.Choice(list(EXTENSIONS)),
     help='Choose which compression algorithm to '
-         'use for exporting jail (zip/lzma).'
+         'use for exporting jail (zip/lzma/gzip/zstd).'
+)
+@click.option(
+    '--threads', '-T',
+    default=None, type=click.IntRange(1),
+    help='Number of threads compressing lzma/gzip/zstd exports, defaults '
+         'to the number of CPUs.'
+)
+@click.option(
+    '--incremental-from', '-i', 'incremental_from', default=None,
+    metavar='SNAPSHOT',
+    help='Only export changes made since SNAPSHOT, usually the snapshot of '
+         'an earlier export.'
+)
+@click.option(
+    '--intermediate', '-I', is_flag=True, default=False,
+    help='Include the snapshots taken between --incremental-from and now.'
 )
-@click.argument("jail", required=True)
-def cli(compression, jail):
+@click.option(
+    '--keep-snapshot', '-k', is_flag=True, default=False,
+    help='Keep the export snapshot so later exports can be incremental '
+         'from it, always done for incremental exports.'
+)
+@click.argument("jails", nargs=-1, required=True)
+def cli(
+    bundle, compression, threads, incremental_from, intermediate,
+    keep_snapshot, jails
+):
     """Make a recursive snapshot of the jail and export to a file."""
-    ioc.IOCage(jail=jail).export(compression)
+    if bundle:
+        if incremental_from or keep_snapshot:
+            ioc_common.logit({
+                'level': 'EXCEPTION',
+                'message': '--bundle can not be combined with '
+                           '--incremental-from or --keep-snapshot.'
+            })
+        ioc.IOCage().export_bundle(
+            jails, bundle, compression, threads=threads
+        )
+        return
+    elif len(jails) > 1:
+        ioc_common.logit({
+            'level': 'EXCEPTION',
+            'message': 'Exporting several jails requires --bundle.'
+        })
+
+    ioc.IOCage(jail=jails[0]).export(
+        compression, threads=threads, incremental_from=incremental_from,
+        intermediate=intermediate, keep_snapshot=keep_snapshot
+    )
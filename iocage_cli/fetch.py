@@ -150,6 +150,23 @@ def validate_count(ctx, param, value):
     '--proxy', '-S', default=None,
     help='Provide proxy to use for creating jail'
 )
+@click.option(
+    '--jobs', '-j', default=4, type=click.IntRange(1),
+    help='Number of release files to download concurrently.'
+)
+@click.option(
+    '--segments', default=1, type=click.IntRange(1),
+    help='Split large release files into this many parallel ranged'
+         ' downloads.'
+)
+@click.option(
+    '--stream', default=False, is_flag=True,
+    help='Extract release files while they download.'
+)
+@click.option(
+    '--refresh', default=False, is_flag=True,
+    help='Sync the plugin repository even if it was synced recently.'
+)
 def cli(**kwargs):
     """CLI command that calls fetch_release()"""
     release = kwargs.get("release", None)
@@ -25,8 +25,8 @@
 import click
 import texttable
 
+import iocage_lib.daemon as daemon
 import iocage_lib.ioc_common as ioc_common
-import iocage_lib.iocage as ioc
 
 
 @click.command(context_settings=dict(
@@ -58,6 +58,8 @@ import iocage_lib.iocage as ioc
 )
 def cli(prop, _type, _pool, jail, recursive, header, plugin, force):
     """Get a list of jails and print the property."""
+    # Everything below is answered by iocaged when it runs, but plugin
+    # properties which may need to start the jail.
     table = texttable.Texttable(max_width=0)
 
     if _type:
@@ -65,7 +67,7 @@ def cli(prop, _type, _pool, jail, recursive, header, plugin, force):
         jail = prop
         prop = _type
     elif _pool:
-        pool = ioc.IOCage(skip_jails=True).get('', pool=True)
+        pool = daemon.IOCage(skip_jails=True).get('', pool=True)
         ioc_common.logit({
             'level': 'INFO',
             'message': pool
@@ -94,21 +96,21 @@ def cli(prop, _type, _pool, jail, recursive, header, plugin, force):
 
     if not recursive:
         if prop == 'state' or _type == 'state':
-            state = ioc.IOCage(jail=jail).get(prop)
+            state = daemon.IOCage(jail=jail).get(prop)
 
             ioc_common.logit({
                 'level': 'INFO',
                 'message': state
             })
         elif prop == 'jid' or _type == 'jid':
-            jid = ioc.IOCage(jail=jail).list('jid', uuid=jail)[1]
+            jid = daemon.IOCage(jail=jail).list('jid', uuid=jail)[1]
 
             ioc_common.logit({
                 'level': 'INFO',
                 'message': jid
             })
         elif plugin:
-            _plugin = ioc.IOCage(jail=jail, skip_jails=True).get(
+            _plugin = daemon.IOCage(jail=jail, skip_jails=True).get(
                 prop, plugin=True, start_jail=force
             )
 
@@ -117,7 +119,7 @@ def cli(prop, _type, _pool, jail, recursive, header, plugin, force):
                 'message': _plugin
             })
         elif prop == 'all':
-            props = ioc.IOCage(jail=jail, skip_jails=True).get(prop)
+            props = daemon.IOCage(jail=jail, skip_jails=True).get(prop)
 
             for p, v in props.items():
                 ioc_common.logit({
@@ -125,14 +127,14 @@ def cli(prop, _type, _pool, jail, recursive, header, plugin, force):
                     'message': f'{p}:{v}'
                 })
         else:
-            p = ioc.IOCage(jail=jail, skip_jails=True).get(prop)
+            p = daemon.IOCage(jail=jail, skip_jails=True).get(prop)
 
             ioc_common.logit({
                 'level': 'INFO',
                 'message': p
             })
     else:
-        jails = ioc.IOCage().get(prop, recursive=True)
+        jails = daemon.IOCage().get(prop, recursive=True)
         table.header(['NAME', f'PROP - {prop}'])
 
         for jail_dict in jails:
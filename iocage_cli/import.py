@@ -26,6 +26,8 @@ import click
 
 import iocage_lib.iocage as ioc
 
+from iocage_lib.archive import EXTENSIONS
+
 __rootcmd__ = True
 
 
@@ -33,8 +35,9 @@ __rootcmd__ = True
 @click.option(
     '--compression', '-c',
     default=None,
+    type=click.Choice(list(EXTENSIONS)),
     help='Choose which compression algorithm to '
-         'use for exporting jail (zip/lzma).'
+         'use for exporting jail (zip/lzma/gzip/zstd).'
 )
 @click.option(
     '--path', '-p',
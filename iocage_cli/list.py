@@ -23,6 +23,7 @@
 # POSSIBILITY OF SUCH DAMAGE.
 """list module for the cli."""
 import click
+import iocage_lib.daemon as daemon
 import iocage_lib.ioc_common as ioc_common
 import iocage_lib.iocage as ioc
 
@@ -51,16 +52,21 @@ import iocage_lib.iocage as ioc
               help="Lists all jails with less processing and fields.")
 @click.option("--official", "-O", is_flag=True, default=False,
               help="Lists only official plugins.")
+@click.option("--refresh", is_flag=True, default=False,
+              help="Sync the plugin repository for --plugins --remote even"
+                   " if it was synced recently.")
 def cli(dataset_type, header, _long, remote, http, plugins, _sort, quick,
-        official):
+        official, refresh):
     """This passes the arg and calls the jail_datasets function."""
-    freebsd_version = ioc_common.checkoutput(["freebsd-version"])
-    iocage = ioc.IOCage(skip_jails=True)
-
     if dataset_type is None:
         dataset_type = "all"
 
+    if remote:
+        iocage = ioc.IOCage(skip_jails=True)
+
     if remote and not plugins:
+        freebsd_version = ioc_common.checkoutput(["freebsd-version"])
+
         if "HBSD" in freebsd_version:
             hardened = True
         else:
@@ -77,9 +83,11 @@ def cli(dataset_type, header, _long, remote, http, plugins, _sort, quick,
             header=header,
             _long=_long,
             plugins=True,
-            official=official)
+            official=official,
+            refresh=refresh)
     elif not remote:
-        _list = iocage.list(
+        # Answered by iocaged when it runs
+        _list = daemon.IOCage(skip_jails=True).list(
             dataset_type, header, _long, _sort, plugin=plugins, quick=quick)
 
     if not header:
@@ -0,0 +1,94 @@
+# Copyright (c) 2014-2019, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""metrics module for the cli."""
+import click
+
+import iocage_lib.ioc_common as ioc_common
+import iocage_lib.metrics as ioc_metrics
+
+
+@click.group(name="metrics", help="Export jail metrics for Prometheus.")
+def cli():
+    """Publishes jail state and resource usage as Prometheus metrics."""
+    pass
+
+
+@cli.command(name="serve", help="Serve the metrics over HTTP.")
+@click.option(
+    "--address",
+    "-a",
+    default=ioc_metrics.DEFAULT_ADDRESS,
+    show_default=True,
+    help="Address to listen on.")
+@click.option(
+    "--port",
+    "-p",
+    type=int,
+    default=ioc_metrics.DEFAULT_PORT,
+    show_default=True,
+    help="Port to listen on.")
+@click.option(
+    "--interval",
+    "-i",
+    type=int,
+    default=ioc_metrics.DEFAULT_INTERVAL,
+    show_default=True,
+    help="Seconds scrapes are answered from the last collection.")
+def serve(address, port, interval):
+    """Serves /metrics until interrupted."""
+    collector = ioc_metrics.Collector(interval)
+    try:
+        server = ioc_metrics.server(collector, address, port)
+    except OSError as err:
+        ioc_common.logit({
+            "level": "EXCEPTION",
+            "message": f"Could not listen on {address}:{port}: {err}"
+        })
+
+    ioc_common.logit({
+        "level": "INFO",
+        "message": f"Serving metrics on http://{address}:{port}/metrics"
+    })
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+@cli.command(name="textfile", help="Write the metrics to a file.")
+@click.argument("path")
+def textfile(path):
+    """
+    Writes the metrics for node_exporter's textfile collector, meant to be
+    run from cron.
+    """
+    try:
+        ioc_metrics.Collector().write_textfile(path)
+    except OSError as err:
+        ioc_common.logit({
+            "level": "EXCEPTION",
+            "message": f"Could not write {path}: {err}"
+        })
@@ -0,0 +1,95 @@
+# Copyright (c) 2014-2019, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""top module for the cli."""
+import json
+import sys
+import time
+
+import click
+import texttable
+
+import iocage_lib.ioc_common as ioc_common
+import iocage_lib.top as ioc_top
+
+__rootcmd__ = True
+
+
+@click.command(name="top", help="Show live resource usage of running jails.")
+@click.option(
+    "--delay",
+    "-d",
+    type=float,
+    default=2,
+    show_default=True,
+    help="Seconds between refreshes.")
+@click.option(
+    "--sort",
+    "-s",
+    "_sort",
+    default="pcpu",
+    show_default=True,
+    type=click.Choice(list(ioc_top.COLUMNS)),
+    help="Column to sort by.")
+@click.option(
+    "--once",
+    "-o",
+    is_flag=True,
+    default=False,
+    help="Print a single refresh and exit.")
+@click.option(
+    "--json",
+    "-j",
+    "_json",
+    is_flag=True,
+    default=False,
+    help="Print each refresh as JSON.")
+def cli(delay, _sort, once, _json):
+    """
+    Samples the RACCT usage of every running jail each delay seconds. With
+    --once it samples twice, so CPU% is known, and exits.
+    """
+    top = ioc_top.JailTop()
+    top.sample()
+    clear = sys.stdout.isatty() and not once and not _json
+
+    try:
+        while True:
+            time.sleep(delay)
+            rows = top.sort(top.sample(), _sort)
+
+            if _json:
+                print(json.dumps(rows), flush=True)
+            else:
+                table = texttable.Texttable(max_width=0)
+                table.set_deco(texttable.Texttable.HEADER)
+                table.set_cols_dtype(["t"] * len(ioc_top.COLUMNS))
+                table.add_rows(top.table(rows))
+                if clear:
+                    click.clear()
+                ioc_common.logit({"level": "INFO", "message": table.draw()})
+
+            if once:
+                break
+    except KeyboardInterrupt:
+        pass
@@ -22,7 +22,10 @@
 # IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 """update module for the cli."""
+import threading
+
 import click
+import iocage_lib.ioc_common as ioc_common
 import iocage_lib.iocage as ioc
 
 __rootcmd__ = True
@@ -38,8 +41,65 @@ __rootcmd__ = True
     help='Decide whether or not to update the pkg repositories and '
          'all installed packages in jail( this has no effect for plugins ).'
 )
+@click.option(
+    '--plugins', default=False, is_flag=True,
+    help='Only update the plugins of the plugin jails given, several at'
+         ' once. The jails themselves are not updated.'
+)
+@click.option(
+    '--jobs', '-j', default=4, type=click.IntRange(1),
+    help='Update this many plugins at once with --plugins.'
+)
 @click.argument('jail', required=True)
-def cli(jail, pkgs):
+def cli(jail, pkgs, plugins, jobs):
     """Update the supplied jail to the latest patchset"""
     skip_jails = bool(jail != 'ALL')
+    if plugins:
+        update_plugins(jail, skip_jails, jobs)
+        return
+
     ioc.IOCage(jail=jail, skip_jails=skip_jails).update(pkgs=pkgs)
+
+
+def update_plugins(jail, skip_jails, jobs, upgrade=False):
+    action = 'upgrade' if upgrade else 'update'
+    lock = threading.Lock()
+
+    def on_result(result):
+        with lock:
+            if result['ok']:
+                click.echo(
+                    f'{result["jail"]}: {result["plugin"]} {action}d '
+                    f'({result["duration"]:.1f}s)'
+                )
+            else:
+                rolled_back = ', rolled back' if result['rolled_back'] else ''
+                click.echo(
+                    f'{result["jail"]}: {result["plugin"]} {action} failed'
+                    f'{rolled_back} ({result["duration"]:.1f}s): '
+                    f'{result["error"]}', err=True
+                )
+
+    results = ioc.IOCage(jail=jail, skip_jails=skip_jails).update_plugins(
+        jobs=jobs, upgrade=upgrade, on_result=on_result
+    )
+
+    failed = [r['jail'] for r in results if not r['ok']]
+    if not results:
+        ioc_common.logit({
+            'level': 'EXCEPTION',
+            'message': f'No plugin jails to {action}!'
+        })
+    elif failed:
+        ioc_common.logit({
+            'level': 'ERROR',
+            'message': f'Plugin {action} failed in {len(failed)} of '
+                       f'{len(results)} jails: {", ".join(failed)}'
+        })
+        exit(1)
+    else:
+        ioc_common.logit({
+            'level': 'INFO',
+            'message': f'{action.capitalize()}d the plugins of all '
+                       f'{len(results)} jails successfully.'
+        })
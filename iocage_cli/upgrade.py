@@ -25,6 +25,8 @@
 import click
 import iocage_lib.iocage as ioc
 
+from iocage_cli.update import update_plugins
+
 __rootcmd__ = True
 
 
@@ -34,7 +36,20 @@ __rootcmd__ = True
     " jail to the RELEASE given.")
 @click.argument("jail", required=True)
 @click.option("--release", "-r", required=False, help="RELEASE to upgrade to")
-def cli(jail, release):
+@click.option(
+    '--plugins', default=False, is_flag=True,
+    help='Only upgrade the plugins of the plugin jails given to the RELEASE'
+         ' of their manifest, several at once.'
+)
+@click.option(
+    '--jobs', '-j', default=4, type=click.IntRange(1),
+    help='Upgrade this many plugins at once with --plugins.'
+)
+def cli(jail, release, plugins, jobs):
     """Runs upgrade with the command given inside the specified jail."""
     skip_jails = bool(jail != 'ALL')
+    if plugins:
+        update_plugins(jail, skip_jails, jobs, upgrade=True)
+        return
+
     ioc.IOCage(jail=jail, skip_jails=skip_jails).upgrade(release)
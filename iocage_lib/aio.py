@@ -0,0 +1,283 @@
+import asyncio
+import json
+import os
+import time
+
+import iocage_lib.ioc_exec
+import iocage_lib.ioc_json
+import iocage_lib.iocage
+
+from iocage_lib.catalog import JailCatalog
+from iocage_lib.ioc_exec import OutputBuffer
+
+
+DEFAULT_CONCURRENCY = 64
+# How long to keep reading once a command exited, daemons it spawned may
+# hold on to its stdout/stderr forever.
+DRAIN_TIMEOUT = 0.1
+
+
+class ExitProtocol(asyncio.subprocess.SubprocessStreamProtocol):
+
+    """
+    Stream protocol which also tells when the process exited. Process.wait()
+    only returns once the pipes are closed as well, which never happens for
+    commands leaving a daemon behind.
+    """
+
+    def __init__(self, limit, loop):
+        super().__init__(limit=limit, loop=loop)
+        self.exited = asyncio.Event()
+
+    def process_exited(self):
+        super().process_exited()
+        self.exited.set()
+
+
+class AsyncIOCage:
+
+    """
+    Coroutine versions of listing, status queries, exec, start and stop.
+
+    One instance holds the host context (pool, iocroot, the jail catalog
+    and the configs it read) for every coroutine using it. External
+    commands run through asyncio subprocesses, at most concurrency of them
+    at a time. Concurrent status queries share a single jls call, so
+    thousands of them cost one process.
+
+    Starting and stopping jails is done by the regular IOCStart/IOCStop
+    code on the default executor, one jail at a time since both change
+    host wide state (bridges, epairs, firewall rules).
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, status_ttl=0):
+        self.concurrency = concurrency
+        self.status_ttl = status_ttl
+        self.pool = None
+        self.iocroot = None
+        self.catalog = None
+        self.configs = {}
+        self._semaphore = None
+        self._state_lock = None
+        self._jls = None
+        self._jls_time = 0
+
+    # asyncio primitives are bound to the loop running when they are made
+    @property
+    def semaphore(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    @property
+    def state_lock(self):
+        if self._state_lock is None:
+            self._state_lock = asyncio.Lock()
+        return self._state_lock
+
+    @staticmethod
+    async def run_sync(func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            None, func, *args
+        )
+
+    async def setup(self):
+        if self.catalog is None:
+            conf = await self.run_sync(iocage_lib.ioc_json.IOCJson)
+            self.pool = conf.pool
+            self.iocroot = conf.iocroot
+            self.catalog = JailCatalog(self.iocroot, self.pool)
+        return self
+
+    async def run(self, *command, env=None):
+        """Returns (returncode, stdout, stderr) of command."""
+        async with self.semaphore:
+            proc = await asyncio.create_subprocess_exec(
+                *command, stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE, env=env
+            )
+            stdout, stderr = await proc.communicate()
+
+        return proc.returncode, stdout, stderr
+
+    async def read_jls(self):
+        rc, stdout, _ = await self.run('jls', '--libxo=json', 'jid', 'name')
+        if rc:
+            return {}
+
+        jails = json.loads(stdout).get('jail-information', {}).get('jail', [])
+        self._jls_time = time.monotonic()
+        return {
+            j['name'][4:]: str(j['jid']) for j in jails
+            if j['name'].startswith('ioc-')
+        }
+
+    async def running(self):
+        """
+        Returns {jail: jid} of every running jail. Callers arriving while
+        jls runs, or within status_ttl of its last run, share its result.
+        """
+        if self._jls is None or self._jls.done() and (
+            self._jls.exception() or
+            time.monotonic() - self._jls_time > self.status_ttl
+        ):
+            self._jls = asyncio.ensure_future(self.read_jls())
+
+        return await asyncio.shield(self._jls)
+
+    def invalidate(self):
+        if self._jls is not None and self._jls.done():
+            self._jls = None
+
+    async def jid(self, jail):
+        """Returns (True, jid) if jail is running, (False, '-') otherwise."""
+        jid = (await self.running()).get(jail.replace('.', '_'))
+        return (True, jid) if jid else (False, '-')
+
+    async def list(self, location='jails'):
+        """
+        Returns the catalog entry of every jail (or template) with its jid
+        and state added, sorted by name.
+        """
+        await self.setup()
+        jails, running = await asyncio.gather(
+            self.run_sync(self.catalog.jails, location), self.running()
+        )
+
+        return [
+            {
+                **entry,
+                'jid': running.get(name.replace('.', '_')),
+                'state': 'up' if name.replace('.', '_') in running
+                else 'down',
+            } for name, entry in sorted(jails.items())
+        ]
+
+    async def path(self, jail):
+        await self.setup()
+        jails = await self.run_sync(self.catalog.jails)
+        if jail not in jails:
+            raise KeyError(f'jail {jail} not found')
+        return jails[jail]['path']
+
+    async def config(self, jail):
+        """The jail's full configuration, reread only once it changed."""
+        path = await self.path(jail)
+        mtime = JailCatalog.mtime(os.path.join(path, 'config.json'))
+        cached = self.configs.get(jail)
+        if not cached or cached[0] != mtime:
+            conf = await self.run_sync(
+                lambda: iocage_lib.ioc_json.IOCJson(
+                    path, silent=True
+                ).json_get_value('all')
+            )
+            cached = self.configs[jail] = (mtime, conf)
+
+        return cached[1]
+
+    async def exec(
+        self, jail, command, host_user='root', jail_user=None,
+        start_jail=False, max_output=None
+    ):
+        """
+        Runs command in jail and returns a dict shaped like the ones
+        IOCage.exec_many returns: jail, rc, stdout, stderr, truncated,
+        duration and error.
+        """
+        result = {
+            'jail': jail, 'rc': None, 'stdout': b'', 'stderr': b'',
+            'truncated': False, 'duration': 0.0, 'error': None,
+        }
+        started = time.monotonic()
+
+        try:
+            conf = await self.config(jail)
+            status, _ = await self.jid(jail)
+            if not status:
+                if not start_jail:
+                    result['error'] = f'{jail} is not running'
+                    return result
+                await self.start(jail)
+
+            cmd = iocage_lib.ioc_exec.jexec_command(
+                jail, conf['exec_fib'], command, host_user, jail_user
+            )
+            env = iocage_lib.ioc_exec.exec_env(
+                iocage_lib.iocage.IOCage.__exec_env__(conf['exec_clean'])
+            )
+            buffers = [OutputBuffer(max_output), OutputBuffer(max_output)]
+
+            async with self.semaphore:
+                result['rc'] = await self.communicate(cmd, env, buffers)
+
+            result['stdout'], result['stderr'] = (
+                b.getvalue() for b in buffers
+            )
+            result['truncated'] = any(b.truncated for b in buffers)
+        except Exception as e:
+            result['error'] = str(e)
+        finally:
+            result['duration'] = time.monotonic() - started
+
+        return result
+
+    @staticmethod
+    async def communicate(cmd, env, buffers):
+        loop = asyncio.get_running_loop()
+        # What create_subprocess_exec does, with a protocol that can tell
+        # when the command exited.
+        transport, protocol = await loop.subprocess_exec(
+            lambda: ExitProtocol(limit=2 ** 16, loop=loop), *cmd,
+            stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE, env=env
+        )
+
+        async def pump(stream, buffer):
+            while True:
+                data = await stream.read(2 ** 16)
+                if not data:
+                    break
+                buffer.write(data)
+
+        readers = [
+            asyncio.ensure_future(pump(stream, buffer)) for stream, buffer in
+            zip((protocol.stdout, protocol.stderr), buffers)
+        ]
+        try:
+            await protocol.exited.wait()
+            await asyncio.wait(readers, timeout=DRAIN_TIMEOUT)
+        finally:
+            for reader in readers:
+                reader.cancel()
+            transport.close()
+
+        return transport.get_returncode()
+
+    async def start(self, jail):
+        async with self.state_lock:
+            try:
+                await self.run_sync(
+                    lambda: iocage_lib.iocage.IOCage(
+                        jail=jail, skip_jails=True, silent=True
+                    ).start(jail)
+                )
+            finally:
+                self.invalidate()
+
+    async def stop(self, jail, force=False):
+        async with self.state_lock:
+            try:
+                await self.run_sync(
+                    lambda: iocage_lib.iocage.IOCage(
+                        jail=jail, skip_jails=True, silent=True
+                    ).stop(jail, force=force)
+                )
+            finally:
+                self.invalidate()
+
+    async def exec_many(self, jails, command, **kwargs):
+        """Runs exec for every jail concurrently, results in jail order."""
+        return await asyncio.gather(
+            *(self.exec(jail, command, **kwargs) for jail in jails)
+        )
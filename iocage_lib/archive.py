@@ -0,0 +1,444 @@
+import collections
+import concurrent.futures
+import contextlib
+import gzip
+import hashlib
+import io
+import lzma
+import os
+import shutil
+import subprocess as su
+import tarfile
+import threading
+import time
+import zipfile
+
+
+CHUNK_SIZE = 1024 * 1024
+# tar needs the size of a member before its data, send streams are
+# therefore stored as consecutive members of at most this size
+MEMBER_SIZE = 64 * 1024 * 1024
+
+
+def default_threads():
+    return os.cpu_count() or 1
+
+
+class BlockCompressor:
+
+    """
+    Write only file object compressing fixed size blocks on a thread pool.
+
+    Every block becomes a complete gzip member or xz stream of its own, the
+    result is a plain concatenation of those which gzip/xz (and Python's
+    gzip/lzma modules) decompress like any other file. zlib and liblzma
+    release the GIL, so this scales with threads at a small cost in ratio.
+    """
+
+    def __init__(self, fileobj, compress, block_size, threads):
+        self.fileobj = fileobj
+        self.compress = compress
+        self.block_size = block_size
+        self.threads = threads
+        self.executor = concurrent.futures.ThreadPoolExecutor(threads)
+        self.pending = collections.deque()
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self.submit(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def submit(self, block):
+        self.pending.append(self.executor.submit(self.compress, block))
+        # Blocks are written in order, which also bounds memory use
+        while len(self.pending) > self.threads * 2:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def close(self):
+        try:
+            if self.buffer:
+                self.submit(bytes(self.buffer))
+                self.buffer.clear()
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().result())
+        finally:
+            for future in self.pending:
+                future.cancel()
+            self.executor.shutdown()
+
+
+class PipeCompressor:
+
+    """
+    Write only file object compressing through an external filter, its
+    output is copied into fileobj by a helper thread.
+    """
+
+    def __init__(self, fileobj, command):
+        self.fileobj = fileobj
+        self.proc = su.Popen(command, stdin=su.PIPE, stdout=su.PIPE)
+        self.error = None
+        self.thread = threading.Thread(target=self.pump, daemon=True)
+        self.thread.start()
+
+    def pump(self):
+        try:
+            for chunk in iter(lambda: self.proc.stdout.read(CHUNK_SIZE), b''):
+                self.fileobj.write(chunk)
+        except Exception as e:
+            self.error = e
+            self.proc.kill()
+
+    def write(self, data):
+        self.proc.stdin.write(data)
+        return len(data)
+
+    def close(self):
+        with contextlib.suppress(BrokenPipeError):
+            self.proc.stdin.close()
+        self.thread.join()
+        self.proc.wait()
+
+        if self.error:
+            raise self.error
+        if self.proc.returncode:
+            raise su.CalledProcessError(self.proc.returncode, self.proc.args)
+
+
+class Codec:
+
+    """Compression used for tar based export images."""
+
+    name = None
+    extension = None
+
+    def available(self):
+        return True
+
+    def compressor(self, fileobj, threads):
+        raise NotImplementedError
+
+    def decompressor(self, fileobj):
+        """
+        Context manager returning a readable file object decompressing
+        what is read from fileobj.
+        """
+        raise NotImplementedError
+
+
+class BlockCodec(Codec):
+
+    def __init__(self, name, extension, compress, open_, block_size):
+        self.name = name
+        self.extension = extension
+        self.compress = compress
+        self.open = open_
+        self.block_size = block_size
+
+    def compressor(self, fileobj, threads):
+        return BlockCompressor(
+            fileobj, self.compress, self.block_size, threads
+        )
+
+    def decompressor(self, fileobj):
+        # Both handle multiple members/streams
+        return self.open(fileobj, 'rb')
+
+
+class ZstdCodec(Codec):
+
+    name = 'zstd'
+    extension = 'tar.zst'
+
+    def available(self):
+        return shutil.which('zstd') is not None
+
+    def compressor(self, fileobj, threads):
+        return PipeCompressor(fileobj, ['zstd', '-q', '-c', f'-T{threads}'])
+
+    @contextlib.contextmanager
+    def decompressor(self, fileobj):
+        proc = su.Popen(
+            ['zstd', '-q', '-d', '-c'], stdin=su.PIPE, stdout=su.PIPE
+        )
+
+        def feed():
+            with contextlib.suppress(BrokenPipeError, ValueError):
+                for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b''):
+                    proc.stdin.write(chunk)
+            with contextlib.suppress(BrokenPipeError):
+                proc.stdin.close()
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        try:
+            yield proc.stdout
+        finally:
+            proc.stdout.close()
+            proc.wait()
+            feeder.join()
+
+        if proc.returncode:
+            raise su.CalledProcessError(proc.returncode, proc.args)
+
+
+CODECS = {
+    c.name: c for c in (
+        BlockCodec(
+            'lzma', 'tar.xz', lambda b: lzma.compress(b, preset=6), lzma.open,
+            # Same block size xz -T picks for the default preset
+            24 * 1024 * 1024
+        ),
+        BlockCodec(
+            'gzip', 'tar.gz',
+            lambda b: gzip.compress(b, compresslevel=6, mtime=0), gzip.open,
+            1024 * 1024
+        ),
+        ZstdCodec(),
+    )
+}
+
+EXTENSIONS = {
+    'zip': 'zip', **{name: c.extension for name, c in CODECS.items()}
+}
+
+
+def codec_for(path):
+    """Returns the compression algorithm of the image at path."""
+    for name, extension in EXTENSIONS.items():
+        if path.endswith(f'.{extension}'):
+            return name
+    return None
+
+
+class HashingWriter:
+
+    """
+    Write only file object computing the SHA256 of everything written
+    through it.
+
+    It deliberately can't seek, which makes zipfile emit data descriptors
+    instead of going back to patch local headers, so the digest matches the
+    file on disk without reading it again.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+        self.offset = 0
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.sha256.update(data)
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+def read_full(stream, size):
+    """Reads size bytes from stream, less only at EOF."""
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = stream.read(min(size - len(buf), CHUNK_SIZE))
+        if not chunk:
+            break
+        buf += chunk
+    return bytes(buf)
+
+
+class ArchiveWriter:
+
+    """Writes send streams into an export image in a single pass."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    @classmethod
+    def open(cls, fileobj, compression_algo, threads=None):
+        if compression_algo == 'zip':
+            return ZipArchiveWriter(fileobj)
+        return TarArchiveWriter(
+            fileobj, CODECS[compression_algo], threads or default_threads()
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add_stream(self, name, stream):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+
+class ZipArchiveWriter(ArchiveWriter):
+
+    def __init__(self, fileobj):
+        super().__init__(fileobj)
+        self.zip = zipfile.ZipFile(
+            fileobj, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True
+        )
+
+    def add_stream(self, name, stream):
+        with self.zip.open(name, 'w', force_zip64=True) as dst:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                dst.write(chunk)
+
+    def close(self):
+        self.zip.close()
+
+
+class TarArchiveWriter(ArchiveWriter):
+
+    def __init__(self, fileobj, codec, threads):
+        super().__init__(fileobj)
+        self.compressor = codec.compressor(fileobj, threads)
+        self.tar = tarfile.open(fileobj=self.compressor, mode='w|')
+
+    def add_stream(self, name, stream):
+        first = True
+        while True:
+            chunk = read_full(stream, MEMBER_SIZE)
+            if not chunk and not first:
+                break
+
+            info = tarfile.TarInfo(name)
+            info.size = len(chunk)
+            info.mtime = time.time()
+            info.mode = 0o600
+            self.tar.addfile(info, io.BytesIO(chunk))
+            first = False
+
+            if len(chunk) < MEMBER_SIZE:
+                break
+
+    def close(self):
+        try:
+            self.tar.close()
+        finally:
+            self.compressor.close()
+
+
+class HashingReader:
+
+    """Read only file object computing the SHA256 of everything read."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.sha256.update(data)
+        return data
+
+    def readable(self):
+        return True
+
+    def drain(self):
+        for _ in iter(lambda: self.read(CHUNK_SIZE), b''):
+            pass
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+class ImageReader:
+
+    """
+    Reads the send streams out of an export image and computes the image's
+    SHA256 along the way.
+
+    tar based images are read front to back exactly once, the digest covers
+    the compressed image file as read off the disk, the same bytes export
+    wrote its .sha256 for and import verifies. zip images need random
+    access instead, which lets members be read concurrently (seekable), and
+    are hashed by a helper thread running alongside.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.seekable = path.endswith('.zip')
+        self.digest = None
+        self.hasher = None
+
+        if self.seekable:
+            self.hasher = threading.Thread(target=self.hash, daemon=True)
+            self.hasher.start()
+
+    def hash(self):
+        with open(self.path, 'rb') as f:
+            reader = HashingReader(f)
+            reader.drain()
+        self.digest = reader.hexdigest()
+
+    def hexdigest(self):
+        """SHA256 of the image, once every stream was read."""
+        if self.hasher:
+            self.hasher.join()
+        return self.digest
+
+    def names(self):
+        """Stream names of a seekable image."""
+        with zipfile.ZipFile(self.path, 'r') as z:
+            return z.namelist()
+
+    def open(self, name):
+        """Chunks of one stream of a seekable image, safe to use in threads."""
+        with zipfile.ZipFile(self.path, 'r') as z, z.open(name) as f:
+            yield from iter(lambda: f.read(CHUNK_SIZE), b'')
+
+    def streams(self):
+        """
+        Yields (name, chunks) for every send stream in the image, chunks has
+        to be consumed before advancing to the next stream. Consecutive tar
+        members sharing a name are one stream.
+        """
+        if self.seekable:
+            for name in self.names():
+                yield name, self.open(name)
+            return
+
+        codec = CODECS[codec_for(self.path) or 'lzma']
+        with open(self.path, 'rb') as raw:
+            reader = HashingReader(raw)
+            with codec.decompressor(reader) as f, \
+                    tarfile.open(fileobj=f, mode='r|') as tar:
+                member = tar.next()
+
+                def chunks(name):
+                    nonlocal member
+                    while member is not None and member.name == name:
+                        f = tar.extractfile(member)
+                        yield from iter(lambda: f.read(CHUNK_SIZE), b'')
+                        member = tar.next()
+
+                while member is not None:
+                    stream = chunks(member.name)
+                    yield member.name, stream
+                    # Skip whatever the consumer left behind
+                    for _ in stream:
+                        pass
+
+            # Trailing padding the decompressor didn't need
+            reader.drain()
+            self.digest = reader.hexdigest()
+
+
+def read_streams(path):
+    """Yields (name, chunks) for every send stream in the image at path."""
+    yield from ImageReader(path).streams()
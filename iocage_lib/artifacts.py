@@ -0,0 +1,297 @@
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import iocage_lib.ioc_common
+
+from iocage_lib.lazy import lazy_import
+
+requests = lazy_import('requests')
+
+
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_MAX_SIZE = 10 * 1024 ** 3
+
+
+def parse_size(value):
+    """Parses sizes like 512M or 10G into bytes."""
+    value = str(value).strip().upper()
+    for power, suffix in enumerate('KMGT', 1):
+        if value.endswith(suffix):
+            return int(float(value[:-1]) * 1024 ** power)
+
+    return int(value)
+
+
+class ArtifactStore:
+
+    """
+    Content addressed cache for files iocage downloads over and over, like
+    release sets, MANIFESTs, the EOL page and freebsd-update.sh.
+
+    Objects live under objects/ named after their SHA256 and index.json maps
+    each URL to the object it last resolved to together with the ETag and
+    Last-Modified the server sent. Cached URLs are revalidated with a
+    conditional HEAD request, and the least recently used objects are
+    evicted once the store grows past max_size.
+
+    The store can be shared between hosts, when it isn't writable (e.g. a
+    read only NFS mount) it is only consulted and never updated.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.objects_path = os.path.join(path, 'objects')
+        self.index_path = os.path.join(path, 'index.json')
+        self.lock_path = os.path.join(path, '.lock')
+
+        if not os.path.isdir(self.objects_path):
+            try:
+                os.makedirs(self.objects_path, exist_ok=True)
+            except OSError:
+                pass
+
+    @classmethod
+    def default(cls):
+        """
+        Store configured by IOCAGE_ARTIFACTS/IOCAGE_ARTIFACTS_MAX_SIZE, None
+        unless IOCAGE_ARTIFACTS is set. Files are copied into the store, which
+        isn't worth the space for a host fetching each RELEASE once.
+        """
+        path = os.environ.get('IOCAGE_ARTIFACTS')
+        if not path:
+            return None
+
+        return cls(path, parse_size(
+            os.environ.get('IOCAGE_ARTIFACTS_MAX_SIZE', DEFAULT_MAX_SIZE)
+        ))
+
+    @property
+    def readonly(self):
+        return not os.access(self.objects_path, os.W_OK)
+
+    @contextlib.contextmanager
+    def locked(self):
+        if self.readonly:
+            yield
+            return
+
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    def read_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+
+        index.setdefault('urls', {})
+        index.setdefault('objects', {})
+        return index
+
+    def write_index(self, index):
+        if self.readonly:
+            return
+
+        with iocage_lib.ioc_common.open_atomic(self.index_path, 'w') as f:
+            json.dump(index, f, sort_keys=True)
+
+    def object_path(self, sha256):
+        return os.path.join(self.objects_path, sha256[:2], sha256)
+
+    def touch(self, sha256):
+        with self.locked():
+            index = self.read_index()
+            if sha256 in index['objects']:
+                index['objects'][sha256]['atime'] = time.time()
+                self.write_index(index)
+
+    def lookup(self, url, auth=None, verify=True, timeout=None):
+        """
+        Returns (path, sha256) of the cached copy of url if the server
+        confirms it is still current, or (None, None).
+        """
+        entry = self.read_index()['urls'].get(url)
+        if not entry or not os.path.isfile(self.object_path(entry['sha256'])):
+            return None, None
+
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        try:
+            r = requests.head(
+                url, headers=headers, auth=auth, verify=verify,
+                timeout=timeout, allow_redirects=True
+            )
+        except requests.ConnectionError:
+            # Offline, stale is better than nothing
+            r = None
+
+        if r is not None and r.status_code != requests.codes.not_modified:
+            validators = self.validators(r.headers)
+            if not r.ok or not any(validators.values()) or validators != {
+                k: entry.get(k) for k in validators
+            }:
+                return None, None
+
+        self.touch(entry['sha256'])
+        return self.object_path(entry['sha256']), entry['sha256']
+
+    @staticmethod
+    def validators(headers):
+        return {
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+        }
+
+    def add(self, url, path, sha256=None, headers=None):
+        """
+        Copies the file at path into the store as the content of url.
+        Returns the SHA256 of the file, which is only known up front for a
+        read only store if it was passed in.
+        """
+        if self.readonly:
+            return sha256
+
+        if not sha256 or not os.path.isfile(self.object_path(sha256)):
+            sha256 = self.store(path)
+
+        with self.locked():
+            index = self.read_index()
+            old = index['urls'].get(url, {}).get('sha256')
+            index['urls'][url] = {
+                'sha256': sha256, **self.validators(headers or {})
+            }
+            index['objects'][sha256] = {
+                'size': os.path.getsize(self.object_path(sha256)),
+                'atime': time.time(),
+            }
+
+            if old and old != sha256:
+                self.drop_unreferenced(index, old)
+
+            self.evict(index, keep=sha256)
+            self.write_index(index)
+
+        return sha256
+
+    def store(self, path):
+        fd, tmp = tempfile.mkstemp(dir=self.objects_path)
+        digest = hashlib.sha256()
+        try:
+            with open(path, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+                for block in iter(lambda: src.read(CHUNK_SIZE), b''):
+                    digest.update(block)
+                    dst.write(block)
+
+            sha256 = digest.hexdigest()
+            os.makedirs(
+                os.path.dirname(self.object_path(sha256)), exist_ok=True
+            )
+            os.replace(tmp, self.object_path(sha256))
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp)
+            raise
+
+        return sha256
+
+    def forget(self, url):
+        if self.readonly:
+            return
+
+        with self.locked():
+            index = self.read_index()
+            entry = index['urls'].pop(url, None)
+            if entry:
+                self.drop_unreferenced(index, entry['sha256'])
+                self.write_index(index)
+
+    def drop_unreferenced(self, index, sha256):
+        if any(u['sha256'] == sha256 for u in index['urls'].values()):
+            return
+
+        index['objects'].pop(sha256, None)
+        with contextlib.suppress(OSError):
+            os.remove(self.object_path(sha256))
+
+    def evict(self, index, keep=None):
+        objects = index['objects']
+        total = sum(o['size'] for o in objects.values())
+
+        for sha256 in sorted(objects, key=lambda s: objects[s]['atime']):
+            if total <= self.max_size:
+                break
+            if sha256 == keep:
+                continue
+
+            total -= objects.pop(sha256)['size']
+            index['urls'] = {
+                u: e for u, e in index['urls'].items() if e['sha256'] != sha256
+            }
+            with contextlib.suppress(OSError):
+                os.remove(self.object_path(sha256))
+
+    def copy(self, url, dest, auth=None, verify=True):
+        """
+        Places the cached copy of url at dest, hard linked if possible.
+        Returns the SHA256 of the file or None if url isn't cached.
+        """
+        path, sha256 = self.lookup(url, auth, verify)
+        if not path:
+            return None
+
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(dest)
+
+        try:
+            os.link(path, dest)
+        except OSError:
+            shutil.copyfile(path, dest)
+
+        return sha256
+
+    def read(self, url, auth=None, verify=True, timeout=None):
+        """Returns the content of url, from the store when current."""
+        path, _ = self.lookup(url, auth, verify, timeout)
+        if path:
+            with open(path, 'rb') as f:
+                return f.read()
+
+        r = requests.get(url, auth=auth, verify=verify, timeout=timeout)
+        r.raise_for_status()
+
+        # Without validators lookup() would never serve it
+        if not self.readonly and any(self.validators(r.headers).values()):
+            with tempfile.NamedTemporaryFile(dir=self.objects_path) as tmp:
+                tmp.write(r.content)
+                tmp.flush()
+                self.add(url, tmp.name, headers=r.headers)
+
+        return r.content
+
+
+def read_artifact(url, **kwargs):
+    """Fetches url through the default ArtifactStore when there is one."""
+    store = ArtifactStore.default()
+
+    if store is None:
+        r = requests.get(url, **kwargs)
+        r.raise_for_status()
+        return r.content
+
+    return store.read(url, **kwargs)
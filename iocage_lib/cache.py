@@ -3,10 +3,13 @@ import os
 import subprocess as su
 import threading
 
+from iocage_lib.lazy import lazy_import
 from iocage_lib.zfs import (
     all_properties, dataset_exists, get_all_dependents, get_dependents_with_depth,
 )
 
+jsonschema = lazy_import('jsonschema')
+
 
 class Cache:
 
@@ -15,8 +18,11 @@ class Cache:
     def __init__(self):
         self.fields = [
             'dataset_data', 'pool_data', 'dataset_dep_data', 'ioc_pool', 'ioc_dataset',
-            '_freebsd_version', '_plugin_manifest_schema'
+            '_freebsd_version',
         ]
+        # Ship with iocage, so these survive reset()
+        self._plugin_manifest_schema = None
+        self._plugin_manifest_validator = None
         self.reset()
 
     @property
@@ -128,6 +134,14 @@ class Cache:
                 self._plugin_manifest_schema = json.load(f)
         return self._plugin_manifest_schema
 
+    @property
+    def plugin_manifest_validator(self):
+        if not self._plugin_manifest_validator:
+            self._plugin_manifest_validator = jsonschema.Draft7Validator(
+                self.plugin_manifest_schema
+            )
+        return self._plugin_manifest_validator
+
     def reset(self):
         with self.cache_lock:
             for f in self.fields:
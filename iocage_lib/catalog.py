@@ -0,0 +1,229 @@
+import contextlib
+import fcntl
+import json
+import os
+
+import iocage_lib.ioc_common
+import iocage_lib.ioc_json
+
+from iocage_lib.cache import cache
+
+
+CATALOG_VERSION = 1
+CATALOG_LOCATIONS = ('jails', 'templates')
+
+
+class JailCatalog:
+
+    """
+    Compact index of every jail and template under iocroot.
+
+    Listing, rc ordering and name resolution only need a handful of
+    properties per jail, so instead of opening every config.json we keep
+    them in <iocroot>/catalog.json keyed by jail name. Each entry records the
+    mtime of the config it was built from, any entry whose config (or the
+    defaults.json it inherits from) changed since is rebuilt on read.
+    """
+
+    fields = (
+        'type', 'release', 'boot', 'priority', 'depends', 'ip4_addr',
+        'ip6_addr', 'dhcp', 'basejail', 'interfaces', 'host_hostuuid',
+    )
+
+    def __init__(self, iocroot, pool):
+        self.iocroot = iocroot
+        self.pool = pool
+        self.path = os.path.join(iocroot or '', 'catalog.json')
+        self.lock_path = os.path.join(iocroot or '', '.catalog.lock')
+        self.defaults_path = os.path.join(iocroot or '', 'defaults.json')
+
+    @contextlib.contextmanager
+    def locked(self):
+        try:
+            lock = open(self.lock_path, 'a')
+        except OSError:
+            # Non root users can still read the catalog, they just
+            # can't persist anything they had to rebuild.
+            yield
+            return
+
+        with lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    @staticmethod
+    def mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def read(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+
+        if data.get('version') != CATALOG_VERSION or data.get(
+            'defaults_mtime'
+        ) != self.mtime(self.defaults_path):
+            # Every thin config inherits from defaults.json, so a change
+            # there invalidates all entries.
+            data = {}
+
+        return data.get('jails', {})
+
+    def write(self, jails):
+        try:
+            with iocage_lib.ioc_common.open_atomic(self.path, 'w') as f:
+                json.dump({
+                    'version': CATALOG_VERSION,
+                    'defaults_mtime': self.mtime(self.defaults_path),
+                    'jails': jails,
+                }, f, sort_keys=True)
+        except OSError:
+            pass
+
+    def defaults(self):
+        try:
+            with open(self.defaults_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return iocage_lib.ioc_json.IOCConfiguration.retrieve_default_props()
+
+    def template(self, location, name):
+        if location == 'templates':
+            return '-'
+
+        origin = cache.datasets.get(
+            os.path.join(self.pool, 'iocage', location, name, 'root'), {}
+        ).get('origin')
+        if not origin or origin == '-':
+            return '-'
+
+        template = origin.rsplit('/root@', 1)[0].rsplit('/', 1)[-1]
+        if 'release' in template.lower() or 'stable' in template.lower():
+            template = '-'
+
+        return template
+
+    def index(self, name, path, location, config_mtime, defaults=None):
+        """Build the catalog entry for a single jail from its config.json"""
+        entry = {
+            'name': name,
+            'path': path,
+            'location': location,
+            'config_mtime': config_mtime,
+            'corrupt': False,
+        }
+
+        try:
+            with open(os.path.join(path, 'config.json'), 'r') as f:
+                conf = json.load(f)
+        except (OSError, ValueError):
+            entry.update({k: 'N/A' for k in self.fields})
+            entry.update({
+                'host_hostuuid': name, 'template': '-', 'corrupt': True,
+            })
+            return entry
+
+        conf = {**(defaults or self.defaults()), **conf}
+        for key in self.fields:
+            entry[key] = conf.get(key, 'none')
+
+        for key in ('boot', 'dhcp', 'basejail'):
+            entry[key] = iocage_lib.ioc_common.check_truthy(entry[key])
+
+        entry['priority'] = iocage_lib.ioc_common.try_convert(
+            entry['priority'], 99, int
+        )
+        entry['template'] = self.template(location, name)
+
+        return entry
+
+    def scan(self):
+        for location in CATALOG_LOCATIONS:
+            try:
+                with os.scandir(os.path.join(self.iocroot, location)) as it:
+                    for d in it:
+                        if not d.is_dir(follow_symlinks=False):
+                            continue
+
+                        config_mtime = self.mtime(
+                            os.path.join(d.path, 'config.json')
+                        )
+                        if config_mtime is None:
+                            # Unmounted/locked dataset or not a jail at all
+                            continue
+
+                        yield d.name, d.path, location, config_mtime
+            except OSError:
+                continue
+
+    def jails(self, location=None):
+        """
+        Returns a dict of jail name -> catalog entry, rebuilding any entry
+        that is missing or stale and dropping ones that no longer exist.
+        """
+        if not self.iocroot:
+            return {}
+
+        with self.locked():
+            jails = self.read()
+            catalog = {}
+            defaults = None
+
+            for name, path, loc, config_mtime in self.scan():
+                entry = jails.get(name)
+                if not entry or entry['path'] != path or \
+                        entry['config_mtime'] != config_mtime:
+                    defaults = defaults or self.defaults()
+                    entry = self.index(
+                        name, path, loc, config_mtime, defaults
+                    )
+
+                catalog[name] = entry
+
+            if catalog != jails:
+                self.write(catalog)
+
+        return {
+            k: v for k, v in catalog.items()
+            if not location or v['location'] == location
+        }
+
+    def update(self, path):
+        """Re-index the jail living at path, called whenever its config is
+        written."""
+        if not self.iocroot:
+            return
+
+        path = path.rstrip('/')
+        location, name = path.rsplit('/', 2)[-2:]
+        if location not in CATALOG_LOCATIONS:
+            return
+
+        config_mtime = self.mtime(os.path.join(path, 'config.json'))
+
+        with self.locked():
+            jails = self.read()
+            for k in [k for k, v in jails.items() if v['path'] == path]:
+                jails.pop(k)
+
+            if config_mtime is not None:
+                jails[name] = self.index(name, path, location, config_mtime)
+
+            self.write(jails)
+
+    def remove(self, name):
+        if not self.iocroot:
+            return
+
+        with self.locked():
+            jails = self.read()
+            if jails.pop(name, None) is not None:
+                self.write(jails)
@@ -0,0 +1,287 @@
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import json
+import logging
+import os
+import signal
+import socket
+import time
+
+from iocage_lib.ioc_exceptions import DaemonUnavailable
+
+
+DEFAULT_SOCKET = '/var/run/iocaged.sock'
+# ZFS state changed by anything but iocage itself is noticed after this long
+DEFAULT_CACHE_TTL = 60
+CONNECT_TIMEOUT = 0.5
+# IOCage methods clients may call, all of them only read state
+METHODS = ('get', 'list')
+
+
+def socket_path():
+    return os.environ.get('IOCAGE_SOCKET', DEFAULT_SOCKET)
+
+
+class Client:
+
+    """
+    Talks newline delimited JSON-RPC 2.0 to iocaged. Every method raises
+    DaemonUnavailable if the daemon isn't running.
+    """
+
+    def __init__(self, path=None, timeout=None):
+        self.path = path or socket_path()
+        self.timeout = timeout
+        self.request_id = 0
+
+    def call(self, method, **params):
+        if not os.path.exists(self.path):
+            raise DaemonUnavailable(f'{self.path} does not exist')
+
+        self.request_id += 1
+        request = {
+            'jsonrpc': '2.0', 'id': self.request_id, 'method': method,
+            'params': params,
+        }
+
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(CONNECT_TIMEOUT)
+                sock.connect(self.path)
+                sock.settimeout(self.timeout)
+                sock.sendall(json.dumps(request).encode() + b'\n')
+                with sock.makefile('rb') as f:
+                    line = f.readline()
+        except OSError as e:
+            raise DaemonUnavailable(str(e))
+
+        if not line:
+            raise DaemonUnavailable('iocaged closed the connection')
+
+        response = json.loads(line)
+        if 'error' in response:
+            import iocage_lib.ioc_common
+
+            iocage_lib.ioc_common.logit({
+                'level': 'EXCEPTION',
+                'message': response['error']['message']
+            })
+
+        return response['result']
+
+    def available(self):
+        try:
+            self.call('ping')
+        except DaemonUnavailable:
+            return False
+        return True
+
+    def invalidate(self):
+        """Tells the daemon iocage changed something, if it is running."""
+        with contextlib.suppress(DaemonUnavailable):
+            self.call('invalidate')
+
+
+class RemoteIOCage:
+
+    """
+    Stands in for IOCage, answering get and list through iocaged. Anything
+    which may change state goes to a local IOCage instead.
+    """
+
+    def __init__(self, client, jail=None, skip_jails=False, **kwargs):
+        self.client = client
+        self.jail = jail
+        self.skip_jails = skip_jails
+        self.kwargs = kwargs
+
+    def local(self):
+        import iocage_lib.iocage
+        return iocage_lib.iocage.IOCage(
+            jail=self.jail, skip_jails=self.skip_jails, **self.kwargs
+        )
+
+    def call(self, method, *args, **kwargs):
+        return self.client.call(
+            method, jail=self.jail, skip_jails=self.skip_jails, args=args,
+            kwargs=kwargs
+        )
+
+    def get(self, prop, recursive=False, plugin=False, pool=False, **kwargs):
+        if plugin or kwargs.get('start_jail'):
+            return self.local().get(prop, recursive, plugin, pool, **kwargs)
+
+        return self.call(
+            'get', prop, recursive=recursive, plugin=plugin, pool=pool,
+            **kwargs
+        )
+
+    def list(self, lst_type, *args, **kwargs):
+        return self.call('list', lst_type, *args, **kwargs)
+
+
+def IOCage(jail=None, skip_jails=False, **kwargs):
+    """
+    IOCage for read only commands, backed by iocaged when it runs and by
+    the library otherwise.
+    """
+    client = Client()
+    if client.available():
+        return RemoteIOCage(client, jail, skip_jails, **kwargs)
+
+    import iocage_lib.iocage
+    return iocage_lib.iocage.IOCage(jail=jail, skip_jails=skip_jails, **kwargs)
+
+
+class Daemon:
+
+    """
+    Keeps one process with the host context, ZFS cache and jail catalog
+    warm and answers read only IOCage calls for CLI invocations.
+
+    Calls run one at a time on a single worker thread, the library isn't
+    meant to be used concurrently. The ZFS cache is dropped whenever a
+    client reports a change and after cache_ttl seconds otherwise.
+    """
+
+    def __init__(self, path=None, cache_ttl=DEFAULT_CACHE_TTL):
+        self.path = path or socket_path()
+        self.cache_ttl = cache_ttl
+        self.cache_time = time.monotonic()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.logger = logging.getLogger('iocage')
+
+    def warm_up(self):
+        import iocage_lib.ioc_check
+        import iocage_lib.iocage
+
+        iocage_lib.ioc_check.IOCCheck(silent=True)
+        # Populates the ZFS cache and the jail catalog
+        iocage_lib.iocage.IOCage(silent=True).list('all')
+        self.cache_time = time.monotonic()
+
+    def invalidate(self):
+        from iocage_lib.cache import cache
+
+        cache.reset()
+        self.cache_time = time.monotonic()
+
+    def dispatch(self, method, params):
+        if method == 'ping':
+            return {'pid': os.getpid()}
+        elif method == 'invalidate':
+            self.invalidate()
+            return True
+        elif method not in METHODS:
+            raise LookupError(f'Method not found: {method}')
+
+        if time.monotonic() - self.cache_time > self.cache_ttl:
+            self.invalidate()
+
+        import iocage_lib.iocage
+
+        ioc = iocage_lib.iocage.IOCage(
+            jail=params.get('jail'), skip_jails=params.get('skip_jails'),
+            silent=True
+        )
+        return getattr(ioc, method)(
+            *params.get('args', ()), **params.get('kwargs', {})
+        )
+
+    async def handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                response = {'jsonrpc': '2.0', 'id': None}
+                try:
+                    request = json.loads(line)
+                    response['id'] = request.get('id')
+                    method = request['method']
+                except (ValueError, KeyError, AttributeError) as e:
+                    response['error'] = {'code': -32700, 'message': str(e)}
+                else:
+                    try:
+                        response['result'] = await loop.run_in_executor(
+                            self.executor, self.dispatch, method,
+                            request.get('params', {})
+                        )
+                    except (Exception, SystemExit) as e:
+                        code = -32601 if method not in METHODS + (
+                            'ping', 'invalidate'
+                        ) else -32000
+                        response['error'] = {'code': code, 'message': str(e)}
+
+                try:
+                    data = json.dumps(response)
+                except (TypeError, ValueError) as e:
+                    response.pop('result')
+                    response['error'] = {'code': -32603, 'message': str(e)}
+                    data = json.dumps(response)
+
+                writer.write(data.encode() + b'\n')
+                await writer.drain()
+        finally:
+            writer.close()
+
+    def remove_stale_socket(self):
+        if not os.path.exists(self.path):
+            return
+
+        if Client(self.path).available():
+            raise RuntimeError(f'iocaged is already listening on {self.path}')
+
+        os.remove(self.path)
+
+    async def serve(self, ready=None):
+        self.remove_stale_socket()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.warm_up)
+
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            with contextlib.suppress(NotImplementedError, RuntimeError):
+                loop.add_signal_handler(sig, stop.set)
+
+        umask = os.umask(0o077)
+        try:
+            server = await asyncio.start_unix_server(self.handle, self.path)
+        finally:
+            os.umask(umask)
+
+        self.logger.debug(f'iocaged listening on {self.path}')
+        if ready:
+            ready(stop)
+
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            with contextlib.suppress(OSError):
+                os.remove(self.path)
+            self.executor.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='iocaged',
+        description='Serve read only iocage commands from warm caches.'
+    )
+    parser.add_argument(
+        '--socket', '-s', default=socket_path(),
+        help=f'UNIX socket to listen on (default: {socket_path()})'
+    )
+    parser.add_argument(
+        '--cache-ttl', '-t', type=int, default=DEFAULT_CACHE_TTL,
+        help='Seconds before cached ZFS state is refreshed'
+        f' (default: {DEFAULT_CACHE_TTL})'
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(Daemon(args.socket, args.cache_ttl).serve())
@@ -0,0 +1,350 @@
+import concurrent.futures
+import hashlib
+import os
+import threading
+
+from iocage_lib.lazy import lazy_import
+
+requests = lazy_import('requests')
+
+
+CHUNK_SIZE = 1024 * 1024
+SEGMENT_MIN_SIZE = 64 * 1024 * 1024
+# Seconds to wait for the server to answer or send more data
+TIMEOUT = 300
+
+
+class Downloader:
+
+    """
+    Fetches files over HTTP(S) into a local directory.
+
+    Files are streamed to "<name>.part" and only renamed once complete, so a
+    dropped connection leaves the partial file behind and the next attempt
+    resumes it with a Range request. The ETag or Last-Modified of the file
+    is kept in "<name>.part.validator" and sent along as If-Range, so a file
+    which changed in the meantime is downloaded from the start instead.
+    Multiple files are downloaded concurrently and large files can
+    additionally be split into segments which are fetched in parallel when
+    the server supports ranges.
+
+    The SHA256 of every completed file is computed as it is written and
+    kept in digests, the response headers are kept in headers, both keyed by
+    path.
+    """
+
+    def __init__(
+        self, auth=None, verify=True, jobs=4, segments=1, progress=None,
+        segment_min_size=SEGMENT_MIN_SIZE, timeout=TIMEOUT,
+    ):
+        self.auth = auth
+        self.verify = verify
+        self.timeout = timeout
+        self.jobs = max(jobs, 1)
+        self.segments = max(segments, 1)
+        self.segment_min_size = segment_min_size
+        self.progress = progress
+        self.digests = {}
+        self.headers = {}
+        self.local = threading.local()
+
+    @property
+    def session(self):
+        # requests.Session is not thread safe, one per worker
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def get(self, url, headers=None):
+        return self.session.get(
+            url, auth=self.auth, verify=self.verify, stream=True,
+            headers=headers or {}, timeout=self.timeout
+        )
+
+    def head(self, url):
+        return self.session.head(
+            url, auth=self.auth, verify=self.verify, allow_redirects=True,
+            timeout=self.timeout
+        )
+
+    @staticmethod
+    def validator(headers):
+        """The If-Range value identifying the content of a response."""
+        etag = headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            # Weak ETags can't be used for ranges
+            return etag
+        return headers.get('Last-Modified')
+
+    @staticmethod
+    def read_validator(path):
+        try:
+            with open(f'{path}.part.validator', 'r') as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def write_validator(self, path, headers):
+        validator = self.validator(headers)
+        if validator:
+            with open(f'{path}.part.validator', 'w') as f:
+                f.write(validator)
+        else:
+            self.remove_validator(path)
+
+    @staticmethod
+    def remove_validator(path):
+        try:
+            os.remove(f'{path}.part.validator')
+        except FileNotFoundError:
+            pass
+
+    def finish(self, path, digest):
+        self.digests[path] = digest
+        os.replace(f'{path}.part', path)
+        self.remove_validator(path)
+
+    @staticmethod
+    def hash_file(path):
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+                sha256.update(block)
+        return sha256
+
+    def report(self, name, done, total):
+        if self.progress:
+            self.progress(name, done, total)
+
+    def open(self, url, path):
+        """
+        Returns a DownloadStream for url, so a consumer can read the file
+        while it is being written to path.
+        """
+        r = self.get(url)
+        r.raise_for_status()
+        return DownloadStream(self, r, path)
+
+    def download_all(self, files):
+        """
+        Download every (url, path) pair in files, re-raising the first error
+        once all the transfers in flight are done.
+        """
+        files = list(files)
+        if not files:
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(self.jobs, len(files))
+        ) as executor:
+            futures = [
+                executor.submit(self.download, url, path)
+                for url, path in files
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+
+    def download(self, url, path):
+        part = f'{path}.part'
+
+        if self.segments > 1 and (
+            os.path.exists(f'{part}.0') or not os.path.exists(part)
+        ):
+            r = self.head(url)
+            size = int(r.headers.get('Content-Length', 0))
+
+            if r.ok and r.headers.get('Accept-Ranges') == 'bytes' and \
+                    size >= self.segment_min_size:
+                self.headers[path] = r.headers
+                return self.download_segmented(url, path, size)
+
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        validator = self.read_validator(path) if offset else None
+        headers = {}
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+        if validator:
+            # The server sends the whole file if it changed since
+            headers['If-Range'] = validator
+        r = self.get(url, headers)
+
+        if r.status_code == requests.codes.range_not_satisfiable:
+            r.close()
+            head = self.head(url)
+            if head.ok and head.headers.get('Content-Length') == str(offset) \
+                    and self.validator(head.headers) == validator:
+                # We already have every byte, verification happens later
+                self.finish(path, self.hash_file(part).hexdigest())
+                return
+
+            # The file shrank or changed, start over
+            offset = 0
+            r = self.get(url)
+
+        r.raise_for_status()
+        self.headers[path] = r.headers
+
+        if r.status_code != requests.codes.partial_content:
+            # Server ignored the Range header or the file changed, start over
+            offset = 0
+            self.write_validator(path, r.headers)
+
+        total = offset + int(r.headers.get('Content-Length', 0))
+        name = os.path.basename(path)
+        # Only the bytes from an earlier attempt have to be read back
+        sha256 = self.hash_file(part) if offset else hashlib.sha256()
+
+        with open(part, 'ab' if offset else 'wb') as f:
+            self.report(name, offset, total)
+            for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                sha256.update(chunk)
+                offset += len(chunk)
+                self.report(name, offset, total)
+
+        self.finish(path, sha256.hexdigest())
+
+    def download_segmented(self, url, path, size):
+        part = f'{path}.part'
+        name = os.path.basename(path)
+        step = -(-size // self.segments)
+        ranges = [
+            (i, start, min(start + step, size) - 1)
+            for i, start in enumerate(range(0, size, step))
+        ]
+        done = {}
+        lock = threading.Lock()
+
+        validator = self.validator(self.headers[path])
+        if validator != self.read_validator(path):
+            # Segments of an earlier attempt are of another version
+            for i, _, _ in ranges:
+                if os.path.exists(f'{part}.{i}'):
+                    os.remove(f'{part}.{i}')
+        self.write_validator(path, self.headers[path])
+
+        def fetch(i, start, end):
+            segment = f'{part}.{i}'
+            have = os.path.getsize(segment) if os.path.exists(segment) else 0
+
+            def account(n):
+                with lock:
+                    done[i] = n
+                    self.report(name, sum(done.values()), size)
+
+            account(have)
+            if start + have > end:
+                return
+
+            headers = {'Range': f'bytes={start + have}-{end}'}
+            if validator:
+                headers['If-Range'] = validator
+            r = self.get(url, headers)
+            r.raise_for_status()
+            if r.status_code != requests.codes.partial_content:
+                r.close()
+                raise requests.HTTPError(
+                    f'{url} changed or does not support ranged requests',
+                    response=r
+                )
+
+            with open(segment, 'ab') as f:
+                for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+                    have += len(chunk)
+                    account(have)
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(ranges)
+        ) as executor:
+            futures = [executor.submit(fetch, *r) for r in ranges]
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+
+        # Segments arrive out of order, so they are hashed while being
+        # stitched together instead.
+        sha256 = hashlib.sha256()
+        with open(part, 'wb') as f:
+            for i, _, _ in ranges:
+                with open(f'{part}.{i}', 'rb') as segment:
+                    for block in iter(lambda: segment.read(CHUNK_SIZE), b''):
+                        sha256.update(block)
+                        f.write(block)
+
+        for i, _, _ in ranges:
+            os.remove(f'{part}.{i}')
+
+        self.finish(path, sha256.hexdigest())
+
+
+class DownloadStream:
+
+    """
+    Read only file object over a download in progress. Everything read is
+    also written to "<path>.part" and hashed, closing the stream drains what
+    the reader left behind and moves the file in place once complete.
+    """
+
+    def __init__(self, downloader, response, path):
+        self.downloader = downloader
+        self.response = response
+        self.path = path
+        self.name = os.path.basename(path)
+        self.total = int(response.headers.get('Content-Length', 0))
+        self.done = 0
+        self.sha256 = hashlib.sha256()
+        self.chunks = response.iter_content(chunk_size=CHUNK_SIZE)
+        self.buffer = bytearray()
+        self.file = open(f'{path}.part', 'wb')
+        # Lets the regular download resume this one
+        downloader.write_validator(path, response.headers)
+        self.complete = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close(drain=exc_type is None)
+
+    def readable(self):
+        return True
+
+    def fill(self, size):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                chunk = next(self.chunks)
+            except StopIteration:
+                self.complete = True
+                break
+
+            self.file.write(chunk)
+            self.sha256.update(chunk)
+            self.done += len(chunk)
+            self.downloader.report(self.name, self.done, self.total)
+            self.buffer += chunk
+
+    def read(self, size=-1):
+        self.fill(size)
+        if size < 0:
+            size = len(self.buffer)
+
+        data = bytes(self.buffer[:size])
+        # bytearray drops its head without copying the remainder
+        del self.buffer[:size]
+        return data
+
+    def close(self, drain=True):
+        if self.file.closed:
+            return
+
+        if drain:
+            while not self.complete:
+                self.buffer.clear()
+                self.fill(CHUNK_SIZE)
+
+        self.file.close()
+        self.response.close()
+
+        if self.complete:
+            self.downloader.headers[self.path] = self.response.headers
+            self.downloader.finish(self.path, self.sha256.hexdigest())
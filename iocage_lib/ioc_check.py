@@ -23,18 +23,27 @@
 # POSSIBILITY OF SUCH DAMAGE.
 """Check datasets before execution"""
 import collections
+import json
 import os
 import threading
 import shutil
 
+import iocage_lib
 import iocage_lib.ioc_common
 import iocage_lib.ioc_json
 
 from iocage_lib.cache import cache
 from iocage_lib.dataset import Dataset
+from iocage_lib.pools import Pool
 from iocage_lib.zfs import ZFSException
 
 DATASET_CREATION_LOCK = threading.Lock()
+DATASETS = (
+    'iocage', 'iocage/download', 'iocage/images', 'iocage/jails',
+    'iocage/log', 'iocage/releases', 'iocage/templates'
+)
+# Written to iocroot after a full check passed
+STAMP_FILE = '.check_stamp'
 
 
 class IOCCheck(object):
@@ -43,6 +52,7 @@ class IOCCheck(object):
 
     def __init__(
         self, silent=False, callback=None, migrate=False, reset_cache=False,
+        force=False,
     ):
         self.reset_cache = reset_cache
         if reset_cache:
@@ -55,7 +65,11 @@ class IOCCheck(object):
         self.silent = silent
 
         self.__check_fd_mount__()
-        self.__check_datasets__()
+
+        stamp = self.__stamp__()
+        self.checked = force or not stamp or stamp != self.__read_stamp__()
+        if self.checked:
+            self.__check_datasets__()
 
         self.pool_root_dataset = Dataset(self.pool, cache=reset_cache)
         self.iocage_dataset = Dataset(
@@ -65,9 +79,62 @@ class IOCCheck(object):
         if migrate:
             self.__check_migrations__()
 
-        self.__clean_files__()
+        if self.checked:
+            self.__clean_files__()
+            self.__write_stamp__()
+
+    @property
+    def stamp_path(self):
+        return os.path.join(
+            Dataset(os.path.join(self.pool, 'iocage')).path, STAMP_FILE
+        )
+
+    def __stamp__(self):
+        """
+        Identifies what the last full check verified: the pool, the guid,
+        exec and mountpoint of every dataset it checked and the iocage
+        version doing it. Comes from the cached ZFS properties IOCJson
+        already loaded, None if a dataset is missing.
+        """
+        datasets = {}
+        for dataset in DATASETS:
+            ds = Dataset(f'{self.pool}/{dataset}')
+            if not ds.exists:
+                return None
+            datasets[dataset] = [
+                ds.properties.get('guid'), ds.properties.get('exec'),
+                ds.properties.get('mountpoint'),
+            ]
+
+        return {
+            'version': iocage_lib.__version__,
+            'pool': [self.pool, Pool(self.pool).properties.get('guid')],
+            'datasets': datasets,
+        }
+
+    def __read_stamp__(self):
+        try:
+            with open(self.stamp_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def __write_stamp__(self):
+        # Creating datasets above dropped the ZFS cache
+        stamp = self.__stamp__()
+        if not stamp:
+            return
+
+        try:
+            with iocage_lib.ioc_common.open_atomic(self.stamp_path, 'w') as f:
+                json.dump(stamp, f, sort_keys=True)
+        except OSError:
+            # Non root users just check every time
+            pass
 
     def __clean_files__(self):
+        # Left behind by releases which kept a plugin INDEX clone there, the
+        # parsed INDEX cache lives next to the clones in .plugins.
         shutil.rmtree(
             os.path.join(self.iocage_dataset.path, '.plugin_index'),
             ignore_errors=True
@@ -84,11 +151,7 @@ class IOCCheck(object):
         Loops through the required datasets and if there is root
         privilege will then create them.
         """
-        datasets = ("iocage", "iocage/download", "iocage/images",
-                    "iocage/jails", "iocage/log", "iocage/releases",
-                    "iocage/templates")
-
-        for dataset in datasets:
+        for dataset in DATASETS:
             zfs_dataset_name = f"{self.pool}/{dataset}"
             try:
                 ds = Dataset(zfs_dataset_name, cache=self.reset_cache)
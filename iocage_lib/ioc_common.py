@@ -22,7 +22,7 @@
 # IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 """Common methods we reuse."""
-import collections
+import collections.abc
 import contextlib
 import ipaddress
 import logging
@@ -32,8 +32,6 @@ import stat
 import subprocess as su
 import tempfile as tmp
 
-import jsonschema
-import requests
 import datetime as dt
 import re
 import shlex
@@ -48,6 +46,9 @@ import iocage_lib.ioc_exec
 from iocage_lib.cache import cache
 
 from iocage_lib.dataset import Dataset
+from iocage_lib.lazy import lazy_import
+
+requests = lazy_import('requests')
 
 INTERACTIVE = False
 # 4 is a magic number for default and doesn't refer
@@ -83,7 +84,7 @@ def callback(_log, callback_exception):
         else:
             if not isinstance(message, str) and isinstance(
                 message,
-                collections.Iterable
+                collections.abc.Iterable
             ):
                 message = '\n'.join(message)
 
@@ -1141,12 +1142,30 @@ def get_active_jails():
     }
 
 
-def validate_plugin_manifest(manifest, _callback, silent):
-    v = jsonschema.Draft7Validator(cache.plugin_manifest_schema)
+def plugin_manifest_errors(manifest):
+    """Returns what is wrong with the plugin manifest, nothing if valid."""
+    return [
+        e.message
+        for e in cache.plugin_manifest_validator.iter_errors(manifest)
+    ]
+
+
+def validate_plugin_manifests(manifests):
+    """
+    Validates a dict of plugin manifests, returns the errors of the invalid
+    ones keyed the same way.
+    """
+    invalid = {}
+    for key, manifest in manifests.items():
+        errors = plugin_manifest_errors(manifest)
+        if errors:
+            invalid[key] = errors
+
+    return invalid
 
-    errors = []
-    for e in v.iter_errors(manifest):
-        errors.append(e.message)
+
+def validate_plugin_manifest(manifest, _callback, silent):
+    errors = plugin_manifest_errors(manifest)
 
     if errors:
         errors = '\n'.join(errors)
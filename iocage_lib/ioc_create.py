@@ -38,8 +38,6 @@ import iocage_lib.ioc_list
 import iocage_lib.ioc_start
 import iocage_lib.ioc_stop
 import iocage_lib.ioc_exceptions
-import dns.resolver
-import dns.exception
 import shutil
 
 from iocage_lib.cache import cache
@@ -742,6 +740,10 @@ class IOCCreate(object):
         Takes a list of pkg's to install into the target jail. The resolver
         property is required for pkg to have network access.
         """
+        # Only needed here and slow to import
+        import dns.resolver
+        import dns.exception
+
         started = False
         status, jid = iocage_lib.ioc_list.IOCList().list_get_jid(jail_uuid)
 
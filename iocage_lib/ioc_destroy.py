@@ -29,6 +29,7 @@ import iocage_lib.ioc_exceptions
 import iocage_lib.ioc_json
 import iocage_lib.ioc_stop
 
+from iocage_lib.catalog import JailCatalog
 from iocage_lib.dataset import Dataset
 from iocage_lib.snapshot import Snapshot, SnapshotListableResource
 
@@ -282,3 +283,5 @@ class IOCDestroy:
         except SystemExit:
             # The dataset doesn't exist, we don't care :)
             pass
+
+        JailCatalog(self.iocroot, self.pool).remove(uuid)
@@ -22,7 +22,7 @@
 # IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 """Exception classes for iocage"""
-import collections
+import collections.abc
 from contextlib import contextmanager
 
 
@@ -31,7 +31,7 @@ class ExceptionWithMsg(Exception):
     def __init__(self, message):
         if not isinstance(message, str) and not isinstance(
             message,
-            collections.Iterable
+            collections.abc.Iterable
         ):
             message = [message]
 
@@ -97,3 +97,7 @@ def ignore_exceptions(*exceptions, clean=None, suppress_exception=True):
             # For cases where this block is used dynamically to suppress
             # exceptions
             raise e
+
+
+class DaemonUnavailable(Exception):
+    pass
@@ -29,11 +29,95 @@ import iocage_lib.ioc_json
 import iocage_lib.ioc_list
 import iocage_lib.ioc_start
 import iocage_lib.ioc_exceptions
-import select
-import fcntl
+import codecs
+import collections
 import os
 import re
-import collections
+import selectors
+import threading
+
+CHUNK_SIZE = 64 * 1024
+# The EOL notice is looked for in this much of the end of stdout
+EOL_WINDOW = 4096
+
+
+class OutputBuffer(object):
+    """
+    Keeps the last max_size bytes written to it, everything when max_size
+    is None. With spill_path every byte also goes to that file, so very
+    large outputs can be kept without holding them in memory.
+    """
+    def __init__(self, max_size=None, spill_path=None):
+        self.max_size = max_size
+        self.spill_path = spill_path
+        self.spill = open(spill_path, 'wb') if spill_path else None
+        self.chunks = collections.deque()
+        self.length = 0
+        self.size = 0
+
+    @property
+    def truncated(self):
+        return self.size > self.length
+
+    def write(self, data):
+        if self.spill:
+            self.spill.write(data)
+
+        self.size += len(data)
+        self.chunks.append(data)
+        self.length += len(data)
+
+        while self.max_size is not None and self.length > self.max_size:
+            excess = self.length - self.max_size
+            head = self.chunks[0]
+            if len(head) <= excess:
+                self.chunks.popleft()
+                self.length -= len(head)
+            else:
+                self.chunks[0] = head[excess:]
+                self.length -= excess
+
+        return len(data)
+
+    def getvalue(self):
+        return b''.join(self.chunks)
+
+    def close(self):
+        if self.spill:
+            self.spill.close()
+
+
+def exec_env(su_env=None):
+    """Fills in the environment every command run in a jail gets."""
+    path = '/sbin:/bin:/usr/sbin:/usr/bin:/usr/local/sbin:'\
+           '/usr/local/bin:/root/bin'
+    env_lang = os.environ.get('LANG', 'en_US.UTF-8')
+    su_env = su_env or {}
+    su_env.setdefault('PATH', path)
+    su_env.setdefault('PWD', '/')
+    su_env.setdefault('HOME', '/')
+    su_env.setdefault('TERM', 'xterm-256color')
+    su_env.setdefault('LANG', env_lang)
+    su_env.setdefault('LC_ALL', env_lang)
+    su_env.setdefault('HTTP_PROXY', os.environ.get('HTTP_PROXY', ''))
+    su_env.setdefault('HTTP_PROXY_AUTH', os.environ.get('HTTP_PROXY_AUTH', ''))
+    su_env.setdefault('NO_PROXY', os.environ.get('NO_PROXY', ''))
+
+    return su_env
+
+
+def jexec_command(uuid, exec_fib, command, host_user='root', jail_user=None):
+    if jail_user:
+        flag = "-U"
+        user = jail_user
+    else:
+        flag = "-u"
+        user = host_user
+
+    return [
+        '/usr/sbin/setfib', str(exec_fib), 'jexec', flag, user,
+        f'ioc-{uuid.replace(".", "_")}'
+    ] + list(command)
 
 
 class IOCExec(object):
@@ -53,7 +137,8 @@ class IOCExec(object):
         stdin_bytestring=None,
         su_env=None,
         decode=False,
-        callback=None
+        callback=None,
+        line_buffered=False
     ):
         self.command = command
         self.uuid = uuid.replace(".", "_") if uuid is not None else uuid
@@ -65,23 +150,10 @@ class IOCExec(object):
         self.skip = skip
         self.stdin_bytestring = stdin_bytestring
         self.decode = decode
+        self.line_buffered = line_buffered
         self.stdin = su.PIPE if self.stdin_bytestring is not None else None
 
-        path = '/sbin:/bin:/usr/sbin:/usr/bin:/usr/local/sbin:'\
-               '/usr/local/bin:/root/bin'
-        env_lang = os.environ.get('LANG', 'en_US.UTF-8')
-        su_env = su_env or {}
-        su_env.setdefault('PATH', path)
-        su_env.setdefault('PWD', '/')
-        su_env.setdefault('HOME', '/')
-        su_env.setdefault('TERM', 'xterm-256color')
-        su_env.setdefault('LANG', env_lang)
-        su_env.setdefault('LC_ALL', env_lang)
-        su_env.setdefault('HTTP_PROXY', os.environ.get('HTTP_PROXY', ''))
-        su_env.setdefault('HTTP_PROXY_AUTH', os.environ.get('HTTP_PROXY_AUTH', ''))
-        su_env.setdefault('NO_PROXY', os.environ.get('NO_PROXY', ''))
-
-        self.su_env = su_env
+        self.su_env = exec_env(su_env)
         self.callback = callback
         self.cmd = self.command
 
@@ -95,17 +167,10 @@ class IOCExec(object):
             self.flight_checks()
 
             if not self.unjailed:
-                if self.jail_user:
-                    flag = "-U"
-                    user = self.jail_user
-                else:
-                    flag = "-u"
-                    user = self.host_user
-
-                self.cmd = [
-                    '/usr/sbin/setfib', exec_fib, 'jexec', flag, user,
-                    f'ioc-{self.uuid.replace(".", "_")}'
-                ] + list(self.command)
+                self.cmd = jexec_command(
+                    self.uuid, exec_fib, self.command, self.host_user,
+                    self.jail_user
+                )
 
     def __enter__(self):
         self.proc = su.Popen(
@@ -198,6 +263,19 @@ class IOCExec(object):
                     },
                     _callback=self.callback)
 
+    def watch_exit(self):
+        """Returns a fd which becomes readable once the command exited."""
+        r, w = os.pipe()
+
+        def wait():
+            try:
+                self.proc.wait()
+            finally:
+                os.close(w)
+
+        threading.Thread(target=wait, daemon=True).start()
+        return r
+
     def exec_jail(self):
         # Courtesy of @william-gr
         # service(8) and some rc.d scripts have the bad habit of
@@ -209,42 +287,74 @@ class IOCExec(object):
         # $ jexec 1 service postgresql onerestart | cat
         # ... <hangs>
         # postgresql rc.d command never closes the pipe
+        #
+        # Instead of polling, we sleep until either pipe has data or the
+        # command exits. Once it is gone only what is already buffered in
+        # the pipes gets read.
         stderr_queue = collections.deque(maxlen=30)
-        rtrn_stdout = _rtrn_stdout = rtrn_stderr = b''
-
-        for i in ('stdout', 'stderr'):
-            fileno = getattr(self.proc, i).fileno()
-            fl = fcntl.fcntl(fileno, fcntl.F_GETFL)
-            fcntl.fcntl(fileno, fcntl.F_SETFL, fl | os.O_NONBLOCK)
-
-        timeout = 0.1
-
-        while True:
-            r = select.select([
-                self.proc.stdout.fileno(),
-                self.proc.stderr.fileno()], [], [], timeout)[0]
+        eol_tail = OutputBuffer(EOL_WINDOW)
+        streams = ('stdout', 'stderr')
+        pending = dict.fromkeys(streams, b'')
+        decoders = {
+            i: codecs.getincrementaldecoder('utf-8')() for i in streams
+        }
+        empty = '' if self.decode else b''
+
+        def emit(stream, data, final=False):
+            if self.line_buffered:
+                data = pending[stream] + data
+                cut = len(data) if final else data.rfind(b'\n') + 1
+                data, pending[stream] = data[:cut], data[cut:]
+
+            if self.decode:
+                return decoders[stream].decode(data, final)
+
+            return data
+
+        exit_fd = self.watch_exit()
+        selector = selectors.DefaultSelector()
+        selector.register(exit_fd, selectors.EVENT_READ, 'exit')
+        for i in streams:
+            selector.register(
+                getattr(self.proc, i).fileno(), selectors.EVENT_READ, i
+            )
 
-            if self.proc.poll() is not None:
-                if timeout == 0:
+        exited = False
+        try:
+            while selector.get_map():
+                events = selector.select(0 if exited else None)
+                if not events:
                     break
-                else:
-                    timeout = 0
-
-            if r:
-                if self.proc.stdout.fileno() in r:
-                    rtrn_stdout = self.proc.stdout.read()
-
-                    if rtrn_stdout:
-                        _rtrn_stdout = rtrn_stdout
-                if self.proc.stderr.fileno() in r:
-                    rtrn_stderr = self.proc.stderr.read()
-                    stderr_queue.append(rtrn_stderr)
-
-                if not self.decode:
-                    yield rtrn_stdout, rtrn_stderr
-                else:
-                    yield rtrn_stdout.decode(), rtrn_stderr.decode()
 
+                for key, _ in events:
+                    if key.data == 'exit':
+                        selector.unregister(key.fd)
+                        exited = True
+                        continue
+
+                    data = os.read(key.fd, CHUNK_SIZE)
+                    if not data:
+                        selector.unregister(key.fd)
+                        continue
+
+                    if key.data == 'stdout':
+                        eol_tail.write(data)
+                    else:
+                        stderr_queue.append(data)
+
+                    output = emit(key.data, data)
+                    if output:
+                        yield (output, empty) if key.data == 'stdout' \
+                            else (empty, output)
+        finally:
+            selector.close()
+            os.close(exit_fd)
+
+        final = [emit(i, b'', final=True) for i in streams]
+        if any(final):
+            yield tuple(final)
+
+        self.proc.wait()
         error = True if self.proc.returncode != 0 else False
 
         # self.uuid being None means a RELEASE being updated,
@@ -255,7 +365,7 @@ class IOCExec(object):
                 rb'(WARNING: FreeBSD \d*\.\d-RELEASE HAS PASSED ITS'\
                 rb' END-OF-LIFE DATE)'
 
-            if re.search(jail_eol_regex, _rtrn_stdout):
+            if re.search(jail_eol_regex, eol_tail.getvalue()):
                 error = False
 
             if error:
@@ -264,15 +374,99 @@ class IOCExec(object):
                 )
 
 
+class CaptureExec(IOCExec):
+    """
+    Runs the command like IOCExec and keeps its output in OutputBuffers,
+    at most max_output bytes (the tail) of each stream, all of it in
+    <spill_path>.stdout/.stderr if given. Every complete line is handed to
+    on_line(stream, line) as it arrives, see run().
+    """
+    def __init__(
+        self, *args, max_output=None, spill_path=None, on_line=None,
+        **kwargs
+    ):
+        kwargs.update(decode=False, line_buffered=True)
+        super().__init__(*args, **kwargs)
+        self.on_line = on_line
+        self.buffers = {
+            i: OutputBuffer(
+                max_output, f'{spill_path}.{i}' if spill_path else None
+            ) for i in ('stdout', 'stderr')
+        }
+        self.returncode = None
+
+    @property
+    def stdout(self):
+        return self.buffers['stdout'].getvalue()
+
+    @property
+    def stderr(self):
+        return self.buffers['stderr'].getvalue()
+
+    @property
+    def truncated(self):
+        return any(b.truncated for b in self.buffers.values())
+
+    def run(self):
+        """Runs the command to completion and returns its exit code."""
+        try:
+            with self as exec_gen:
+                try:
+                    for output in exec_gen:
+                        for stream, data in zip(self.buffers, output):
+                            if data:
+                                self.lines(stream, data)
+                except iocage_lib.ioc_exceptions.CommandFailed:
+                    # The exit code tells the caller
+                    pass
+        finally:
+            for buffer in self.buffers.values():
+                buffer.close()
+
+        self.returncode = self.proc.returncode
+        return self.returncode
+
+    def lines(self, stream, data):
+        self.buffers[stream].write(data)
+        if not self.on_line:
+            return
+
+        lines = data.split(b'\n')
+        if not lines[-1]:
+            lines.pop()
+        for line in lines:
+            self.on_line(stream, line)
+
+
 class SilentExec(object):
-    def __init__(self, *args, **kwargs):
-        decode = kwargs.get('decode', False)
-        with IOCExec(*args, **kwargs) as silent:  # noqa
-            self.output = list(silent)
+    """
+    Runs the command to completion, stdout and stderr hold its output.
+    max_output and spill_path bound what is kept like for CaptureExec.
+    """
+    def __init__(self, *args, max_output=None, spill_path=None, **kwargs):
+        decode = kwargs.pop('decode', False)
+        buffers = [
+            OutputBuffer(
+                max_output, f'{spill_path}.{i}' if spill_path else None
+            ) for i in ('stdout', 'stderr')
+        ]
 
-        join_str = b'' if not decode else ''
-        self.stdout = join_str.join([i[0] for i in self.output])
-        self.stderr = join_str.join([i[1] for i in self.output])
+        try:
+            with IOCExec(*args, **kwargs) as silent:  # noqa
+                for output in silent:
+                    for buffer, data in zip(buffers, output):
+                        if data:
+                            buffer.write(data)
+        finally:
+            for buffer in buffers:
+                buffer.close()
+
+        self.stdout, self.stderr = (b.getvalue() for b in buffers)
+        self.truncated = any(b.truncated for b in buffers)
+
+        if decode:
+            self.stdout = self.stdout.decode()
+            self.stderr = self.stderr.decode()
 
 
 class InteractiveExec(IOCExec):
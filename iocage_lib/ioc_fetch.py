@@ -22,19 +22,16 @@
 # IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 """iocage fetch module."""
-import hashlib
+import concurrent.futures
+import json
 import logging
 import os
 import shutil
 import subprocess as su
 import tarfile
 import tempfile
+import threading
 import time
-import urllib.request
-
-import requests
-import requests.auth
-import requests.packages.urllib3.exceptions
 
 import iocage_lib.ioc_common
 import iocage_lib.ioc_destroy
@@ -44,8 +41,13 @@ import iocage_lib.ioc_json
 import iocage_lib.ioc_start
 
 
+from iocage_lib.artifacts import ArtifactStore, read_artifact
 from iocage_lib.pools import Pool
 from iocage_lib.dataset import Dataset
+from iocage_lib.download import Downloader
+from iocage_lib.lazy import lazy_import
+
+requests = lazy_import('requests')
 
 
 class IOCFetch:
@@ -67,7 +69,10 @@ class IOCFetch:
                  eol=True,
                  files=('MANIFEST', 'base.txz', 'lib32.txz', 'src.txz'),
                  silent=False,
-                 callback=None):
+                 callback=None,
+                 jobs=4,
+                 segments=1,
+                 stream=False):
         self.pool = iocage_lib.ioc_json.IOCJson().json_get_value("pool")
         self.iocroot = iocage_lib.ioc_json.IOCJson(
             self.pool).json_get_value("iocroot")
@@ -93,6 +98,12 @@ class IOCFetch:
         self.eol = eol
         self.silent = silent
         self.callback = callback
+        self.jobs = jobs
+        self.segments = segments
+        self.download_lock = threading.Lock()
+        self.stream = stream
+        self.fresh_release = False
+        self.artifacts = ArtifactStore.default()
         self.zpool = Pool(self.pool)
 
         if hardened:
@@ -111,14 +122,10 @@ class IOCFetch:
         """Scrapes the FreeBSD website and returns a list of EOL RELEASES"""
         logging.getLogger("requests").setLevel(logging.WARNING)
         _eol = "https://www.freebsd.org/security/unsupported.html"
-        req = requests.get(_eol)
-        status = req.status_code == requests.codes.ok
+        content = read_artifact(_eol)
         eol_releases = []
 
-        if not status:
-            req.raise_for_status()
-
-        for eol in req.content.decode("iso-8859-1").split():
+        for eol in content.decode("iso-8859-1").split():
             eol = eol.strip("href=").strip("/").split(">")
             # We want a dynamic EOL
             try:
@@ -442,6 +449,10 @@ class IOCFetch:
             },
             _callback=self.callback,
             silent=self.silent)
+
+        if self.stream:
+            self.fetch_stream()
+
         self.fetch_download(self.files)
         missing_files = self.__fetch_check__(self.files)
         missing_attempt = 0
@@ -512,6 +523,7 @@ class IOCFetch:
         """
         hashes = {}
         missing = []
+        extract = []
         files_left = self.files_left.copy()
 
         if os.path.isdir(f"{self.iocroot}/download/{self.release}"):
@@ -568,34 +580,29 @@ class IOCFetch:
                 if self.hardened and f == "lib32.txz":
                     continue
 
-                # Python Central
-                hash_block = 65536
-                sha256 = hashlib.sha256()
-
                 if f in _list:
                     try:
-                        with open(
-                            os.path.join(release_download_path, f), 'rb'
-                        ) as txz:
-                            buf = txz.read(hash_block)
-
-                            while len(buf) > 0:
-                                sha256.update(buf)
-                                buf = txz.read(hash_block)
-
-                            if hashes[f] != sha256.hexdigest():
-                                if not _missing:
-                                    iocage_lib.ioc_common.logit(
-                                        {
-                                            "level":
-                                            "WARNING",
-                                            "message":
-                                            f"{f} failed verification,"
-                                            " will redownload!"
-                                        },
-                                        _callback=self.callback,
-                                        silent=self.silent)
-                                    missing.append(f)
+                        digest = self.__fetch_digest__(
+                            os.path.join(release_download_path, f)
+                        )
+
+                        if hashes[f] != digest:
+                            if self.artifacts:
+                                # Don't hand out the same bad copy again
+                                self.artifacts.forget(self.__fetch_url__(f))
+
+                            if not _missing:
+                                iocage_lib.ioc_common.logit(
+                                    {
+                                        "level":
+                                        "WARNING",
+                                        "message":
+                                        f"{f} failed verification,"
+                                        " will redownload!"
+                                    },
+                                    _callback=self.callback,
+                                    silent=self.silent)
+                                missing.append(f)
                     except FileNotFoundError:
                         if not _missing:
                             iocage_lib.ioc_common.logit(
@@ -632,24 +639,194 @@ class IOCFetch:
                         continue
 
                 if not missing and f in _list:
-                    iocage_lib.ioc_common.logit(
-                        {
-                            "level": "INFO",
-                            "message": f"Extracting: {f}... "
-                        },
-                        _callback=self.callback,
-                        silent=self.silent)
+                    extract.append(f)
 
-                    try:
-                        self.fetch_extract(f)
-                    except Exception:
-                        raise
+            self.fetch_extract_all(extract)
 
-                    if f in self.files_left:
-                        self.files_left.remove(f)
+            for f in extract:
+                if f in self.files_left:
+                    self.files_left.remove(f)
 
             return missing
 
+    def __fetch_digests_path__(self):
+        return os.path.join(
+            self.iocroot, 'download', self.release, '.sha256.json'
+        )
+
+    def __fetch_digests_load__(self):
+        try:
+            with open(self.__fetch_digests_path__(), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def __fetch_digests_save__(self, digests):
+        try:
+            with iocage_lib.ioc_common.open_atomic(
+                self.__fetch_digests_path__(), 'w'
+            ) as f:
+                json.dump(digests, f, sort_keys=True, indent=4)
+        except OSError:
+            pass
+
+    def __fetch_digest_record__(self, digests, path, digest):
+        st = os.stat(path)
+        digests[os.path.basename(path)] = {
+            'size': st.st_size, 'mtime': st.st_mtime_ns, 'sha256': digest
+        }
+
+    def __fetch_digest__(self, path):
+        """
+        Returns the SHA256 of a downloaded file. Digests are kept next to the
+        files along with their size and mtime, so a file is only read back
+        when it changed since it was downloaded or last hashed.
+        """
+        st = os.stat(path)
+        digests = self.__fetch_digests_load__()
+        entry = digests.get(os.path.basename(path), {})
+
+        if entry.get('size') == st.st_size and \
+                entry.get('mtime') == st.st_mtime_ns:
+            return entry['sha256']
+
+        digest = Downloader.hash_file(path).hexdigest()
+        self.__fetch_digest_record__(digests, path, digest)
+        self.__fetch_digests_save__(digests)
+
+        return digest
+
+    def __fetch_url__(self, f):
+        if self.hardened:
+            return f"{self.server}/{self.root_dir}/{f}"
+
+        return f"{self.server}/{self.root_dir}/{self.release}/{f}"
+
+    def __fetch_auth__(self):
+        if self.auth == "basic":
+            return self.user, self.password
+        elif self.auth == "digest":
+            return requests.auth.HTTPDigestAuth(self.user, self.password)
+
+    def __fetch_downloader__(self):
+        self.download_progress = {}
+        self.download_last = time.time()
+        self.download_last_bytes = self.download_last_progress = 0
+
+        return Downloader(
+            auth=self.__fetch_auth__(), verify=self.verify, jobs=self.jobs,
+            segments=self.segments, progress=self.__fetch_progress__
+        )
+
+    def fetch_stream(self):
+        """
+        Downloads and extracts the sets in one pass, each set is piped into
+        tarfile as it arrives and verified against MANIFEST once complete.
+
+        This is only done into a RELEASE dataset created here, so a set
+        failing verification can be undone by destroying the dataset. Sets
+        which failed are downloaded again, the regular verify and extract
+        path then takes over for whatever was not streamed successfully.
+        """
+        if self.hardened or 'MANIFEST' not in self.files or os.path.isdir(
+            f"{self.iocroot}/releases/{self.release}/root"
+        ):
+            return
+
+        self.fetch_download(['MANIFEST'], missing=True)
+        hashes = self.__fetch_manifest__()
+        release_download_path = os.path.join(
+            self.iocroot, 'download', self.release
+        )
+        # Sets the artifact store has are extracted the regular way
+        sets = [
+            f for f in self.files_left if f in hashes and not os.path.exists(
+                os.path.join(release_download_path, f)
+            )
+        ]
+        self.__fetch_from_artifacts__([
+            (self.__fetch_url__(f), os.path.join(release_download_path, f))
+            for f in sets
+        ])
+        sets = [
+            f for f in sets if not os.path.exists(
+                os.path.join(release_download_path, f)
+            )
+        ]
+        if not sets:
+            return
+
+        dest = self.__fetch_extract_dataset__()
+        downloader = self.__fetch_downloader__()
+
+        def stream(f):
+            path = os.path.join(release_download_path, f)
+            try:
+                with downloader.open(self.__fetch_url__(f), path) as src:
+                    with tarfile.open(fileobj=src, mode='r|*') as tar:
+                        tar.extractall(
+                            dest,
+                            members=self.__fetch_check_members__(tar, dest)
+                        )
+            except (requests.RequestException, tarfile.TarError, OSError):
+                # Partial downloads are resumed by the regular path
+                return False
+
+            return downloader.digests.get(path) == hashes[f]
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(min(self.jobs, len(sets)), 1)
+            ) as executor:
+                verified = dict(zip(sets, executor.map(stream, sets)))
+        finally:
+            self.__fetch_downloaded__(downloader, [
+                (self.__fetch_url__(f), os.path.join(release_download_path, f))
+                for f in sets
+            ])
+
+        if all(verified.values()):
+            for f in sets:
+                self.files_left.remove(f)
+            return
+
+        failed = [f for f, ok in verified.items() if not ok]
+        iocage_lib.ioc_common.logit(
+            {
+                'level': 'WARNING',
+                'message': f'{", ".join(failed)} failed to stream or verify,'
+                           ' discarding the extracted RELEASE and downloading'
+                           ' again!'
+            },
+            _callback=self.callback,
+            silent=self.silent)
+        Dataset(
+            f"{self.pool}/iocage/releases/{self.release}/root"
+        ).destroy(recursive=True, force=True)
+        try:
+            # The empty mountpoint would pass for an existing dataset
+            os.rmdir(dest)
+        except OSError:
+            pass
+        self.fresh_release = False
+
+        # The download dataset exists now, so the regular path would only
+        # verify what is there. Whatever failed is fetched again first, a
+        # partial download is resumed.
+        self.fetch_download(failed, missing=True)
+
+    def __fetch_manifest__(self):
+        hashes = {}
+
+        with open(os.path.join(
+            self.iocroot, 'download', self.release, 'MANIFEST'
+        ), 'r') as _manifest:
+            for line in _manifest:
+                col = line.split("\t")
+                hashes[col[0]] = col[1]
+
+        return hashes
+
     def fetch_download(self, _list, missing=False):
         """Creates the download dataset and then downloads the RELEASE."""
         dataset = f"{self.iocroot}/download/{self.release}"
@@ -669,81 +846,97 @@ class IOCFetch:
             release_download_path = os.path.join(
                 self.iocroot, 'download', self.release
             )
+            files = [
+                (self.__fetch_url__(f), os.path.join(release_download_path, f))
+                for f in _list if not (self.hardened and f == 'lib32.txz')
+            ]
+            files = self.__fetch_from_artifacts__(files)
+            downloader = self.__fetch_downloader__()
 
-            for f in _list:
-                if self.hardened:
-                    _file = f"{self.server}/{self.root_dir}/{f}"
+            try:
+                downloader.download_all(files)
+            finally:
+                self.__fetch_downloaded__(downloader, files)
 
-                    if f == "lib32.txz":
-                        continue
-                else:
-                    _file = f"{self.server}/{self.root_dir}/" \
-                        f"{self.release}/{f}"
-
-                if self.auth == "basic":
-                    r = requests.get(
-                        _file,
-                        auth=(self.user, self.password),
-                        verify=self.verify,
-                        stream=True)
-                elif self.auth == "digest":
-                    r = requests.get(
-                        _file,
-                        auth=requests.auth.HTTPDigestAuth(
-                            self.user, self.password),
-                        verify=self.verify,
-                        stream=True)
-                else:
-                    r = requests.get(
-                        _file, verify=self.verify, stream=True)
-
-                status = r.status_code == requests.codes.ok
-
-                if not status:
-                    r.raise_for_status()
-
-                with open(os.path.join(release_download_path, f), 'wb') as txz:
-                    file_size = int(r.headers['Content-Length'])
-                    chunk_size = 1024 * 1024
-                    total = file_size / chunk_size
-                    start = time.time()
-                    dl_progress = 0
-                    last_progress = 0
-
-                    for i, chunk in enumerate(
-                        r.iter_content(chunk_size=chunk_size), 1
-                    ):
-                        if chunk:
-                            elapsed = time.time() - start
-                            dl_progress += len(chunk)
-                            txz.write(chunk)
-
-                            progress = float(i) / float(total)
-                            if progress >= 1.:
-                                progress = 1
-                            progress = round(progress * 100, 0)
-
-                            if progress != last_progress:
-                                text = self.update_progress(
-                                    progress,
-                                    f'Downloading: {f}',
-                                    elapsed,
-                                    chunk_size
-                                )
-
-                                if progress % 10 == 0:
-                                    # Not for user output, but for callback
-                                    # heartbeats
-                                    iocage_lib.ioc_common.logit(
-                                        {
-                                            'level': 'INFO',
-                                            'message': text.rstrip()
-                                        },
-                                        _callback=self.callback,
-                                        silent=True)
-
-                            last_progress = progress
-                            start = time.time()
+    def __fetch_from_artifacts__(self, files):
+        """
+        Places current copies of (url, path) files from the artifact store,
+        returns the ones which still need to be downloaded.
+        """
+        if not self.artifacts:
+            return files
+
+        remaining = []
+        digests = self.__fetch_digests_load__()
+
+        for url, path in files:
+            try:
+                digest = self.artifacts.copy(
+                    url, path, self.__fetch_auth__(), self.verify
+                )
+            except OSError:
+                digest = None
+
+            if digest:
+                self.__fetch_digest_record__(digests, path, digest)
+            else:
+                remaining.append((url, path))
+
+        self.__fetch_digests_save__(digests)
+
+        return remaining
+
+    def __fetch_downloaded__(self, downloader, files):
+        # Whatever finished was hashed while it streamed in, __fetch_check__
+        # won't need to read it again.
+        digests = self.__fetch_digests_load__()
+
+        for url, path in files:
+            digest = downloader.digests.get(path)
+            if not digest:
+                continue
+
+            self.__fetch_digest_record__(digests, path, digest)
+            if self.artifacts:
+                try:
+                    self.artifacts.add(
+                        url, path, digest, downloader.headers.get(path)
+                    )
+                except OSError:
+                    pass
+
+        self.__fetch_digests_save__(digests)
+
+    def __fetch_progress__(self, name, done, total):
+        """Renders a single progress bar for all concurrent downloads."""
+        with self.download_lock:
+            self.download_progress[name] = (done, total)
+            done = sum(d for d, _ in self.download_progress.values())
+            total = sum(t for _, t in self.download_progress.values())
+
+            progress = round(min(done / total, 1) * 100, 0) if total else 0
+            if progress == self.download_last_progress:
+                return
+
+            now = time.time()
+            text = self.update_progress(
+                progress,
+                f'Downloading: {", ".join(sorted(self.download_progress))}',
+                max(now - self.download_last, 0.001),
+                done - self.download_last_bytes
+            )
+            self.download_last, self.download_last_bytes = now, done
+            self.download_last_progress = progress
+
+            if text and progress % 10 == 0:
+                # Not for user output, but for callback heartbeats
+                iocage_lib.ioc_common.logit(
+                    {
+                        'level': 'INFO',
+                        'message': text.rstrip()
+                    },
+                    _callback=self.callback,
+                    silent=True)
 
     def update_progress(self, progress, display_text, elapsed, chunk_size):
         """
@@ -774,9 +967,14 @@ class IOCFetch:
 
         return text
 
-    def __fetch_check_members__(self, members):
-        """Checks if the members are relative, if not, log a warning."""
-        _members = []
+    def __fetch_check_members__(self, members, dest=None):
+        """
+        Checks if the members are relative, if not, log a warning.
+
+        Parent directories are created up front when extracting several sets
+        at once, tarfile would otherwise race the other sets creating them.
+        """
+        created = set()
 
         for m in members:
             if m.name == ".":
@@ -794,31 +992,72 @@ class IOCFetch:
 
                 continue
 
-            _members.append(m)
+            parent = os.path.dirname(m.name)
+            if dest and parent not in created:
+                os.makedirs(os.path.join(dest, parent), exist_ok=True)
+                created.add(parent)
 
-        return _members
+            yield m
 
-    def fetch_extract(self, f):
-        """
-        Takes a src and dest then creates the RELEASE dataset for the data.
-        """
-        src = f"{self.iocroot}/download/{self.release}/{f}"
+    def __fetch_extract_dataset__(self):
+        """Creates the RELEASE root dataset if it does not exist yet."""
         dest = f"{self.iocroot}/releases/{self.release}/root"
 
-        dataset = f"{self.pool}/iocage/releases/{self.release}/root"
-
         if not os.path.isdir(dest):
             self.zpool.create_dataset({
-                'name': dataset, 'create_ancestors': True,
+                'name': f"{self.pool}/iocage/releases/{self.release}/root",
+                'create_ancestors': True,
                 'properties': {'compression': 'lz4'},
             })
+            # Nothing to overwrite, so extraction can skip removing the
+            # existing files first.
+            self.fresh_release = True
+
+        return dest
+
+    def fetch_extract(self, f):
+        """
+        Takes a src and dest then creates the RELEASE dataset for the data.
+        """
+        src = f"{self.iocroot}/download/{self.release}/{f}"
+        dest = self.__fetch_extract_dataset__()
 
         with tarfile.open(src) as f:
-            # Extracting over the same files is much slower then
-            # removing them first.
-            member = self.__fetch_extract_remove__(f)
-            member = self.__fetch_check_members__(member)
-            f.extractall(dest, members=member)
+            if self.fresh_release:
+                member = f
+            else:
+                # Extracting over the same files is much slower then
+                # removing them first.
+                member = self.__fetch_extract_remove__(f)
+
+            f.extractall(
+                dest, members=self.__fetch_check_members__(member, dest)
+            )
+
+    def fetch_extract_all(self, files):
+        """Extracts the given sets into the RELEASE dataset concurrently."""
+        if not files:
+            # An empty dataset would pass for a fetched RELEASE next time
+            return
+
+        self.__fetch_extract_dataset__()
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(len(files), 1)
+        ) as executor:
+            futures = []
+            for f in files:
+                iocage_lib.ioc_common.logit(
+                    {
+                        "level": "INFO",
+                        "message": f"Extracting: {f}... "
+                    },
+                    _callback=self.callback,
+                    silent=self.silent)
+                futures.append(executor.submit(self.fetch_extract, f))
+
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
 
     def fetch_update(self, cli=False, uuid=None):
         """This calls 'freebsd-update' to update the fetched RELEASE."""
@@ -893,8 +1132,7 @@ class IOCFetch:
                 "/main/usr.sbin/freebsd-update/freebsd-update.sh"
 
             tmp = tempfile.NamedTemporaryFile(delete=False)
-            with urllib.request.urlopen(f) as fbsd_update:
-                tmp.write(fbsd_update.read())
+            tmp.write(read_artifact(f))
             tmp.close()
             os.chmod(tmp.name, 0o755)
             fetch_name = tmp.name
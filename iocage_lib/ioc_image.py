@@ -22,18 +22,29 @@
 # IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 """iocage export and import module"""
+import concurrent.futures
+import contextlib
 import datetime
+import io
+import json
 import re
-import hashlib
 import os
 import subprocess as su
-import tarfile
-import zipfile
+import threading
 
 import iocage_lib.ioc_common
 import iocage_lib.ioc_json
 
+from iocage_lib.archive import (
+    ArchiveWriter, CODECS, EXTENSIONS, HashingWriter, ImageReader, codec_for
+)
 from iocage_lib.cache import cache
+from iocage_lib.dataset import Dataset, Snapshot
+from iocage_lib.zfs import list_snapshots
+
+METADATA_VERSION = 1
+# Child datasets of zip images received at once
+IMPORT_JOBS = 4
 
 
 class IOCImage(object):
@@ -43,22 +54,76 @@ class IOCImage(object):
         self.pool = iocage_lib.ioc_json.IOCJson().json_get_value("pool")
         self.iocroot = iocage_lib.ioc_json.IOCJson(
             self.pool).json_get_value("iocroot")
-        self.date = datetime.datetime.utcnow().strftime("%F")
+        # Names the images and snapshots, several exports of a day must not
+        # collide
+        self.date = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H%M%S')
         self.callback = callback
         self.silent = silent
 
-    def export_jail(self, uuid, path, compression_algo='zip'):
-        """Make a recursive snapshot of the jail and export to a file."""
+    def export_jail(
+        self, uuid, path, compression_algo='zip', threads=None,
+        incremental_from=None, intermediate=False, keep_snapshot=False
+    ):
+        """
+        Make a recursive snapshot of the jail and export to a file.
+
+        threads is how many CPUs compress in parallel for the tar based
+        formats, all of them by default.
+
+        With incremental_from only the changes since that snapshot are
+        exported (zfs send -i, or -I with intermediate). Incremental exports
+        keep their snapshot so the next one can build on it, keep_snapshot
+        does the same for full exports starting a chain.
+        """
         images = f"{self.iocroot}/images"
         name = f"{uuid}_{self.date}"
         image = f"{images}/{name}"
         export_type, jail_name = path.rsplit('/', 2)[-2:]
         image_path = f"{self.pool}/iocage/{export_type}/{jail_name}"
-        jail_list = []
-        extension = 'zip' if compression_algo == 'zip' else 'tar.xz'
+        extension = EXTENSIONS.get(compression_algo)
+
+        if extension is None:
+            iocage_lib.ioc_common.logit(
+                {
+                    'level': 'EXCEPTION',
+                    'message': f'Unknown compression algorithm: '
+                               f'{compression_algo}, use one of '
+                               f'{", ".join(EXTENSIONS)}.'
+                },
+                _callback=self.callback,
+                silent=self.silent)
+        elif compression_algo in CODECS and \
+                not CODECS[compression_algo].available():
+            iocage_lib.ioc_common.logit(
+                {
+                    'level': 'EXCEPTION',
+                    'message': f'{compression_algo} is not installed.'
+                },
+                _callback=self.callback,
+                silent=self.silent)
+
+        base = snapshots = None
+        if incremental_from:
+            keep_snapshot = True
+            base = incremental_from.rsplit('@', 1)[-1]
+            snapshots = set(list_snapshots(
+                raise_error=False, resource=image_path, recursive=True
+            ))
+
+            if f'{image_path}@{base}' not in snapshots:
+                iocage_lib.ioc_common.logit(
+                    {
+                        'level': 'EXCEPTION',
+                        'message': f'{image_path}@{base} does not exist.'
+                    },
+                    _callback=self.callback,
+                    silent=self.silent)
+
+        self.__check_image_free__(image)
 
         # Looks like foo/iocage/jails/df0ef69a-57b6-4480-b1f8-88f7b6febbdf@BAR
-        target = f"{image_path}@ioc-export-{self.date}"
+        snapshot = f'ioc-export-{self.date}'
+        target = f"{image_path}@{snapshot}"
 
         try:
             iocage_lib.ioc_common.checkoutput(
@@ -78,109 +143,261 @@ class IOCImage(object):
             stdout=su.PIPE,
             stderr=su.PIPE).communicate()[0].decode("utf-8").split()
 
-        for dataset in datasets:
-            if dataset.split("/")[-1] == jail_name:
-                _image = image
-                jail_list.append(_image)
-            else:
-                image_name = dataset.partition(f"{image_path}")[2]
-                name = image_name.replace("/", "_")
-                _image = image + name
-                jail_list.append(_image)
-                target = f"{dataset}@ioc-export-{self.date}"
-
-            # Sending each individually as sending them recursively to a file
-            # does not work how one expects.
-            try:
-                with open(_image, "wb") as export:
-                    msg = f"Exporting dataset: {dataset}"
-                    iocage_lib.ioc_common.logit(
-                        {
-                            "level": "INFO",
-                            "message": msg
-                        },
-                        self.callback,
-                        silent=self.silent)
+        final_image_path = f'{image}.{extension}'
+        iocage_lib.ioc_common.logit(
+            {
+                'level': 'INFO',
+                'message': f'Preparing compressed file: {final_image_path}.'
+            },
+            self.callback,
+            silent=self.silent)
+
+        # Every send stream goes straight into the archive, which is hashed
+        # while it is written.
+        try:
+            with open(final_image_path, 'wb') as raw:
+                output = HashingWriter(raw)
+                with ArchiveWriter.open(
+                    output, compression_algo, threads
+                ) as archive:
+                    for dataset in datasets:
+                        if dataset.split("/")[-1] == jail_name:
+                            _image = image
+                        else:
+                            image_name = dataset.partition(f"{image_path}")[2]
+                            _image = image + image_name.replace("/", "_")
+                            target = f"{dataset}@ioc-export-{self.date}"
+
+                        iocage_lib.ioc_common.logit(
+                            {
+                                "level": "INFO",
+                                "message": f"Exporting dataset: {dataset}"
+                            },
+                            self.callback,
+                            silent=self.silent)
 
-                    su.check_call(["zfs", "send", target], stdout=export)
+                        # Datasets created after the base snapshot are sent
+                        # in full
+                        if base and f'{dataset}@{base}' in snapshots:
+                            send_from = f'{dataset}@{base}'
+                        else:
+                            send_from = None
+
+                        # Member names stay what they were when the streams
+                        # were staged in files under images/
+                        self.__export_dataset__(
+                            archive, target, _image.lstrip('/'),
+                            send_from, intermediate
+                        )
+        except su.CalledProcessError as err:
+            os.remove(final_image_path)
+            iocage_lib.ioc_common.logit(
+                {
+                    "level": "EXCEPTION",
+                    "message": (err.stderr or b'').decode('utf-8').rstrip()
+                    or str(err)
+                },
+                _callback=self.callback,
+                silent=self.silent)
+        except BaseException:
+            os.remove(final_image_path)
+            raise
+
+        with open(os.path.join(images, f'{image}.sha256'), 'w') as checksum:
+            checksum.write(output.hexdigest())
+
+        metadata = {
+            'version': METADATA_VERSION,
+            'uuid': uuid,
+            'date': self.date,
+            'snapshot': snapshot,
+            'keep_snapshot': keep_snapshot,
+            'compression': compression_algo,
+            'sha256': output.hexdigest(),
+            'incremental': None,
+        }
+        if base:
+            base_image = self.__find_image__(images, uuid, base)
+            metadata['incremental'] = {
+                'from': base,
+                'intermediate': intermediate,
+                'image': base_image['image'] if base_image else None,
+                'sha256': base_image['sha256'] if base_image else None,
+            }
+
+        with open(f'{image}.json', 'w') as f:
+            json.dump(metadata, f, indent=4, sort_keys=True)
+
+        # Cleanup our mess.
+        if not keep_snapshot:
+            try:
+                target = f"{image_path}@{snapshot}"
+                iocage_lib.ioc_common.checkoutput(
+                    ["zfs", "destroy", "-r", target], stderr=su.STDOUT)
             except su.CalledProcessError as err:
+                msg = err.output.decode('utf-8').rstrip()
                 iocage_lib.ioc_common.logit(
                     {
                         "level": "EXCEPTION",
-                        "message": err
+                        "message": msg
                     },
                     _callback=self.callback,
                     silent=self.silent)
 
+        msg = f"\nExported: {image}.{extension}"
         iocage_lib.ioc_common.logit(
             {
-                'level': 'INFO',
-                'message': '\nPreparing compressed '
-                f'file: {image}.{extension}.'
+                "level": "INFO",
+                "message": msg
             },
             self.callback,
             silent=self.silent)
 
-        final_image_path = os.path.join(images, f'{image}.{extension}')
-        if compression_algo == 'zip':
-            with zipfile.ZipFile(
-                final_image_path, 'w',
-                compression=zipfile.ZIP_DEFLATED, allowZip64=True
-            ) as final:
-                for jail in jail_list:
-                    final.write(jail)
-        else:
-            with tarfile.open(final_image_path, mode='w:xz') as f:
-                for jail in jail_list:
-                    f.add(jail)
-
-        with open(final_image_path, 'rb') as import_image:
-            digest = hashlib.sha256()
-            chunk_size = 10 * 1024 * 1024
-
-            while True:
-                chunk = import_image.read(chunk_size)
+    @staticmethod
+    def __export_dataset__(
+        archive, target, name, send_from=None, intermediate=False
+    ):
+        # Sending each individually as sending them recursively to a file
+        # does not work how one expects.
+        cmd = ['zfs', 'send']
+        if send_from:
+            cmd += ['-I' if intermediate else '-i', send_from]
 
-                if chunk == b'':
-                    break
+        send = su.Popen([*cmd, target], stdout=su.PIPE, stderr=su.PIPE)
+        try:
+            archive.add_stream(name, send.stdout)
+        except BaseException:
+            send.kill()
+            raise
+        finally:
+            send.stdout.close()
 
-                digest.update(chunk)
+        _, stderr = send.communicate()
 
-            image_checksum = digest.hexdigest()
+        if send.returncode:
+            raise su.CalledProcessError(
+                send.returncode, send.args, stderr=stderr
+            )
 
-        with open(os.path.join(images, f'{image}.sha256'), 'w') as checksum:
-            checksum.write(image_checksum)
+    @staticmethod
+    def __image_stem__(filename):
+        return filename[:-len(f'.{EXTENSIONS[codec_for(filename) or "lzma"]}')]
 
-        # Cleanup our mess.
+    @classmethod
+    def __image_metadata__(cls, image_dir, filename):
+        """Metadata of an image, None for images exported without any."""
         try:
-            target = f"{self.pool}/iocage/jails/{uuid}@ioc-export-{self.date}"
-            iocage_lib.ioc_common.checkoutput(
-                ["zfs", "destroy", "-r", target], stderr=su.STDOUT)
-
-            for jail in jail_list:
-                os.remove(jail)
+            with open(os.path.join(
+                image_dir, f'{cls.__image_stem__(filename)}.json'
+            ), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
 
-        except su.CalledProcessError as err:
-            msg = err.output.decode('utf-8').rstrip()
+    def __check_image_free__(self, image):
+        """
+        Refuses to export over an existing image, an incremental export
+        or a bundle may be built on it.
+        """
+        existing = [
+            f'{image}.{e}' for e in ('json', 'sha256', *EXTENSIONS.values())
+            if os.path.exists(f'{image}.{e}')
+        ]
+        if existing:
             iocage_lib.ioc_common.logit(
                 {
-                    "level": "EXCEPTION",
-                    "message": msg
+                    'level': 'EXCEPTION',
+                    'message': f'{existing[0]} already exists, refusing to '
+                               'overwrite it.'
                 },
                 _callback=self.callback,
                 silent=self.silent)
 
-        msg = f"\nExported: {image}.{extension}"
-        iocage_lib.ioc_common.logit(
-            {
-                "level": "INFO",
-                "message": msg
-            },
-            self.callback,
-            silent=self.silent)
+    @staticmethod
+    def __find_image__(image_dir, uuid, snapshot):
+        """Metadata of the image of uuid exported at snapshot, if any."""
+        for f in sorted(os.listdir(image_dir)):
+            if not f.startswith(f'{uuid}_') or not f.endswith('.json'):
+                continue
+
+            try:
+                with open(os.path.join(image_dir, f), 'r') as m:
+                    metadata = json.load(m)
+            except (OSError, ValueError):
+                continue
+
+            image = next((
+                f'{f[:-len(".json")]}.{e}' for e in EXTENSIONS.values()
+                if os.path.isfile(
+                    os.path.join(image_dir, f'{f[:-len(".json")]}.{e}')
+                )
+            ), None)
+            if image and metadata.get('uuid') == uuid and \
+                    metadata.get('snapshot') == snapshot:
+                return {**metadata, 'image': image}
+
+        return None
+
+    def __import_chain__(self, image_dir, filename):
+        """
+        Returns [(filename, metadata)] to import in order to end up with
+        filename, walking incremental images back to one whose base is
+        already present here or to a full image.
+        """
+        metadata = self.__image_metadata__(image_dir, filename)
+        chain = [(filename, metadata)]
+
+        while metadata and metadata.get('incremental'):
+            incremental = metadata['incremental']
+            base = f'{self.pool}/iocage/jails/{metadata["uuid"]}' \
+                f'@{incremental["from"]}'
+            if Snapshot(base).exists:
+                break
+
+            base_image = incremental.get('image')
+            if not base_image or not os.path.isfile(
+                os.path.join(image_dir, base_image)
+            ):
+                iocage_lib.ioc_common.logit(
+                    {
+                        'level': 'EXCEPTION',
+                        'message': f'{filename} is incremental from {base}, '
+                                   f'import {base_image or "its base"} first.'
+                    },
+                    _callback=self.callback,
+                    silent=self.silent)
+
+            try:
+                with open(os.path.join(
+                    image_dir, f'{self.__image_stem__(base_image)}.sha256'
+                ), 'r') as f:
+                    checksum = f.read().strip()
+            except FileNotFoundError:
+                checksum = None
+
+            if checksum != incremental['sha256']:
+                iocage_lib.ioc_common.logit(
+                    {
+                        'level': 'EXCEPTION',
+                        'message': f'{base_image} is not the image {filename}'
+                                   ' was exported against, checksums differ.'
+                    },
+                    _callback=self.callback,
+                    silent=self.silent)
+
+            filename = base_image
+            metadata = self.__image_metadata__(image_dir, filename)
+            chain.insert(0, (filename, metadata))
+
+        return chain
 
     def import_jail(self, jail, compression_algo=None, path=None):
-        """Import from an iocage export."""
+        """
+        Import from an iocage export.
+
+        Incremental images are applied on top of what was imported before,
+        missing base images found next to them are imported first.
+        """
         # Path can be an absolute path pointing straight to the exported jail
         # or it can the directory where the exported jail lives
         # TODO: We should introduce parsers for this
@@ -195,11 +412,10 @@ class IOCImage(object):
         elif os.path.isfile(image_dir):
             image_dir, filename = image_dir.rsplit('/', 1)
         else:
-            if not compression_algo:
-                extension_regex = r'zip|tar\.xz'
-            else:
-                extension_regex = r'zip' if \
-                    compression_algo == 'zip' else r'tar.xz'
+            extension_regex = '|'.join(
+                re.escape(e) for a, e in EXTENSIONS.items()
+                if compression_algo in (None, a)
+            )
             regex = re.compile(rf'{jail}.*(?:{extension_regex})')
             matches = [
                 f for f in os.listdir(image_dir) if regex.match(f)
@@ -232,70 +448,260 @@ class IOCImage(object):
             else:
                 filename = matches[0]
 
-        if filename.rsplit('.', 1)[-1] == 'zip':
-            compression_algo = extension = 'zip'
-        else:
-            compression_algo = 'lzma'
-            extension = 'tar.xz'
+        metadata = self.__image_metadata__(image_dir, filename)
+        if metadata and metadata.get('type') == 'bundle':
+            self.import_bundle(image_dir, filename)
+            return
+
+        for _filename, metadata in self.__import_chain__(image_dir, filename):
+            uuid = self.__import_image__(image_dir, _filename, metadata)
+
+        self.__import_as_jail__(uuid)
+
+    def __import_as_jail__(self, uuid):
+        # Templates become jails again once imported, let's make that reality.
+        cache.reset()
+        jail_json = iocage_lib.ioc_json.IOCJson(
+            f'{self.iocroot}/jails/{uuid}', silent=True
+        )
+        if jail_json.json_get_value('type') == 'template':
+            jail_json.json_set_value('type=jail')
+            jail_json.json_set_value('template=0', _import=True)
+
+        msg = f"\nImported: {uuid}"
+        iocage_lib.ioc_common.logit(
+            {
+                "level": "INFO",
+                "message": msg
+            },
+            self.callback,
+            silent=self.silent)
+
+    def __import_state_path__(self, filename):
+        return os.path.join(
+            self.iocroot, 'images', f'{self.__image_stem__(filename)}.import'
+        )
+
+    def __import_state__(self, filename, checksum):
+        """
+        Progress of an earlier import of filename which didn't finish, it
+        only applies to the very same image.
+        """
+        try:
+            with open(self.__import_state_path__(filename), 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+
+        if state.get('sha256') != checksum:
+            state = {}
+
+        return {'sha256': checksum, 'done': [], 'tokens': {}, **state}
+
+    def __import_state_save__(self, filename, state):
+        os.makedirs(os.path.join(self.iocroot, 'images'), exist_ok=True)
+        with iocage_lib.ioc_common.open_atomic(
+            self.__import_state_path__(filename), 'w'
+        ) as f:
+            json.dump(state, f)
+
+    @staticmethod
+    def __image_dataset__(name, uuid, date):
+        """Dataset, relative to the jails dataset, an image member is for."""
+        z_dataset_type = name.split(f'{date}_', 1)[-1]
+        z_dataset_type = z_dataset_type.split(f'{uuid}_', 1)[-1]
+        if z_dataset_type == date:
+            # This is the parent dataset
+            return uuid
+
+        return f'{uuid}/{z_dataset_type.replace("_", "/")}'.rstrip('/')
+
+    def __recv__(self, dataset, chunks, aborted=False, options=()):
+        """
+        Receives one send stream into dataset with zfs recv -s. Returns None
+        on success, otherwise the receive resume token (or an empty string
+        if there is none) together with zfs's error message.
+        """
+        if aborted:
+            # Drop the partial state a failed earlier attempt left behind
+            su.run(['zfs', 'recv', '-A', dataset], stderr=su.DEVNULL)
+
+        recv = su.Popen(
+            ['zfs', 'recv', '-s', '-F', *options, dataset], stdin=su.PIPE,
+            stderr=su.PIPE
+        )
+        try:
+            for data in chunks:
+                recv.stdin.write(data)
+        except BrokenPipeError:
+            pass
+        finally:
+            try:
+                recv.stdin.close()
+            except BrokenPipeError:
+                pass
+
+        stderr = recv.stderr.read().decode(errors='replace').strip()
+        recv.wait()
+        if recv.returncode == 0:
+            return None
+
+        token = su.run(
+            ['zfs', 'get', '-H', '-o', 'value', 'receive_resume_token',
+             dataset], stdout=su.PIPE, stderr=su.DEVNULL
+        ).stdout.decode().strip()
+        return (token if token not in ('', '-') else ''), stderr
+
+    def __import_image__(self, image_dir, filename, metadata=None):
+        """
+        Receives every dataset in image, returns the jail's UUID.
+
+        Decompression is streamed straight into zfs recv -s and the image is
+        checked against its SHA256 as it is read. Which datasets were
+        received is persisted, so importing the image again after a failure
+        continues with the ones missing. Resume tokens of datasets that
+        stopped midway are kept and reported as well, they allow finishing
+        the transfer from the source with zfs send -t. Child datasets of zip
+        images are received concurrently.
+        """
+        compression_algo = codec_for(filename) or 'lzma'
+        extension = EXTENSIONS[compression_algo]
+
+        if compression_algo in CODECS and \
+                not CODECS[compression_algo].available():
+            iocage_lib.ioc_common.logit(
+                {
+                    'level': 'EXCEPTION',
+                    'message': f'{compression_algo} is required to import '
+                               f'{filename}.'
+                },
+                _callback=self.callback,
+                silent=self.silent)
 
         image_target = f"{image_dir}/{filename}"
         uuid, date = filename[:-len(f'.{extension}')].rsplit('_', 1)
+        jails = f'{self.pool}/iocage/jails'
+        fresh = not Dataset(f'{jails}/{uuid}', cache=False).exists
 
-        if compression_algo == 'zip':
-            reader = {
-                'func': zipfile.ZipFile, 'params': ['r'], 'iter': 'namelist'
-            }
-        else:
-            reader = {
-                'func': tarfile.open, 'params': ['r:xz'], 'iter': 'getmembers'
-            }
+        try:
+            with open(os.path.join(
+                image_dir, f'{self.__image_stem__(filename)}.sha256'
+            ), 'r') as f:
+                checksum = f.read().strip()
+        except FileNotFoundError:
+            checksum = None
 
-        with reader['func'](image_target, *reader['params']) as f:
-            for member in getattr(f, reader['iter'])():
-                if compression_algo != 'zip':
-                    name = member.name
-                else:
-                    name = member
+        state = self.__import_state__(filename, checksum)
+        state_lock = threading.Lock()
+        received = []
+        failed = {}
 
-                z_dataset_type = name.split(f'{date}_', 1)[-1]
-                z_dataset_type = z_dataset_type.split(f'{uuid}_', 1)[-1]
-                if z_dataset_type == date:
-                    # This is the parent dataset
-                    z_dataset_type = uuid
-                else:
-                    z_dataset_type = \
-                        f'{uuid}/{z_dataset_type.replace("_", "/")}'.rstrip(
-                            '/'
-                        )
+        def receive(name, chunks):
+            z_dataset_type = self.__image_dataset__(name, uuid, date)
+            dataset = f'{jails}/{z_dataset_type}'
 
+            if z_dataset_type in state['done'] and \
+                    Snapshot(f'{dataset}@ioc-export-{date}').exists:
                 iocage_lib.ioc_common.logit(
                     {
                         'level': 'INFO',
-                        'message': f'Importing dataset: {z_dataset_type}'
+                        'message': f'Already imported: {z_dataset_type}'
                     },
                     self.callback,
                     silent=self.silent
                 )
+                return
 
-                recv = su.Popen(
-                    [
-                        'zfs', 'recv', '-F', os.path.join(
-                            self.pool, 'iocage/jails', z_dataset_type
-                        )
-                    ], stdin=su.PIPE
-                )
+            iocage_lib.ioc_common.logit(
+                {
+                    'level': 'INFO',
+                    'message': f'Importing dataset: {z_dataset_type}'
+                },
+                self.callback,
+                silent=self.silent
+            )
 
-                chunk_size = 10 * 1024 * 1024
+            error = self.__recv__(
+                dataset, chunks, z_dataset_type in state['tokens']
+            )
+            with state_lock:
+                if error is None:
+                    received.append(dataset)
+                    state['done'].append(z_dataset_type)
+                    state['tokens'].pop(z_dataset_type, None)
+                else:
+                    failed[z_dataset_type] = error[1]
+                    state['tokens'][z_dataset_type] = error[0]
+                self.__import_state_save__(filename, state)
 
-                with (f.open(name) if compression_algo == 'zip' else f.extractfile(member)) as file:
-                    data = file.read(chunk_size)
-                    while data is not None and len(data) > 0:
-                        recv.stdin.write(data)
-                        data = file.read(chunk_size)
+        reader = ImageReader(image_target)
+        if reader.seekable:
+            # Parents have to exist before their children can be received
+            levels = {}
+            for name in reader.names():
+                levels.setdefault(
+                    self.__image_dataset__(name, uuid, date).count('/'), []
+                ).append(name)
 
-                recv.communicate()
+            for depth in sorted(levels):
+                with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=IMPORT_JOBS
+                ) as executor:
+                    for future in [
+                        executor.submit(receive, name, reader.open(name))
+                        for name in levels[depth]
+                    ]:
+                        future.result()
+
+                if failed:
+                    break
+        else:
+            streams = reader.streams()
+            try:
+                for name, chunks in streams:
+                    receive(name, chunks)
+                    if failed:
+                        break
+            finally:
+                streams.close()
+
+        if failed:
+            msg = f'Failed to import {filename}:'
+            for z_dataset_type, error in failed.items():
+                msg += f'\n  {z_dataset_type}: {error}'
+                if state['tokens'].get(z_dataset_type):
+                    msg += '\n    receive_resume_token: ' \
+                        f'{state["tokens"][z_dataset_type]}'
+            msg += '\nImporting it again continues with the datasets that' \
+                ' are still missing.'
+
+            iocage_lib.ioc_common.logit(
+                {
+                    'level': 'EXCEPTION',
+                    'message': msg
+                },
+                _callback=self.callback,
+                silent=self.silent)
+
+        if checksum and reader.hexdigest() != checksum:
+            self.__import_discard__(received, fresh, uuid, metadata)
+            os.remove(self.__import_state_path__(filename))
+            iocage_lib.ioc_common.logit(
+                {
+                    'level': 'EXCEPTION',
+                    'message': f'{filename} does not match its checksum, '
+                               'the datasets received from it were discarded.'
+                },
+                _callback=self.callback,
+                silent=self.silent)
+
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.__import_state_path__(filename))
+
+        # Cleanup our mess, unless later incremental images need it.
+        if metadata and metadata.get('keep_snapshot'):
+            return uuid
 
-        # Cleanup our mess.
         try:
             target = f"{self.pool}/iocage/jails/{uuid}@ioc-export-{date}"
 
@@ -311,20 +717,391 @@ class IOCImage(object):
                 _callback=self.callback,
                 silent=self.silent)
 
-        # Templates become jails again once imported, let's make that reality.
-        cache.reset()
-        jail_json = iocage_lib.ioc_json.IOCJson(
-            f'{self.iocroot}/jails/{uuid}', silent=True
+        return uuid
+
+    def __import_discard__(self, received, fresh, uuid, metadata):
+        """Undoes receiving the datasets of an image which turned out bad."""
+        if fresh:
+            Dataset(f'{self.pool}/iocage/jails/{uuid}').destroy(
+                recursive=True, force=True
+            )
+            return
+
+        base = ((metadata or {}).get('incremental') or {}).get('from')
+        # Children first, so parents can be destroyed if need be
+        for dataset in sorted(received, reverse=True):
+            if base and Snapshot(f'{dataset}@{base}').exists:
+                Snapshot(f'{dataset}@{base}').rollback(
+                    {'destroy_latest': True}
+                )
+            else:
+                Dataset(dataset).destroy(recursive=True, force=True)
+
+    @staticmethod
+    def __snapshot_guids__(dataset):
+        """{snapshot name: guid} of the snapshots of dataset."""
+        output = su.run(
+            ['zfs', 'list', '-H', '-p', '-t', 'snapshot', '-d', '1', '-s',
+             'createtxg', '-o', 'name,guid', dataset],
+            stdout=su.PIPE, stderr=su.DEVNULL
+        ).stdout.decode()
+
+        return dict(
+            (line.split('\t')[0].split('@', 1)[-1], line.split('\t')[1])
+            for line in output.splitlines() if '\t' in line
         )
-        if jail_json.json_get_value('type') == 'template':
-            jail_json.json_set_value('type=jail')
-            jail_json.json_set_value('template=0', _import=True)
 
-        msg = f"\nImported: {uuid}"
+    def __bundle_plan__(self, jails, snapshot):
+        """
+        Streams making up a bundle of jails, in the order they have to be
+        received.
+
+        Datasets cloned from a snapshot outside of the bundle (usually a
+        RELEASE or template) only carry their changes relative to it, the
+        datasets they were cloned from are sent once up front: the oldest
+        snapshot needed in full, the others as incrementals from the one
+        before.
+        """
+        prefix = f'{self.pool}/iocage/'
+        rows = {}
+        for uuid, image_path in jails:
+            output = su.run(
+                ['zfs', 'list', '-H', '-r', '-o', 'name,origin', image_path],
+                stdout=su.PIPE, stderr=su.PIPE
+            ).stdout.decode()
+            rows[uuid] = (image_path, [
+                line.split('\t') for line in output.splitlines()
+                if '\t' in line
+            ])
+
+        bundled = {ds for _, r in rows.values() for ds, _ in r}
+        needed = {}
+        for _, r in rows.values():
+            for _, origin in r:
+                origin_ds = origin.split('@', 1)[0]
+                if origin != '-' and origin_ds not in bundled and \
+                        origin_ds.startswith(prefix):
+                    needed.setdefault(origin_ds, set()).add(
+                        origin.split('@', 1)[1]
+                    )
+
+        streams = []
+        for origin_ds in sorted(needed):
+            previous = None
+            # Ordered by creation, incrementals only apply in that order
+            for snap, guid in self.__snapshot_guids__(origin_ds).items():
+                if snap not in needed[origin_ds]:
+                    continue
+                streams.append({
+                    'kind': 'base',
+                    'dataset': origin_ds[len(prefix):],
+                    'snapshot': snap,
+                    'from': previous,
+                    'guid': guid,
+                })
+                previous = snap
+
+        for uuid, (image_path, r) in rows.items():
+            for ds, origin in r:
+                origin_ds = origin.split('@', 1)[0]
+                streams.append({
+                    'kind': 'jail',
+                    'jail': uuid,
+                    'dataset': ds[len(image_path):],
+                    'snapshot': snapshot,
+                    'origin': origin[len(prefix):]
+                    if origin_ds in needed else None,
+                    '_source': ds,
+                })
+
+        return streams
+
+    def export_bundle(
+        self, jails, name, compression_algo='zip', threads=None
+    ):
+        """
+        Export several jails into a single image.
+
+        jails is a list of (uuid, path). Datasets the jails were cloned from
+        are sent only once and the jails as incrementals on top of them, so
+        jails sharing a RELEASE cost little more than one of them. The
+        manifest at the start of the image, which is also written next to
+        it, lists the streams in dependency order.
+        """
+        images = f"{self.iocroot}/images"
+        image = f"{images}/{name}_{self.date}"
+        extension = EXTENSIONS.get(compression_algo)
+        snapshot = f'ioc-bundle-{self.date}'
+
+        if extension is None or (
+            compression_algo in CODECS and
+            not CODECS[compression_algo].available()
+        ):
+            iocage_lib.ioc_common.logit(
+                {
+                    'level': 'EXCEPTION',
+                    'message': f'{compression_algo} is not available, use '
+                               f'one of {", ".join(EXTENSIONS)}.'
+                },
+                _callback=self.callback,
+                silent=self.silent)
+
+        self.__check_image_free__(image)
+
+        jails = [
+            (uuid, f'{self.pool}/iocage/{"/".join(path.rsplit("/", 2)[-2:])}')
+            for uuid, path in jails
+        ]
+        for _, image_path in jails:
+            try:
+                iocage_lib.ioc_common.checkoutput(
+                    ['zfs', 'snapshot', '-r', f'{image_path}@{snapshot}'],
+                    stderr=su.STDOUT)
+            except su.CalledProcessError as err:
+                iocage_lib.ioc_common.logit(
+                    {
+                        'level': 'EXCEPTION',
+                        'message': err.output.decode('utf-8').rstrip()
+                    },
+                    _callback=self.callback,
+                    silent=self.silent)
+
+        streams = self.__bundle_plan__(jails, snapshot)
+        manifest = {
+            'version': METADATA_VERSION,
+            'type': 'bundle',
+            'name': name,
+            'date': self.date,
+            'snapshot': snapshot,
+            'compression': compression_algo,
+            'jails': [uuid for uuid, _ in jails],
+            'streams': [
+                {k: v for k, v in s.items() if not k.startswith('_')}
+                for s in streams
+            ],
+        }
+
+        final_image_path = f'{image}.{extension}'
+        try:
+            with open(final_image_path, 'wb') as raw:
+                output = HashingWriter(raw)
+                with ArchiveWriter.open(
+                    output, compression_algo, threads
+                ) as archive:
+                    archive.add_stream('manifest.json', io.BytesIO(
+                        json.dumps(manifest, indent=4).encode()
+                    ))
+
+                    for i, stream in enumerate(streams):
+                        if stream['kind'] == 'base':
+                            source = f'{self.pool}/iocage/{stream["dataset"]}'
+                            target = f'{source}@{stream["snapshot"]}'
+                            send_from = stream['from'] and \
+                                f'{source}@{stream["from"]}'
+                        else:
+                            source = stream['_source']
+                            target = f'{source}@{snapshot}'
+                            send_from = stream['origin'] and \
+                                f'{self.pool}/iocage/{stream["origin"]}'
+
+                        iocage_lib.ioc_common.logit(
+                            {
+                                'level': 'INFO',
+                                'message': f'Exporting dataset: {target}'
+                            },
+                            self.callback,
+                            silent=self.silent)
+
+                        self.__export_dataset__(
+                            archive, target, f'streams/{i:04d}', send_from
+                        )
+        except su.CalledProcessError as err:
+            os.remove(final_image_path)
+            iocage_lib.ioc_common.logit(
+                {
+                    'level': 'EXCEPTION',
+                    'message': (err.stderr or b'').decode('utf-8').rstrip()
+                    or str(err)
+                },
+                _callback=self.callback,
+                silent=self.silent)
+        except BaseException:
+            os.remove(final_image_path)
+            raise
+
+        with open(f'{image}.sha256', 'w') as checksum:
+            checksum.write(output.hexdigest())
+
+        with open(f'{image}.json', 'w') as f:
+            json.dump(
+                {**manifest, 'sha256': output.hexdigest()}, f, indent=4,
+                sort_keys=True
+            )
+
+        for _, image_path in jails:
+            try:
+                iocage_lib.ioc_common.checkoutput(
+                    ['zfs', 'destroy', '-r', f'{image_path}@{snapshot}'],
+                    stderr=su.STDOUT)
+            except su.CalledProcessError as err:
+                iocage_lib.ioc_common.logit(
+                    {
+                        'level': 'EXCEPTION',
+                        'message': err.output.decode('utf-8').rstrip()
+                    },
+                    _callback=self.callback,
+                    silent=self.silent)
+
         iocage_lib.ioc_common.logit(
             {
-                "level": "INFO",
-                "message": msg
+                'level': 'INFO',
+                'message': f'\nExported: {final_image_path}'
             },
             self.callback,
             silent=self.silent)
+
+    def __bundle_bases__(self, manifest, stem):
+        """
+        Where each dataset the bundle's jails are cloned from ends up,
+        together with whether it has to be received at all.
+
+        A dataset already holding every snapshot needed (matched by GUID,
+        e.g. from importing an earlier bundle) is used as is. Received ones
+        go to their usual place unless something unrelated lives there, like
+        a RELEASE fetched on this host, then they are kept apart under
+        bundles/ so nothing existing is rolled back.
+        """
+        guids = {}
+        for stream in manifest['streams']:
+            if stream['kind'] == 'base':
+                guids.setdefault(stream['dataset'], set()).add(stream['guid'])
+
+        bases = {}
+        for dataset, needed in guids.items():
+            target = f'{self.pool}/iocage/{dataset}'
+            if not Dataset(target, cache=False).exists:
+                bases[dataset] = (target, True)
+            elif needed <= set(self.__snapshot_guids__(target).values()):
+                bases[dataset] = (target, False)
+            else:
+                bases[dataset] = (
+                    f'{self.pool}/iocage/bundles/{stem}/{dataset}', True
+                )
+
+        return bases
+
+    def import_bundle(self, image_dir, filename):
+        """Import every jail of an image created by export_bundle."""
+        stem = self.__image_stem__(filename)
+        metadata = self.__image_metadata__(image_dir, filename) or {}
+        reader = ImageReader(os.path.join(image_dir, filename))
+        streams = reader.streams()
+        imported = []
+        created = []
+
+        try:
+            name, chunks = next(streams)
+            if name != 'manifest.json':
+                iocage_lib.ioc_common.logit(
+                    {
+                        'level': 'EXCEPTION',
+                        'message': f'{filename} is not a bundle.'
+                    },
+                    _callback=self.callback,
+                    silent=self.silent)
+            manifest = json.loads(b''.join(chunks))
+
+            for uuid in manifest['jails']:
+                if Dataset(
+                    f'{self.pool}/iocage/jails/{uuid}', cache=False
+                ).exists:
+                    iocage_lib.ioc_common.logit(
+                        {
+                            'level': 'EXCEPTION',
+                            'message': f'{uuid} already exists.'
+                        },
+                        _callback=self.callback,
+                        silent=self.silent)
+
+            bases = self.__bundle_bases__(manifest, stem)
+            for target, receive in bases.values():
+                if receive:
+                    su.run(
+                        ['zfs', 'create', '-p', target.rsplit('/', 1)[0]],
+                        stderr=su.DEVNULL
+                    )
+
+            for stream, (name, chunks) in zip(manifest['streams'], streams):
+                options = ()
+                if stream['kind'] == 'base':
+                    target, receive = bases[stream['dataset']]
+                    if not receive:
+                        continue
+                    if stream['from'] is None:
+                        created.append(target)
+                else:
+                    target = f'{self.pool}/iocage/jails/{stream["jail"]}' \
+                        f'{stream["dataset"]}'
+                    if stream['origin']:
+                        origin_ds, origin_snap = stream['origin'].split('@')
+                        options = (
+                            '-o',
+                            f'origin={bases[origin_ds][0]}@{origin_snap}'
+                        )
+                    if stream['jail'] not in imported:
+                        imported.append(stream['jail'])
+
+                iocage_lib.ioc_common.logit(
+                    {
+                        'level': 'INFO',
+                        'message': f'Importing dataset: {target}'
+                    },
+                    self.callback,
+                    silent=self.silent
+                )
+
+                error = self.__recv__(target, chunks, options=options)
+                if error is not None:
+                    iocage_lib.ioc_common.logit(
+                        {
+                            'level': 'EXCEPTION',
+                            'message': f'Failed to import {target} from '
+                                       f'{filename}: {error[1]}'
+                        },
+                        _callback=self.callback,
+                        silent=self.silent)
+
+            # Read up to the end so the checksum covers all of it
+            for _ in streams:
+                pass
+        except BaseException:
+            self.__bundle_discard__(imported, created)
+            raise
+        finally:
+            streams.close()
+
+        if metadata.get('sha256') and \
+                reader.hexdigest() != metadata['sha256']:
+            self.__bundle_discard__(imported, created)
+            iocage_lib.ioc_common.logit(
+                {
+                    'level': 'EXCEPTION',
+                    'message': f'{filename} does not match its checksum, '
+                               'the jails received from it were discarded.'
+                },
+                _callback=self.callback,
+                silent=self.silent)
+
+        for uuid in manifest['jails']:
+            Snapshot(
+                f'{self.pool}/iocage/jails/{uuid}@{manifest["snapshot"]}'
+            ).destroy(recursive=True, force=False)
+            self.__import_as_jail__(uuid)
+
+    def __bundle_discard__(self, imported, created):
+        for uuid in imported:
+            Dataset(f'{self.pool}/iocage/jails/{uuid}').destroy(
+                recursive=True, force=True
+            )
+        for dataset in created:
+            Dataset(dataset).destroy(recursive=True, force=True)
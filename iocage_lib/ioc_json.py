@@ -46,6 +46,7 @@ import netifaces
 import random
 import pathlib
 
+from iocage_lib.catalog import JailCatalog
 from iocage_lib.dataset import Dataset
 from iocage_lib.pools import PoolListableResource, Pool
 from iocage_lib.snapshot import Snapshot
@@ -666,6 +667,9 @@ class IOCConfiguration:
                     exception=ioc_exceptions.CommandFailed
                 )
 
+        if not defaults and _file == '/config.json':
+            JailCatalog(self.iocroot, self.pool).update(self.location)
+
     def fix_properties(self, conf):
         """
         Takes a conf file and makes sure any property that has a bad value
@@ -1124,10 +1128,10 @@ class IOCConfiguration:
             'host_domainname': 'none',
             'exec_fib': '0',
             'ip4_addr': 'none',
-            'ip4_saddrsel': '1',
+            'ip4_saddrsel': 1,
             'ip4': 'new',
             'ip6_addr': 'none',
-            'ip6_saddrsel': '1',
+            'ip6_saddrsel': 1,
             'ip6': 'new',
             'defaultrouter': 'auto',
             'defaultrouter6': 'auto',
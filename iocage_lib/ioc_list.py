@@ -33,7 +33,10 @@ import iocage_lib.ioc_json
 import iocage_lib.ioc_plugin
 import texttable
 
+from iocage_lib.cache import cache
+from iocage_lib.catalog import JailCatalog
 from iocage_lib.dataset import Dataset
+from iocage_lib.plugin_index import PluginIndex
 
 
 class IOCList(object):
@@ -67,88 +70,116 @@ class IOCList(object):
         """Lists the datasets of given type."""
         if self.list_type == "base":
             ds = Dataset(f"{self.pool}/iocage/releases").get_dependents()
-        elif self.list_type == "template":
-            ds = Dataset(
-                f"{self.pool}/iocage/templates").get_dependents()
-        else:
-            ds = Dataset(f"{self.pool}/iocage/jails").get_dependents()
 
-        ds = list(ds)
+            return self.list_bases(list(ds))
+
+        catalog = JailCatalog(self.iocroot, self.pool)
+        jails = catalog.jails()
+
+        if self.list_type == "uuid":
+            # Unmounted jails only show up in ZFS
+            uuids = {
+                **self.jail_mountpoints('jails'),
+                **self.jail_mountpoints('templates'),
+            }
+            uuids.update({name: jail['path'] for name, jail in jails.items()})
+
+            # In dataset order, as zfs lists them
+            return dict(sorted(uuids.items()))
 
-        if self.list_type in ('all', 'basejail', 'template'):
+        location = 'templates' if self.list_type == 'template' else 'jails'
+        # Jails the catalog can't index: unmounted ones and ones from before
+        # config.json existed.
+        missing = {
+            uuid: m for uuid, m in self.jail_mountpoints(location).items()
+            if uuid not in jails
+        }
+
+        for uuid, mountpoint in missing.items():
             if self.quick:
-                _all = self.list_all_quick(ds)
-            else:
-                _all = self.list_all(ds)
+                # Converting is left to a full list
+                jail = Dataset(f'{self.pool}/iocage/{location}/{uuid}')
+                if not jail.mounted:
+                    jail.mount()
+                continue
 
-            return _all
-        elif self.list_type == "uuid":
-            jails = {}
+            # IOCJson mounts the dataset and converts jails from before
+            # config.json, the catalog then picks the result up.
+            try:
+                iocage_lib.ioc_json.IOCJson(mountpoint).json_get_value('all')
+            except (Exception, SystemExit):
+                pass
 
-            for jail in ds:
-                uuid = jail.name.rsplit("/", 1)[-1]
-                try:
-                    jails[uuid] = jail.properties["mountpoint"]
-                except KeyError:
-                    iocage_lib.ioc_common.logit(
-                        {
-                            'level': 'ERROR',
-                            'message': f'{jail.name} mountpoint is '
-                            'misconfigured. Please correct this.'
-                        },
-                        _callback=self.callback,
-                        silent=self.silent
-                    )
-
-            template_datasets = Dataset(
-                f'{self.pool}/iocage/templates').get_dependents()
-
-            for template in template_datasets:
-                uuid = template.name.rsplit("/", 1)[-1]
-                jails[uuid] = template.properties['mountpoint']
-
-            return jails
-        elif self.list_type == "base":
-            bases = self.list_bases(ds)
-
-            return bases
+        if missing:
+            jails = catalog.jails()
 
-    def list_all_quick(self, jails):
-        """Returns a table of jails with minimal processing"""
-        jail_list = []
+        for uuid, mountpoint in missing.items():
+            if uuid in jails:
+                continue
+
+            if self.quick:
+                iocage_lib.ioc_common.logit({
+                    "level": "EXCEPTION",
+                    "message": f"{uuid} is missing its configuration file."
+                               "\nPlease run just 'list' instead to create"
+                               " it."
+                }, _callback=self.callback,
+                    silent=self.silent)
+
+            jails[uuid] = {
+                'name': uuid, 'path': mountpoint, 'location': location,
+                'template': '-', 'corrupt': True,
+            }
+
+        jails = [j for j in jails.values() if j['location'] == location]
+
+        if self.quick:
+            return self.list_all_quick(jails)
+
+        return self.list_all(jails)
+
+    def jail_mountpoints(self, location):
+        """
+        Returns {uuid: mountpoint} of the jail datasets under location, from
+        the ZFS properties cached for the whole iocage dataset.
+        """
+        parent = f'{self.pool}/iocage/{location}/'
+        mountpoints = {}
+
+        for name, props in cache.datasets.items():
+            uuid = name[len(parent):]
+            if not name.startswith(parent) or '/' in uuid:
+                continue
+
+            if props.get('encryption', 'off') != 'off' and \
+                    props.get('keystatus', 'available') != 'available':
+                # Can't be mounted until its key is loaded
+                continue
 
-        for jail in jails:
             try:
-                mountpoint = jail.properties['mountpoint']
+                mountpoints[uuid] = props['mountpoint']
             except KeyError:
                 iocage_lib.ioc_common.logit(
                     {
                         'level': 'ERROR',
-                        'message': f'{jail.name} mountpoint is misconfigured. '
-                        'Please correct this.'
+                        'message': f'{name} mountpoint is '
+                        'misconfigured. Please correct this.'
                     },
                     _callback=self.callback,
                     silent=self.silent
                 )
-                continue
 
-            try:
-                with open(f"{mountpoint}/config.json", "r") as loc:
-                    conf = json.load(loc)
-            except FileNotFoundError:
-                uuid = mountpoint.rsplit("/", 1)[-1]
-                iocage_lib.ioc_common.logit({
-                    "level": "EXCEPTION",
-                    "message": f"{uuid} is missing its configuration file."
-                               "\nPlease run just 'list' instead to create"
-                               " it."
-                }, _callback=self.callback,
-                    silent=self.silent)
-            except (Exception, SystemExit):
+        return mountpoints
+
+    def list_all_quick(self, jails):
+        """Returns a table of jails with minimal processing"""
+        jail_list = []
+
+        for conf in jails:
+            if conf['corrupt']:
                 # Jail is corrupt, we want the user to know
                 conf = {
-                    'host_hostuuid':
-                        f'{mountpoint.rsplit("/", 1)[-1]} - CORRUPTED',
+                    'host_hostuuid': f'{conf["name"]} - CORRUPTED',
                     'ip4_addr': 'N/A',
                     'dhcp': 'N/A'
                 }
@@ -193,26 +224,11 @@ class IOCList(object):
         plugin_index_data = {}
 
         for jail in jails:
-            try:
-                mountpoint = jail.properties['mountpoint']
-            except KeyError:
-                iocage_lib.ioc_common.logit(
-                    {
-                        'level': 'ERROR',
-                        'message': f'{jail.name} mountpoint is misconfigured. '
-                        'Please correct this.'
-                    },
-                    _callback=self.callback,
-                    silent=self.silent
-                )
-                continue
+            mountpoint = jail['path']
+            conf = jail
+            state = ''
 
-            try:
-                conf = iocage_lib.ioc_json.IOCJson(mountpoint).json_get_value(
-                    'all'
-                )
-                state = ''
-            except (Exception, SystemExit):
+            if jail['corrupt']:
                 # Jail is corrupt, we want all the keys to exist.
                 # So we will take the defaults and let the user
                 # know that they are not correct.
@@ -224,11 +240,19 @@ class IOCList(object):
                     x: 'N/A'
                     for x in def_props
                 }
-                conf['host_hostuuid'] = \
-                    f'{jail.name.split("/")[-1]}'
+                conf['host_hostuuid'] = jail['name']
                 conf['release'] = 'N/A'
                 state = 'CORRUPT'
                 jid = '-'
+            elif self.plugin:
+                # Plugins need the complete configuration for their portal
+                # and repository information.
+                try:
+                    conf = iocage_lib.ioc_json.IOCJson(
+                        mountpoint
+                    ).json_get_value('all')
+                except (Exception, SystemExit):
+                    conf = jail
 
             if self.basejail_only and not iocage_lib.ioc_common.check_truthy(
                 conf.get('basejail', 0)
@@ -284,24 +308,7 @@ class IOCList(object):
                 jid = active_jails.get(f'ioc-{uuid.replace(".", "_")}', {}).get('jid')
                 state = 'up' if jid else 'down'
 
-            if conf["type"] == "template":
-                template = "-"
-            else:
-                jail_root = Dataset(f'{jail.name}/root')
-                if jail_root.exists:
-                    _origin_property = jail_root.properties.get('origin')
-                else:
-                    _origin_property = None
-
-                if _origin_property:
-                    template = _origin_property
-                    template = template.rsplit("/root@", 1)[0].rsplit(
-                        "/", 1)[-1]
-                else:
-                    template = "-"
-
-            if "release" in template.lower() or "stable" in template.lower():
-                template = "-"
+            template = jail.get('template', '-')
 
             ip_dict = iocage_lib.ioc_common.retrieve_ip4_for_jail(conf, bool(jid))
             full_ip4 = ip_dict['full_ip4'] or full_ip4
@@ -375,7 +382,8 @@ class IOCList(object):
                         index_path = os.path.join(
                             repo_obj.git_destination, 'INDEX'
                         )
-                        if not os.path.exists(index_path):
+                        index = PluginIndex(repo_obj.git_destination).index
+                        if index is None:
                             iocage_lib.ioc_common.logit(
                                 {
                                     'level': 'ERROR',
@@ -386,14 +394,9 @@ class IOCList(object):
                                 _callback=self.callback,
                                 silent=self.silent
                             )
-                            plugin_index_data[
-                                conf['plugin_repository']
-                            ] = {}
-                        else:
-                            with open(index_path) as f:
-                                plugin_index_data[
-                                    conf['plugin_repository']
-                                ] = json.loads(f.read())
+                        plugin_index_data[
+                            conf['plugin_repository']
+                        ] = index or {}
                     elif not plugin_index_data[conf['plugin_repository']]:
                         iocage_lib.ioc_common.logit(
                             {
@@ -26,19 +26,16 @@ import collections
 import concurrent.futures
 import contextlib
 import datetime
-import distutils.dir_util
+import fcntl
 import json
 import logging
 import os
-import git
 import pathlib
 import re
 import shutil
 import subprocess as su
-import requests
-import tarfile
-import tempfile
 import threading
+import time
 import urllib.parse
 import uuid
 
@@ -56,10 +53,20 @@ import texttable
 
 from iocage_lib.cache import cache
 from iocage_lib.dataset import Dataset
+from iocage_lib.lazy import lazy_import
+from iocage_lib.packagesite import PackageSite
+from iocage_lib.plugin_index import PluginIndex
 
+git = lazy_import('git')
+requests = lazy_import('requests')
 
 GIT_LOCK = threading.Lock()
-RE_PLUGIN_VERSION = re.compile(r'"path":"([/\.\+,\d\w-]*)\.txz"')
+# Held while artifacts shared between updates of several jails are cloned
+# and while a missing RELEASE is fetched for a plugin upgrade
+ARTIFACT_LOCK = threading.Lock()
+RELEASE_LOCK = threading.Lock()
+# Seconds a synced plugin repository clone is used without syncing again
+DEFAULT_PLUGIN_SYNC_TTL = 600
 
 
 class IOCPlugin(object):
@@ -102,6 +109,10 @@ class IOCPlugin(object):
         self.silent = silent
         self.callback = callback
         self.keep_jail_on_failure = keep_jail_on_failure
+        # {artifact: local clone} shared by the plugins updated together, an
+        # artifact is cloned once for all of them instead of once per jail
+        self.artifacts = kwargs.get('artifacts')
+        self.rolled_back = False
         self.thickconfig = kwargs.pop('thickconfig', False)
         self.log = logging.getLogger('iocage')
 
@@ -117,6 +128,14 @@ class IOCPlugin(object):
             'git_repository'
         ) or 'https://github.com/freenas/iocage-ix-plugins.git'
 
+        self.refresh = kwargs.get('refresh', False)
+        self.sync_ttl = kwargs.get('sync_ttl')
+        if self.sync_ttl is None:
+            self.sync_ttl = iocage_lib.ioc_common.try_convert(
+                os.environ.get('IOCAGE_PLUGIN_SYNC_TTL'),
+                DEFAULT_PLUGIN_SYNC_TTL, int
+            )
+
         self.git_destination = kwargs.get('git_destination')
         if not self.git_destination:
             # If not provided, we use git repository uri and split on scheme
@@ -126,6 +145,10 @@ class IOCPlugin(object):
                 self.iocroot, '.plugins', self.git_repository.split(
                     '://', 1)[-1].replace('/', '_').replace('.', '_')
             )
+        # Clones never start with a dot, see above
+        self.packagesite_cache_dir = os.path.join(
+            self.iocroot, '.plugins', '.packagesites'
+        )
 
         if self.branch is None and not self.hardened:
             r = cache.freebsd_version
@@ -135,45 +158,80 @@ class IOCPlugin(object):
             # Backwards compat
             self.branch = 'master'
 
-    def pull_clone_git_repo(self, depth=None):
-        self._clone_repo(
-            self.branch, self.git_repository, self.git_destination,
-            depth, self.callback
-        )
+    @contextlib.contextmanager
+    def _repo_lock(self):
+        """Keeps other iocage processes from syncing the same clone."""
+        os.makedirs(os.path.dirname(self.git_destination), exist_ok=True)
+        with open(f'{self.git_destination}.lock', 'a') as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    @property
+    def _sync_stamp_path(self):
+        return f'{self.git_destination}.sync.json'
+
+    def _synced_recently(self):
+        if not os.path.isdir(self.git_destination):
+            return False
+
+        try:
+            with open(self._sync_stamp_path, 'r') as f:
+                stamp = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        age = time.time() - stamp.get('synced', 0)
+        return stamp.get('repository') == self.git_repository and \
+            stamp.get('branch') == self.branch and 0 <= age < self.sync_ttl
+
+    def pull_clone_git_repo(self, depth=1, refresh=None):
+        """
+        Brings the plugin repository clone up to date, unless that already
+        happened within sync_ttl seconds. refresh (or --refresh) syncs
+        regardless, updates and upgrades always do.
+        """
+        refresh = self.refresh if refresh is None else refresh
+        if not refresh and self._synced_recently():
+            return
+
+        with contextlib.ExitStack() as stack:
+            try:
+                stack.enter_context(self._repo_lock())
+            except OSError:
+                # Not root, there is no writing the clone either way
+                pass
+
+            # Someone else may have synced while we waited
+            if not refresh and self._synced_recently():
+                return
+
+            synced = self._clone_repo(
+                self.branch, self.git_repository, self.git_destination,
+                depth, self.callback
+            )
+            if synced:
+                with contextlib.suppress(OSError):
+                    with iocage_lib.ioc_common.open_atomic(
+                        self._sync_stamp_path, 'w'
+                    ) as f:
+                        json.dump({
+                            'repository': self.git_repository,
+                            'branch': self.branch,
+                            'synced': time.time(),
+                        }, f)
 
     @staticmethod
-    def fetch_plugin_packagesites(package_sites):
+    def fetch_plugin_packagesites(package_sites, cache_dir=None):
         def download_parse_packagesite(packagesite_url):
-            package_site_data = {}
-
             try:
-                with tempfile.TemporaryDirectory() as tmpdir:
-                    packagesite_txz_path = os.path.join(tmpdir, 'packagesite.txz')
-                    with requests.get(
-                        f'{packagesite_url}/packagesite.txz', stream=True, timeout=300
-                    ) as r:
-                        r.raise_for_status()
-                        with open(packagesite_txz_path, 'wb') as f:
-                            shutil.copyfileobj(r.raw, f)
-
-                    with tarfile.open(packagesite_txz_path) as p_file:
-                        p_file.extractall(path=tmpdir)
-
-                    packagesite_path = os.path.join(tmpdir, 'packagesite.yaml')
-                    if not os.path.exists(packagesite_path):
-                        raise FileNotFoundError(f'{packagesite_path} not found')
-
-                    with open(packagesite_path, 'r') as f:
-                        for line in f.read().split('\n'):
-                            searched = RE_PLUGIN_VERSION.findall(line)
-                            if not searched:
-                                continue
-                            name = searched[0].rsplit('/', 1)[-1]
-                            package_site_data[
-                                name.rsplit('-', 1)[0]
-                            ] = iocage_lib.ioc_common.parse_package_name(name)
+                package_site_data = PackageSite(
+                    packagesite_url, cache_dir
+                ).packages()
             except Exception:
-                pass
+                package_site_data = {}
 
             return packagesite_url, package_site_data
 
@@ -193,10 +251,12 @@ class IOCPlugin(object):
         return plugin_packagesite_mapping
 
     @staticmethod
-    def fetch_plugin_versions_from_plugin_index(plugins_index):
+    def fetch_plugin_versions_from_plugin_index(
+        plugins_index, cache_dir=None
+    ):
         plugin_packagesite_mapping = IOCPlugin.fetch_plugin_packagesites([
             v['packagesite'] for v in plugins_index.values()
-        ])
+        ], cache_dir)
 
         version_dict = {}
         for plugin in plugins_index:
@@ -221,23 +281,17 @@ class IOCPlugin(object):
     @staticmethod
     def retrieve_plugin_index_data(plugin_index_path, expand_abi=True):
         plugin_index = {}
-        index_path = os.path.join(plugin_index_path, 'INDEX')
-        if not os.path.exists(index_path):
+        repo_index = PluginIndex(plugin_index_path)
+        index = repo_index.index
+        if not index:
             return plugin_index
 
-        with open(index_path, 'r') as f:
-            index = json.loads(f.read())
-
+        manifests = repo_index.manifests
         for plugin in index:
-            plugin_manifest_path = os.path.join(
-                plugin_index_path, index[plugin]['MANIFEST']
-            )
-            if not os.path.exists(plugin_manifest_path):
+            plugin_manifest_data = manifests.get(index[plugin]['MANIFEST'])
+            if plugin_manifest_data is None:
                 continue
 
-            with open(plugin_manifest_path, 'r') as f:
-                plugin_manifest_data = json.loads(f.read())
-
             if not any(plugin_manifest_data.get(k) for k in ('release', 'packagesite')):
                 continue
 
@@ -254,6 +308,30 @@ class IOCPlugin(object):
 
         return plugin_index
 
+    @staticmethod
+    def validate_plugin_index(plugin_index_path):
+        """
+        Validates the manifest of every plugin in the INDEX of the repository
+        clone, returns {plugin: errors} of those which are invalid.
+        """
+        repo_index = PluginIndex(plugin_index_path)
+        index = repo_index.index or {}
+        manifests = repo_index.manifests
+
+        invalid = {}
+        plugin_manifests = {}
+        for plugin, entry in index.items():
+            manifest = entry.get('MANIFEST') if isinstance(entry, dict) else None
+            if manifest not in manifests:
+                invalid[plugin] = [f'Manifest {manifest} not found']
+            else:
+                plugin_manifests[plugin] = manifests[manifest]
+
+        invalid.update(
+            iocage_lib.ioc_common.validate_plugin_manifests(plugin_manifests)
+        )
+        return invalid
+
     @staticmethod
     def expand_abi_with_specified_release(packagesite, release):
         return packagesite.replace(
@@ -265,7 +343,9 @@ class IOCPlugin(object):
 
         plugin_index = self.retrieve_plugin_index_data(self.git_destination)
 
-        return self.fetch_plugin_versions_from_plugin_index(plugin_index)
+        return self.fetch_plugin_versions_from_plugin_index(
+            plugin_index, self.packagesite_cache_dir
+        )
 
     def retrieve_plugin_json(self):
         if not self.plugin_json_path:
@@ -894,7 +974,8 @@ fingerprint: {fingerprint}
         self.pull_clone_git_repo()
 
         index_path = os.path.join(self.git_destination, 'INDEX')
-        if not os.path.exists(index_path):
+        plugins = PluginIndex(self.git_destination).index
+        if plugins is None:
             # Gracefully handle index not existing bit
             iocage_lib.ioc_common.logit(
                 {
@@ -906,9 +987,6 @@ fingerprint: {fingerprint}
                 _callback=self.callback,
                 silent=self.silent
             )
-        else:
-            with open(index_path, 'r') as plugins:
-                plugins = json.load(plugins)
 
         if index_only:
             return plugins
@@ -1075,7 +1153,7 @@ fingerprint: {fingerprint}
             self.stop_rc()
             self.start_rc()
 
-    def update(self, jid):
+    def update(self, jid, pull=True):
         iocage_lib.ioc_common.logit(
             {
                 "level": "INFO",
@@ -1098,7 +1176,8 @@ fingerprint: {fingerprint}
             },
             _callback=self.callback,
             silent=self.silent)
-        self.pull_clone_git_repo()
+        if pull:
+            self.pull_clone_git_repo(refresh=True)
 
         plugin_conf = self._load_plugin_json()
         self.__check_manifest__(plugin_conf, upgrade=False)
@@ -1173,7 +1252,15 @@ fingerprint: {fingerprint}
         shutil.rmtree(f"{path}/plugin", ignore_errors=True)
 
         uri = urllib.parse.urlparse(plugin_conf['artifact'])
-        if uri.scheme == 'file':
+        shared_artifact = self.__shared_artifact__(plugin_conf['artifact'])
+        if shared_artifact:
+            shutil.copytree(
+                shared_artifact,
+                os.path.join(path, 'plugin'),
+                symlinks=True,
+                dirs_exist_ok=True
+            )
+        elif uri.scheme == 'file':
             artifact_path = urllib.parse.unquote(uri.path)
             if not os.path.exists(artifact_path):
                 iocage_lib.ioc_common.logit(
@@ -1185,9 +1272,10 @@ fingerprint: {fingerprint}
                     silent=self.silent
                 )
 
-            distutils.dir_util.copy_tree(
+            shutil.copytree(
                 artifact_path,
-                os.path.join(path, 'plugin')
+                os.path.join(path, 'plugin'),
+                dirs_exist_ok=True
             )
         else:
             self._clone_repo(
@@ -1197,15 +1285,12 @@ fingerprint: {fingerprint}
 
         if os.path.isdir(f"{path}/plugin/overlay/"):
             try:
-                # Quickfix for distutils cache bug making re-installed
-                # plugins with same name fail to copy the overlay folder
-                distutils.dir_util._path_created = {}
-
-                distutils.dir_util.copy_tree(
+                shutil.copytree(
                     f"{path}/plugin/overlay/",
                     f"{path}/root",
-                    preserve_symlinks=True)
-            except distutils.errors.DistutilsFileError as e:
+                    symlinks=True,
+                    dirs_exist_ok=True)
+            except OSError as e:
                 # Copy tree should succeed if the overlay folder exists
                 iocage_lib.ioc_common.logit(
                     {
@@ -1216,6 +1301,60 @@ fingerprint: {fingerprint}
                     silent=self.silent
                 )
 
+    def __shared_artifact__(self, artifact):
+        """
+        Local clone of artifact shared with the other plugins updated
+        together, None if there is none and the jail clones it itself.
+
+        A failed clone is reported once and fails every jail using it, they
+        would only fail the same way cloning it themselves.
+        """
+        if self.artifacts is None or \
+                urllib.parse.urlparse(artifact).scheme == 'file':
+            return None
+
+        with ARTIFACT_LOCK:
+            if artifact not in self.artifacts:
+                # Clones never start with a dot, see __init__
+                destination = os.path.join(
+                    self.iocroot, '.plugins', '.artifacts', artifact.split(
+                        '://', 1)[-1].replace('/', '_').replace('.', '_')
+                )
+                try:
+                    synced = self._clone_repo(
+                        self.branch, artifact, destination, depth=1,
+                        callback=self.callback
+                    )
+                except (git.exc.GitError, RuntimeError):
+                    synced = False
+
+                self.artifacts[artifact] = destination \
+                    if synced and os.path.isdir(destination) else None
+                if not self.artifacts[artifact]:
+                    iocage_lib.ioc_common.logit(
+                        {
+                            'level': 'ERROR',
+                            'message': f'Cloning {artifact} failed, the '
+                                       'plugins using it are not updated.'
+                        },
+                        _callback=self.callback,
+                        silent=self.silent
+                    )
+
+            destination = self.artifacts[artifact]
+
+        if not destination:
+            iocage_lib.ioc_common.logit(
+                {
+                    'level': 'EXCEPTION',
+                    'message': f'{self.jail}: {artifact} could not be cloned!'
+                },
+                _callback=self.callback,
+                silent=self.silent
+            )
+
+        return destination
+
     def __update_pkg_remove__(self, jid):
         """Remove all pkgs from the plugin"""
         try:
@@ -1271,7 +1410,7 @@ fingerprint: {fingerprint}
             self.__rollback_jail__(name='update')
             raise
 
-    def upgrade(self, jid):
+    def upgrade(self, jid, pull=True):
         iocage_lib.ioc_common.logit(
             {
                 "level": "INFO",
@@ -1294,7 +1433,8 @@ fingerprint: {fingerprint}
             },
             _callback=self.callback,
             silent=self.silent)
-        self.pull_clone_git_repo()
+        if pull:
+            self.pull_clone_git_repo(refresh=True)
 
         plugin_conf = self._load_plugin_json()
         self.__check_manifest__(plugin_conf, upgrade=True)
@@ -1313,17 +1453,19 @@ fingerprint: {fingerprint}
 
         release_p = pathlib.Path(f"{self.iocroot}/releases/{plugin_release}")
 
-        if not release_p.exists():
-            iocage_lib.ioc_common.check_release_newer(
-                plugin_release, self.callback, self.silent)
-            iocage_lib.ioc_common.logit(
-                {
-                    "level": "WARNING",
-                    "message": "New plugin RELEASE missing, fetching now... "
-                },
-                _callback=self.callback,
-                silent=self.silent)
-            self.__fetch_release__(plugin_release)
+        with RELEASE_LOCK:
+            if not release_p.exists():
+                iocage_lib.ioc_common.check_release_newer(
+                    plugin_release, self.callback, self.silent)
+                iocage_lib.ioc_common.logit(
+                    {
+                        "level": "WARNING",
+                        "message":
+                        "New plugin RELEASE missing, fetching now... "
+                    },
+                    _callback=self.callback,
+                    silent=self.silent)
+                self.__fetch_release__(plugin_release)
 
         path = f"{self.iocroot}/jails/{self.jail}/root"
 
@@ -1341,7 +1483,8 @@ fingerprint: {fingerprint}
             snapshot=False, snap_name=f'ioc_plugin_upgrade_{self.date}'
         )
 
-        self.update(jid)
+        # The INDEX was pulled above already
+        self.update(jid, pull=False)
 
         return new_release
 
@@ -1370,6 +1513,7 @@ fingerprint: {fingerprint}
 
         iocage.stop()
         iocage.rollback(name)
+        self.rolled_back = True
 
     def _plugin_json_file(self):
         plugin_name = self.plugin.rsplit('_', 1)[0]
@@ -1439,12 +1583,9 @@ fingerprint: {fingerprint}
                 },
                 _callback=self.callback)
 
-        jsons = pathlib.Path(self.git_destination).glob('*.json')
-
-        for f in jsons:
-            _conf = json.loads(pathlib.Path(f).open('r').read())
-
-            if _conf['name'] == p_name:
+        manifests = PluginIndex(self.git_destination).manifests
+        for path, _conf in manifests.items():
+            if '/' not in path and _conf['name'] == p_name:
                 return _conf
 
         iocage_lib.ioc_common.logit(
@@ -1541,14 +1682,23 @@ fingerprint: {fingerprint}
                 ) and not IOCPlugin._verify_git_repo(repo_url, destination):
                     raise git.exc.InvalidGitRepositoryError()
 
-                # "Pull"
+                # "Pull", fetching only the tips of the branches when
+                # shallow. A shallow history can't be merged, so the branch
+                # is reset to what was fetched instead.
                 repo = git.Repo(destination)
                 origin = repo.remotes.origin
-                ref = 'master' if f'origin/{ref}' not in repo.refs else ref
-                for command in [
-                    ['checkout', ref],
-                    ['pull']
-                ]:
+                commands = [
+                    ['fetch', '--prune', *(
+                        ['--depth', str(depth)] if depth else []
+                    ), 'origin'],
+                    ['checkout', '-f', '-B', ref, f'origin/{ref}'],
+                ]
+                for command in commands:
+                    if command[0] == 'checkout' and \
+                            f'origin/{ref}' not in repo.refs:
+                        ref = 'master'
+                        command[3:] = [ref, f'origin/{ref}']
+
                     iocage_lib.ioc_exec.SilentExec(
                         ['git', '-C', destination] + command,
                         None, unjailed=True, decode=True,
@@ -1600,11 +1750,17 @@ fingerprint: {fingerprint}
                                        'network issues.'
                         }
                     )
-                    return
+                    return False
 
-                # Clone
+                # Clone. Shallow clones still get the tip of every branch, so
+                # switching releases needs no new clone, but only the blobs
+                # of the one checked out.
                 shutil.rmtree(destination, ignore_errors=True)
-                kwargs = {'env': os.environ.copy(), 'depth': depth}
+                kwargs = {
+                    'env': os.environ.copy(), 'depth': depth,
+                    'no_single_branch': bool(depth),
+                    'filter': 'blob:none' if depth else None,
+                }
                 repo = git.Repo.clone_from(
                     repo_url, destination, **{
                         k: v for k, v in kwargs.items() if v
@@ -1640,3 +1796,5 @@ fingerprint: {fingerprint}
 
             # Time to make this reality
             repo.git.checkout(ref)
+
+        return True
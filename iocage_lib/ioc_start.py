@@ -34,12 +34,14 @@ import subprocess as su
 import netifaces
 import ipaddress
 import logging
+import time
 
 import iocage_lib.ioc_common
 import iocage_lib.ioc_exec
 import iocage_lib.ioc_json
 import iocage_lib.ioc_list
 import iocage_lib.ioc_stop
+import iocage_lib.metrics
 import iocage_lib.ioc_exceptions as ioc_exceptions
 
 
@@ -124,6 +126,7 @@ class IOCStart(object):
                 }, _callback=self.callback, silent=self.silent)
                 return
 
+        started, start_time = time.time(), time.monotonic()
         mount_procfs = self.conf["mount_procfs"]
         host_domainname = self.conf["host_domainname"]
         host_hostname = self.conf["host_hostname"]
@@ -1002,6 +1005,11 @@ class IOCStart(object):
                     'message': f'  + Failed to set cpuset to: {cpuset}'
                 })
 
+        iocage_lib.metrics.record_start(
+            self.iocroot, self.jail_uuid, started,
+            time.monotonic() - start_time
+        )
+
     def check_aliases(self, ip_addrs, mode='4'):
         """
         Check if the alias already exists for given IP's, otherwise add
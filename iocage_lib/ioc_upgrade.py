@@ -29,12 +29,13 @@ import os
 import pathlib
 import subprocess as su
 import tempfile
-import urllib.request
 
 import iocage_lib.ioc_common
 import iocage_lib.ioc_json
 import iocage_lib.ioc_list
 
+from iocage_lib.artifacts import read_artifact
+
 
 class IOCUpgrade:
 
@@ -111,8 +112,7 @@ class IOCUpgrade:
         tmp = None
         try:
             tmp = tempfile.NamedTemporaryFile(delete=False)
-            with urllib.request.urlopen(f) as fbsd_update:
-                tmp.write(fbsd_update.read())
+            tmp.write(read_artifact(f))
             tmp.close()
             os.chmod(tmp.name, 0o755)
 
@@ -23,11 +23,15 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 import collections
+import concurrent.futures
 import datetime
+import fnmatch
 import json
 import operator
 import os
 import subprocess as su
+import threading
+import time
 
 import iocage_lib.ioc_clean as ioc_clean
 import iocage_lib.ioc_common as ioc_common
@@ -47,10 +51,12 @@ import iocage_lib.ioc_debug as ioc_debug
 import iocage_lib.ioc_exceptions as ioc_exceptions
 
 from iocage_lib.cache import cache
+from iocage_lib.catalog import JailCatalog
 from iocage_lib.dataset import Dataset
 from iocage_lib.pools import Pool, PoolListableResource
 from iocage_lib.release import Release
 from iocage_lib.snapshot import SnapshotListableResource, Snapshot
+from iocage_lib.zfs import all_properties
 
 
 class PoolAndDataset:
@@ -151,11 +157,16 @@ class IOCage:
         boot_order = {}
 
         _reverse = True if action == 'stop' else False
+        catalog = JailCatalog(self.iocroot, self.pool).jails()
 
         for jail in self.jails:
             self.jail = jail
             uuid, path = self.__check_jail_existence__()
-            conf = ioc_json.IOCJson(path).json_get_value('all')
+            conf = catalog.get(uuid)
+
+            if not conf or conf['corrupt']:
+                conf = ioc_json.IOCJson(path).json_get_value('all')
+
             boot = conf['boot']
             priority = conf['priority']
             jail_order[jail] = int(priority)
@@ -165,16 +176,16 @@ class IOCage:
             if boot:
                 boot_order[jail] = int(priority)
 
-            jail_order = collections.OrderedDict(
-                sorted(
-                    jail_order.items(),
-                    key=operator.itemgetter(1),
-                    reverse=_reverse))
-            boot_order = collections.OrderedDict(
-                sorted(
-                    boot_order.items(),
-                    key=operator.itemgetter(1),
-                    reverse=_reverse))
+        jail_order = collections.OrderedDict(
+            sorted(
+                jail_order.items(),
+                key=operator.itemgetter(1),
+                reverse=_reverse))
+        boot_order = collections.OrderedDict(
+            sorted(
+                boot_order.items(),
+                key=operator.itemgetter(1),
+                reverse=_reverse))
 
         if self.rc:
             self.__rc__(boot_order, action, ignore_exception)
@@ -790,6 +801,172 @@ class IOCage:
                 interactive, unjailed, msg_return
             )
 
+    @staticmethod
+    def __exec_env__(exec_clean):
+        if exec_clean:
+            env_path = '/sbin:/bin:/usr/sbin:/usr/bin:/usr/local/sbin:' \
+                '/usr/local/bin:/root/bin'
+            env_lang = os.environ.get('LANG', 'en_US.UTF-8')
+            return {
+                'PATH': env_path,
+                'PWD': '/',
+                'HOME': '/',
+                'TERM': 'xterm-256color',
+                'LANG': env_lang,
+                'LC_ALL': env_lang
+            }
+
+        return os.environ.copy()
+
+    @staticmethod
+    def __match_filters__(conf, filters):
+        """
+        Every prop=value in filters has to match the jail's config, values
+        may be globs and on/off, yes/no and 1/0 are interchangeable.
+        """
+        for prop, value in filters.items():
+            actual = str(conf.get(prop, ''))
+            if fnmatch.fnmatchcase(actual, value):
+                continue
+
+            truthy = ioc_common.truthy_values() + \
+                ioc_common.truthy_inverse_values()
+            if value.lower() in truthy and actual.lower() in truthy and \
+                    ioc_common.check_truthy(value) == \
+                    ioc_common.check_truthy(actual):
+                continue
+
+            return False
+
+        return True
+
+    def exec_jails(self, filters=None):
+        """
+        Returns {uuid: path} of the jails exec_many would run in, the
+        current jail or all of them narrowed down by filters.
+        """
+        if self._all or not self.jail:
+            jails = dict(self.jails)
+        else:
+            uuid, path = self.__check_jail_existence__()
+            jails = {uuid: path}
+
+        if not filters:
+            return jails
+
+        catalog = JailCatalog(self.iocroot, self.pool).jails()
+        selected = {}
+        for uuid, path in jails.items():
+            conf = catalog.get(uuid)
+            if not conf or conf['corrupt'] or not all(
+                f in JailCatalog.fields for f in filters
+            ):
+                conf = ioc_json.IOCJson(path, silent=True).json_get_value(
+                    'all'
+                )
+
+            if self.__match_filters__(conf, filters):
+                selected[uuid] = path
+
+        return selected
+
+    def exec_many(
+        self, command, host_user='root', jail_user=None, start_jail=False,
+        jobs=4, filters=None, max_output=None, on_output=None,
+        on_result=None
+    ):
+        """
+        Runs command in every selected jail (see exec_jails), up to jobs of
+        them at once.
+
+        Returns a list of dicts, one per jail in jail order, with the exit
+        code (rc, None if the command never ran), the captured stdout and
+        stderr (only the last max_output bytes of each if given), whether
+        they were truncated, the duration in seconds and an error message
+        for jails the command couldn't run in.
+
+        on_output(jail, stream, line) is called with every line as it
+        arrives, on_result(result) as soon as a jail is done. Both are
+        called from worker threads.
+        """
+        if host_user and jail_user is not None:
+            ioc_common.logit(
+                {
+                    'level': 'EXCEPTION',
+                    'message': 'Please only specify either host_user or'
+                    ' jail_user, not both!'
+                },
+                _callback=self.callback,
+                silent=self.silent)
+
+        jails = self.exec_jails(filters)
+        # Starting a jail touches host wide state (bridges, epairs, ...)
+        start_lock = threading.Lock()
+
+        def run(uuid, path):
+            result = {
+                'jail': uuid, 'rc': None, 'stdout': b'', 'stderr': b'',
+                'truncated': False, 'duration': 0.0, 'error': None,
+            }
+            started = time.monotonic()
+
+            try:
+                status, _ = self.list('jid', uuid=uuid)
+                if not status:
+                    if not start_jail:
+                        result['error'] = f'{uuid} is not running'
+                        return result
+
+                    with start_lock:
+                        IOCage(
+                            jail=uuid, skip_jails=True, silent=True
+                        ).start(uuid)
+
+                conf = ioc_json.IOCJson(path, silent=True).json_get_value(
+                    'all'
+                )
+                _exec = ioc_exec.CaptureExec(
+                    command, path, uuid=uuid, host_user=host_user,
+                    jail_user=jail_user, skip=True,
+                    su_env=self.__exec_env__(conf['exec_clean']),
+                    max_output=max_output,
+                    on_line=(
+                        lambda stream, line: on_output(uuid, stream, line)
+                    ) if on_output else None,
+                )
+                result['rc'] = _exec.run()
+                result['stdout'] = _exec.stdout
+                result['stderr'] = _exec.stderr
+                result['truncated'] = _exec.truncated
+            except Exception as e:
+                result['error'] = str(e)
+            finally:
+                result['duration'] = time.monotonic() - started
+
+            return result
+
+        def done(result):
+            if on_result:
+                on_result(result)
+            return result
+
+        if not jails:
+            return []
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(min(jobs, len(jails)), 1)
+        ) as executor:
+            futures = {
+                executor.submit(run, uuid, path): uuid
+                for uuid, path in jails.items()
+            }
+            results = {
+                futures[f]: done(f.result())
+                for f in concurrent.futures.as_completed(futures)
+            }
+
+        return [results[uuid] for uuid in jails]
+
     def exec(
         self, command, host_user='root', jail_user=None, console=False,
         start_jail=False, interactive=False, unjailed=False, msg_return=False
@@ -815,22 +992,7 @@ class IOCage:
                 silent=self.silent)
 
         uuid, path = self.__check_jail_existence__()
-        exec_clean = self.get('exec_clean')
-
-        if exec_clean:
-            env_path = '/sbin:/bin:/usr/sbin:/usr/bin:/usr/local/sbin:' \
-                '/usr/local/bin:/root/bin'
-            env_lang = os.environ.get('LANG', 'en_US.UTF-8')
-            su_env = {
-                'PATH': env_path,
-                'PWD': '/',
-                'HOME': '/',
-                'TERM': 'xterm-256color',
-                'LANG': env_lang,
-                'LC_ALL': env_lang
-            }
-        else:
-            su_env = os.environ.copy()
+        su_env = self.__exec_env__(self.get('exec_clean'))
 
         status, jid = self.list("jid", uuid=uuid)
 
@@ -953,7 +1115,10 @@ class IOCage:
                     _callback=self.callback,
                     silent=self.silent)
 
-    def export(self, compression_algo='zip'):
+    def export(
+        self, compression_algo='zip', threads=None, incremental_from=None,
+        intermediate=False, keep_snapshot=False
+    ):
         """Will export a jail"""
         uuid, path = self.__check_jail_existence__()
         status, _ = self.list("jid", uuid=uuid)
@@ -971,7 +1136,37 @@ class IOCage:
                 silent=self.silent)
 
         ioc_image.IOCImage().export_jail(
-            uuid, path, compression_algo=compression_algo
+            uuid, path, compression_algo=compression_algo, threads=threads,
+            incremental_from=incremental_from, intermediate=intermediate,
+            keep_snapshot=keep_snapshot
+        )
+
+    def export_bundle(
+        self, jails, name, compression_algo='zip', threads=None
+    ):
+        """Will export several jails into one image named name"""
+        targets = []
+        for jail in jails:
+            self.jail = jail
+            uuid, path = self.__check_jail_existence__()
+            status, _ = self.list("jid", uuid=uuid)
+
+            if status:
+                ioc_common.logit(
+                    {
+                        "level":
+                        "EXCEPTION",
+                        "message":
+                        f"{uuid} is running, stop the jail before"
+                        " exporting!"
+                    },
+                    _callback=self.callback,
+                    silent=self.silent)
+
+            targets.append((uuid, path))
+
+        ioc_image.IOCImage().export_bundle(
+            targets, name, compression_algo=compression_algo, threads=threads
         )
 
     def fetch(self, **kwargs):
@@ -1091,6 +1286,7 @@ class IOCage:
         else:
             kwargs.pop('git_repository', None)
             kwargs.pop('git_destination', None)
+            kwargs.pop('refresh', None)
 
             if _list:
                 if remote:
@@ -1407,6 +1603,7 @@ class IOCage:
 
         dataset = Dataset(path)
         dataset.rename(new_path, {'force_unmount': True})
+        JailCatalog(self.iocroot, self.pool).remove(uuid)
 
         self.jail = new_name
 
@@ -1648,9 +1845,13 @@ class IOCage:
         else:
             full_path = f"{self.pool}/iocage/jails/{uuid}"
 
-        dataset = Dataset(full_path)
+        # One zfs call for every snapshot's properties instead of one each
+        snapshots = all_properties(
+            [full_path], recursive=True, types=['snapshot']
+        )
 
-        for snap in dataset.snapshots_recursive():
+        for resource_name, props in snapshots.items():
+            snap = Snapshot(resource_name)
             snap_name = snap.name if not long else snap.resource_name
             root_snap_name = snap.resource_name.rsplit("@")[0].split("/")[-1]
             root = False
@@ -1665,9 +1866,9 @@ class IOCage:
 
                 continue
 
-            creation = snap.properties["creation"]
-            used = snap.properties["used"]
-            referenced = snap.properties["referenced"]
+            creation = props["creation"]
+            used = props["used"]
+            referenced = props["referenced"]
 
             snap_list_temp.append([snap_name, creation, referenced, used]) \
                 if not root else snap_list_root.append([snap_name, creation,
@@ -2003,6 +2204,130 @@ class IOCage:
                 _callback=self.callback,
                 silent=self.silent)
 
+    def update_plugins(self, jobs=4, upgrade=False, on_result=None):
+        """
+        Updates the plugin of every selected pluginv2 jail, or upgrades it
+        with upgrade, up to jobs of them at once. Only the plugin is
+        updated, not the jail itself.
+
+        Each plugin repository is pulled once for all the jails created from
+        it and each artifact is cloned once for all the jails using it. A
+        jail whose update fails is rolled back to the snapshot taken before,
+        the others are left updated.
+
+        Returns a list of dicts, one per jail in jail order, with the plugin,
+        whether it succeeded (ok), whether it was rolled back, the duration
+        in seconds and an error message for jails which failed. on_result
+        (result) is called from worker threads as soon as a jail is done.
+        """
+        jails = self.exec_jails({'type': 'pluginv2'})
+        confs = {
+            uuid: ioc_json.IOCJson(path, silent=True).json_get_value('all')
+            for uuid, path in jails.items()
+        }
+        repositories = collections.defaultdict(list)
+        for uuid, conf in confs.items():
+            repositories[conf['plugin_repository']].append(uuid)
+
+        errors = {}
+        for repository, uuids in repositories.items():
+            try:
+                ioc_plugin.IOCPlugin(
+                    git_repository=repository, callback=self.callback,
+                    silent=True
+                ).pull_clone_git_repo(refresh=True)
+            except (Exception, SystemExit) as e:
+                errors.update(dict.fromkeys(
+                    uuids, f'Failed to pull {repository}: {e}'
+                ))
+
+        artifacts = {}
+        # Starting a jail touches host wide state (bridges, epairs, ...)
+        start_lock = threading.Lock()
+        snapshot = 'upgrade' if upgrade else 'update'
+
+        def run(uuid):
+            conf = confs[uuid]
+            result = {
+                'jail': uuid, 'plugin': conf['plugin_name'], 'ok': False,
+                'rolled_back': False, 'duration': 0.0,
+                'error': errors.get(uuid),
+            }
+            if result['error']:
+                return result
+
+            started = time.monotonic()
+            iocage = IOCage(jail=uuid, skip_jails=True, silent=True)
+            running, jid = self.list('jid', uuid=uuid)
+            plugin = None
+
+            try:
+                if not running:
+                    with start_lock:
+                        iocage.start(uuid)
+                    _, jid = self.list('jid', uuid=uuid)
+
+                plugin = ioc_plugin.IOCPlugin(
+                    jail=uuid, plugin=conf['plugin_name'],
+                    git_repository=conf['plugin_repository'],
+                    callback=self.callback, silent=True, artifacts=artifacts
+                )
+                if upgrade:
+                    plugin.upgrade(jid, pull=False)
+                else:
+                    plugin.update(jid, pull=False)
+                result['ok'] = True
+            except (Exception, SystemExit) as e:
+                # logit already printed the reason when exiting
+                result['error'] = 'see the errors above' \
+                    if isinstance(e, SystemExit) else str(e)
+
+                if plugin is not None:
+                    try:
+                        # update() only rolls back to its own snapshot,
+                        # an upgrade has to go back to before the RELEASE
+                        # was upgraded as well
+                        if upgrade or not plugin.rolled_back:
+                            plugin.__rollback_jail__(name=snapshot)
+                        result['rolled_back'] = True
+                    except (Exception, SystemExit):
+                        pass
+
+            try:
+                # Leave every jail running or stopped as it was
+                status, _ = self.list('jid', uuid=uuid)
+                if running and not status:
+                    with start_lock:
+                        iocage.start(uuid)
+                elif not running and status:
+                    iocage.stop()
+            except (Exception, SystemExit) as e:
+                if result['ok']:
+                    result['error'] = str(e)
+            finally:
+                result['duration'] = time.monotonic() - started
+
+            return result
+
+        def done(result):
+            if on_result:
+                on_result(result)
+            return result
+
+        if not jails:
+            return []
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(min(jobs, len(jails)), 1)
+        ) as executor:
+            futures = {executor.submit(run, uuid): uuid for uuid in jails}
+            results = {
+                futures[f]: done(f.result())
+                for f in concurrent.futures.as_completed(futures)
+            }
+
+        return [results[uuid] for uuid in jails]
+
     def upgrade_all(self, release):
         """Runs upgrade for all jails"""
         self._all = False
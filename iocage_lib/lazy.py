@@ -0,0 +1,26 @@
+import importlib
+import sys
+import types
+
+
+class LazyModule(types.ModuleType):
+
+    """
+    Stands in for a module which is only imported once one of its
+    attributes is used, including in except clauses.
+    """
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name__)
+        # Later lookups don't have to come through here
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def lazy_import(name):
+    """
+    Returns module name without importing it yet. Meant for the heavy
+    dependencies (requests, GitPython, jsonschema, ...) most commands never
+    touch.
+    """
+    return sys.modules.get(name) or LazyModule(name)
@@ -0,0 +1,278 @@
+import http.server
+import json
+import logging
+import os
+import threading
+import time
+
+import iocage_lib.racct as racct
+
+from iocage_lib.zfs import all_properties
+
+# Seconds a collection is served before the next scrape collects again
+DEFAULT_INTERVAL = 30
+DEFAULT_ADDRESS = '127.0.0.1'
+DEFAULT_PORT = 9705
+ZFS_PROPERTIES = ('used', 'available', 'referenced', 'compressratio')
+PROMETHEUS_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+# name: (type, help)
+METRICS = {
+    'iocage_jail_info': (
+        'gauge', 'Jail configuration, the value is always 1.'
+    ),
+    'iocage_jail_running': ('gauge', 'Whether the jail is running.'),
+    'iocage_jail_jid': ('gauge', 'JID of the running jail.'),
+    'iocage_jail_boot': ('gauge', 'Whether the jail starts at boot.'),
+    'iocage_jail_zfs_used_bytes': (
+        'gauge', 'Space used by the jail and all its datasets.'
+    ),
+    'iocage_jail_zfs_available_bytes': (
+        'gauge', 'Space available to the jail datasets.'
+    ),
+    'iocage_jail_zfs_referenced_bytes': (
+        'gauge', 'Space referenced by the jail root dataset.'
+    ),
+    'iocage_jail_zfs_compressratio': (
+        'gauge', 'Compression ratio of the jail datasets.'
+    ),
+    'iocage_jail_rctl_usage': (
+        'gauge', 'Resource usage of the running jail as reported by rctl -u.'
+    ),
+    'iocage_jail_last_start_timestamp_seconds': (
+        'gauge', 'When the jail was last started by iocage.'
+    ),
+    'iocage_jail_last_start_duration_seconds': (
+        'gauge', 'How long iocage took to start the jail last time.'
+    ),
+    'iocage_collect_timestamp_seconds': (
+        'gauge', 'When these metrics were collected.'
+    ),
+    'iocage_collect_duration_seconds': (
+        'gauge', 'How long collecting these metrics took.'
+    ),
+}
+
+
+def start_stats_path(iocroot, uuid):
+    return os.path.join(iocroot, 'log', f'{uuid}-start.json')
+
+
+def record_start(iocroot, uuid, started, duration):
+    """Remembers when and how quickly IOCStart started the jail uuid."""
+    import iocage_lib.ioc_common
+
+    try:
+        with iocage_lib.ioc_common.open_atomic(
+            start_stats_path(iocroot, uuid), 'w'
+        ) as f:
+            json.dump({'started': started, 'duration': duration}, f)
+    except OSError:
+        pass
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n'
+    )
+
+
+def render(samples, openmetrics=False):
+    """
+    Formats samples, a dict of metric name -> list of (labels, value), in
+    the Prometheus text format or OpenMetrics.
+    """
+    lines = []
+    for name, (metric_type, help_text) in METRICS.items():
+        if not samples.get(name):
+            continue
+
+        lines.extend([
+            f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}'
+        ])
+        for labels, value in samples[name]:
+            label_str = ','.join(
+                f'{k}="{escape(v)}"' for k, v in labels.items()
+            )
+            lines.append(
+                f'{name}{{{label_str}}} {value}' if label_str
+                else f'{name} {value}'
+            )
+
+    if openmetrics:
+        lines.append('# EOF')
+
+    return '\n'.join(lines) + '\n'
+
+
+class Collector:
+
+    """
+    Collects the metrics of every jail with one zfs get and one jls however
+    many jails there are. rctl usage comes from the kernel directly on
+    FreeBSD, see racct.usage().
+
+    A collection is reused for interval seconds, so any number of scrapes
+    within it cost nothing.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        import iocage_lib.ioc_json
+
+        iocjson = iocage_lib.ioc_json.IOCJson()
+        self.pool = iocjson.pool
+        self.iocroot = iocjson.iocroot
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.samples = None
+        self.collected = None
+
+    def get(self):
+        with self.lock:
+            if self.samples is None or \
+                    time.monotonic() - self.collected >= self.interval:
+                self.samples = self.collect()
+                self.collected = time.monotonic()
+
+            return self.samples
+
+    def render(self, openmetrics=False):
+        return render(self.get(), openmetrics)
+
+    def start_stats(self, uuid):
+        try:
+            with open(start_stats_path(self.iocroot, uuid), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def collect(self):
+        import iocage_lib.ioc_common
+        from iocage_lib.cache import cache
+        from iocage_lib.catalog import JailCatalog
+
+        start = time.monotonic()
+        # A long running collector must not answer from stale ZFS state
+        cache.reset()
+
+        jails = JailCatalog(self.iocroot, self.pool).jails()
+        active = iocage_lib.ioc_common.get_active_jails()
+        datasets = all_properties(
+            [
+                os.path.join(self.pool, 'iocage', location)
+                for location in ('jails', 'templates')
+            ], depth=2, types=['filesystem'], props=ZFS_PROPERTIES,
+            parsable=True
+        )
+        running = {
+            name: racct.jail_name(name) for name in jails
+            if racct.jail_name(name) in active
+        }
+        usage = racct.usage(running.values())
+
+        samples = {name: [] for name in METRICS}
+        for name, jail in sorted(jails.items()):
+            labels = {'jail': name}
+            jls_name = running.get(name)
+
+            samples['iocage_jail_info'].append(({
+                **labels,
+                'release': jail.get('release', 'N/A'),
+                'type': jail.get('type', 'N/A'),
+                'template': jail.get('template', '-'),
+                'location': jail['location'],
+            }, 1))
+            samples['iocage_jail_running'].append((labels, int(bool(jls_name))))
+            if jls_name:
+                samples['iocage_jail_jid'].append(
+                    (labels, active[jls_name]['jid'])
+                )
+            if not jail['corrupt']:
+                samples['iocage_jail_boot'].append((labels, int(jail['boot'])))
+
+            dataset = os.path.join(
+                self.pool, 'iocage', jail['location'], name
+            )
+            props = datasets.get(dataset, {})
+            for prop in ('used', 'available'):
+                if props.get(prop, '-').isdigit():
+                    samples[f'iocage_jail_zfs_{prop}_bytes'].append(
+                        (labels, props[prop])
+                    )
+            referenced = datasets.get(f'{dataset}/root', {}).get('referenced')
+            if referenced and referenced.isdigit():
+                samples['iocage_jail_zfs_referenced_bytes'].append(
+                    (labels, referenced)
+                )
+            ratio = props.get('compressratio', '-').rstrip('x')
+            if ratio.replace('.', '', 1).isdigit():
+                samples['iocage_jail_zfs_compressratio'].append((labels, ratio))
+
+            for resource, value in sorted(usage.get(jls_name, {}).items()):
+                samples['iocage_jail_rctl_usage'].append(
+                    ({**labels, 'resource': resource}, value)
+                )
+
+            stats = self.start_stats(name)
+            if stats:
+                samples['iocage_jail_last_start_timestamp_seconds'].append(
+                    (labels, stats['started'])
+                )
+                samples['iocage_jail_last_start_duration_seconds'].append(
+                    (labels, round(stats['duration'], 3))
+                )
+
+        samples['iocage_collect_timestamp_seconds'].append(
+            ({}, round(time.time(), 3))
+        )
+        samples['iocage_collect_duration_seconds'].append(
+            ({}, round(time.monotonic() - start, 3))
+        )
+
+        return samples
+
+    def write_textfile(self, path):
+        """Writes the metrics for node_exporter's textfile collector."""
+        import iocage_lib.ioc_common
+
+        with iocage_lib.ioc_common.open_atomic(path, 'w') as f:
+            f.write(self.render())
+        # The temporary file is only readable by us
+        os.chmod(path, 0o644)
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+    collector = None
+    logger = logging.getLogger('iocage')
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        openmetrics = 'application/openmetrics-text' in self.headers.get(
+            'Accept', ''
+        )
+        try:
+            body = self.collector.render(openmetrics).encode()
+        except (Exception, SystemExit) as e:
+            self.logger.error(f'Collecting metrics failed: {e}')
+            self.send_error(500, str(e))
+            return
+
+        self.send_response(200)
+        self.send_header(
+            'Content-Type', OPENMETRICS_TYPE if openmetrics else PROMETHEUS_TYPE
+        )
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        self.logger.debug(f'{self.address_string()} {fmt % args}')
+
+
+def server(collector, address=DEFAULT_ADDRESS, port=DEFAULT_PORT):
+    handler = type('Handler', (MetricsHandler,), {'collector': collector})
+    return http.server.ThreadingHTTPServer((address, port), handler)
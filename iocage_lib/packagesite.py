@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import re
+import tarfile
+
+import iocage_lib.ioc_common
+
+from iocage_lib.lazy import lazy_import
+
+requests = lazy_import('requests')
+
+PACKAGESITE_CACHE_VERSION = 1
+RE_PACKAGE_PATH = re.compile(rb'"path":"([/\.\+,\d\w-]*)\.txz"')
+
+
+class PackageSite:
+
+    """
+    Version of every package in a pkg(8) repository, read from its
+    packagesite.txz.
+
+    The archive is tens of MB, so packagesite.yaml is parsed a line at a time
+    straight out of the decompressing HTTP response and never hits the disk.
+    The result is kept in <cache_dir>/<sha256 of the url>.json together with
+    the ETag and Last-Modified of the archive. Later reads send those back and
+    only download it again if the repository changed.
+    """
+
+    def __init__(self, url, cache_dir=None):
+        self.url = url.rstrip('/')
+        self.cache_path = os.path.join(
+            cache_dir, f'{hashlib.sha256(self.url.encode()).hexdigest()}.json'
+        ) if cache_dir else None
+
+    def read_cache(self):
+        if not self.cache_path:
+            return None
+
+        try:
+            with open(self.cache_path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if data.get('version') != PACKAGESITE_CACHE_VERSION or \
+                data.get('url') != self.url:
+            return None
+
+        return data
+
+    def write_cache(self, data):
+        if not self.cache_path:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with iocage_lib.ioc_common.open_atomic(self.cache_path, 'w') as f:
+                json.dump(data, f)
+        except OSError:
+            pass
+
+    @staticmethod
+    def parse(lines):
+        """Returns {package: version} for the packagesite.yaml lines."""
+        packages = {}
+        for line in lines:
+            searched = RE_PACKAGE_PATH.search(line)
+            if not searched:
+                continue
+
+            name = searched.group(1).decode().rsplit('/', 1)[-1]
+            packages[name.rsplit('-', 1)[0]] = \
+                iocage_lib.ioc_common.parse_package_name(name)
+
+        return packages
+
+    def parse_archive(self, fileobj):
+        """Parses packagesite.yaml out of the packagesite.txz stream."""
+        with tarfile.open(fileobj=fileobj, mode='r|*') as tar:
+            for member in tar:
+                if member.isfile() and \
+                        os.path.basename(member.name) == 'packagesite.yaml':
+                    return self.parse(tar.extractfile(member))
+
+        raise FileNotFoundError(
+            f'packagesite.yaml not found in {self.url}/packagesite.txz'
+        )
+
+    def packages(self, timeout=300):
+        """
+        Returns {package: version} of the repository. A cached result is
+        used if the server can't be reached.
+        """
+        cached = self.read_cache()
+        headers = {}
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached and cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+
+        try:
+            with requests.get(
+                f'{self.url}/packagesite.txz', stream=True, timeout=timeout,
+                headers=headers
+            ) as r:
+                if r.status_code == 304 and cached:
+                    return cached['packages']
+
+                r.raise_for_status()
+                r.raw.decode_content = True
+                packages = self.parse_archive(r.raw)
+                validators = {
+                    'etag': r.headers.get('ETag'),
+                    'last_modified': r.headers.get('Last-Modified'),
+                }
+        except requests.RequestException:
+            if cached:
+                return cached['packages']
+            raise
+
+        if any(validators.values()):
+            self.write_cache({
+                'version': PACKAGESITE_CACHE_VERSION, 'url': self.url,
+                **validators, 'packages': packages,
+            })
+
+        return packages
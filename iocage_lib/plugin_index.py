@@ -0,0 +1,159 @@
+import copy
+import json
+import os
+
+import iocage_lib.ioc_common
+
+INDEX_CACHE_VERSION = 1
+
+
+def git_head(repo_path):
+    """
+    Commit checked out in the git repository at repo_path, read from .git
+    directly so it costs neither a git process nor GitPython.
+    """
+    git_dir = os.path.join(repo_path, '.git')
+    try:
+        with open(os.path.join(git_dir, 'HEAD'), 'r') as f:
+            head = f.read().strip()
+    except OSError:
+        return None
+
+    if not head.startswith('ref: '):
+        # Detached
+        return head
+
+    ref = head[5:]
+    try:
+        with open(os.path.join(git_dir, ref), 'r') as f:
+            return f.read().strip()
+    except OSError:
+        pass
+
+    try:
+        with open(os.path.join(git_dir, 'packed-refs'), 'r') as f:
+            for line in f:
+                commit, _, name = line.strip().partition(' ')
+                if name == ref:
+                    return commit
+    except OSError:
+        pass
+
+    return None
+
+
+class PluginIndex:
+
+    """
+    The INDEX and plugin manifests of a plugin repository clone, parsed once
+    per commit.
+
+    Parsing means reading INDEX and every manifest in the repository, so the
+    result is kept in <clone>.index.json next to the clone together with the
+    commit it was parsed from. Until a pull moves HEAD it is served from
+    there, and within a process from memory.
+    """
+
+    memory = {}
+
+    def __init__(self, repo_path):
+        self.repo_path = repo_path.rstrip('/')
+        self.cache_path = f'{self.repo_path}.index.json'
+
+    def revision(self):
+        """
+        HEAD of the clone plus the mtime of INDEX, which catches INDEX being
+        edited in place as well. None if repo_path isn't a clone.
+        """
+        head = git_head(self.repo_path)
+        if head is None:
+            return None
+
+        try:
+            mtime = os.stat(os.path.join(self.repo_path, 'INDEX')).st_mtime_ns
+        except OSError:
+            mtime = None
+
+        return f'{head}:{mtime}'
+
+    def read_cache(self, revision):
+        try:
+            with open(self.cache_path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if data.get('version') != INDEX_CACHE_VERSION or \
+                data.get('revision') != revision:
+            return None
+
+        return data
+
+    def parse(self):
+        """Reads INDEX and every manifest of the repository."""
+        try:
+            with open(os.path.join(self.repo_path, 'INDEX'), 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = None
+
+        paths = {
+            entry['MANIFEST'] for entry in (index or {}).values()
+            if isinstance(entry, dict) and entry.get('MANIFEST')
+        }
+        try:
+            paths.update(
+                e.name for e in os.scandir(self.repo_path)
+                if e.name.endswith('.json') and e.is_file()
+            )
+        except OSError:
+            pass
+
+        manifests = {}
+        for path in sorted(paths):
+            try:
+                with open(os.path.join(self.repo_path, path), 'r') as f:
+                    manifests[path] = json.load(f)
+            except (OSError, ValueError):
+                # Not there or not a manifest, the same as before caching
+                continue
+
+        return {'index': index, 'manifests': manifests}
+
+    def load(self):
+        revision = self.revision()
+        if revision is None:
+            # Nothing to key a cache on
+            return self.parse()
+
+        key = (self.repo_path, revision)
+        if key in self.memory:
+            return self.memory[key]
+
+        data = self.read_cache(revision)
+        if data is None:
+            data = {
+                'version': INDEX_CACHE_VERSION, 'revision': revision,
+                **self.parse()
+            }
+            try:
+                with iocage_lib.ioc_common.open_atomic(
+                    self.cache_path, 'w'
+                ) as f:
+                    json.dump(data, f)
+            except OSError:
+                pass
+
+        self.memory[key] = data
+        return data
+
+    @property
+    def index(self):
+        """The parsed INDEX, None if the repository has none."""
+        # Callers are free to modify what they get
+        return copy.deepcopy(self.load()['index'])
+
+    @property
+    def manifests(self):
+        """Every parsed manifest keyed by its path in the repository."""
+        return copy.deepcopy(self.load()['manifests'])
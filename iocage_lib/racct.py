@@ -0,0 +1,106 @@
+import ctypes
+import errno
+import subprocess
+
+from iocage_lib.utils import load_ctypes_library
+
+# Enough for every resource rctl(8) knows about, grown on ERANGE
+RACCT_BUFSIZE = 4096
+# rctl -u processes running at once where libc can't be used
+RCTL_JOBS = 32
+
+try:
+    LIBC = load_ctypes_library('c', {
+        'rctl_get_racct': (
+            [ctypes.c_char_p, ctypes.c_size_t, ctypes.c_char_p,
+             ctypes.c_size_t], ctypes.c_int
+        ),
+    })
+except (ImportError, OSError):
+    LIBC = None
+
+
+def jail_name(uuid):
+    """Name iocage gives the jail of uuid, as rctl and jls know it."""
+    return f'ioc-{uuid.replace(".", "_")}'
+
+
+def parse(output):
+    """Parses rctl -u output, resource=value separated by commas or lines."""
+    usage = {}
+    for item in output.replace('\n', ',').split(','):
+        resource, sep, value = item.strip().partition('=')
+        if sep:
+            try:
+                usage[resource] = int(value)
+            except ValueError:
+                continue
+
+    return usage
+
+
+class RacctUnavailable(Exception):
+    pass
+
+
+def racct(name):
+    """
+    Resource usage of the running jail name, straight from the kernel the
+    way rctl -u gets it. Returns None if there is no such jail.
+    """
+    subject = f'jail:{name}'.encode()
+    size = RACCT_BUFSIZE
+    while True:
+        buf = ctypes.create_string_buffer(size)
+        if LIBC.rctl_get_racct(subject, len(subject) + 1, buf, size) == 0:
+            return parse(buf.value.decode())
+
+        err = ctypes.get_errno()
+        if err == errno.ERANGE:
+            size *= 4
+        elif err in (errno.ESRCH, errno.EINVAL):
+            return None
+        else:
+            # ENOSYS without kern.racct.enable, EPERM inside a jail
+            raise RacctUnavailable(errno.errorcode.get(err, str(err)))
+
+
+def rctl_usage(names):
+    """rctl -u for every jail in names, RCTL_JOBS of them at a time."""
+    names = list(names)
+    result = {}
+    for i in range(0, len(names), RCTL_JOBS):
+        procs = {
+            name: subprocess.Popen(
+                ['rctl', '-u', f'jail:{name}'], stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL, encoding='utf8'
+            ) for name in names[i:i + RCTL_JOBS]
+        }
+        for name, proc in procs.items():
+            output = proc.communicate()[0]
+            if proc.returncode == 0:
+                result[name] = parse(output)
+
+    return result
+
+
+def usage(names):
+    """
+    Returns {name: {resource: value}} for the running jails names, leaving
+    out any which went away. Reading it through libc doesn't fork at all,
+    rctl -u is only run where that isn't available.
+    """
+    if not getattr(LIBC, 'rctl_get_racct', None):
+        return rctl_usage(names)
+
+    result = {}
+    for name in names:
+        try:
+            jail_usage = racct(name)
+        except RacctUnavailable:
+            return {}
+
+        if jail_usage is not None:
+            result[name] = jail_usage
+
+    return result
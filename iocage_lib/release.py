@@ -1,9 +1,9 @@
 import os
 import re
-import requests
 
 import iocage_lib.dataset as dataset
 
+from iocage_lib.artifacts import read_artifact
 from iocage_lib.cache import cache
 from iocage_lib.resource import IocageListableResource
 from iocage_lib.ioc_fetch import IOCFetch
@@ -49,13 +49,11 @@ class ListableReleases(IocageListableResource):
     def __iter__(self):
         if self.remote:
             # TODO: Please abstract this in the future
-            req = requests.get(
+            content = read_artifact(
                 'https://download.freebsd.org/ftp/'
                 f'releases/{os.uname().machine}/', timeout=10
             )
 
-            assert req.status_code == 200
-
             for release in filter(
                 lambda r: (
                     r if not self.eol_check else r not in self.eol_list
@@ -63,7 +61,7 @@ class ListableReleases(IocageListableResource):
                     r, raise_error=False, major_only=True
                 ),
                 re.findall(
-                    r'href="(\d.*RELEASE)/"', req.content.decode('utf-8')
+                    r'href="(\d.*RELEASE)/"', content.decode('utf-8')
                 )
             ):
                 yield self.resource(release)
@@ -0,0 +1,129 @@
+import os
+import time
+
+import iocage_lib.racct as racct
+
+# column: (header, rctl resource or None if computed)
+COLUMNS = {
+    'name': ('NAME', None),
+    'jid': ('JID', None),
+    'cpu': ('CPU%', None),
+    'pcpu': ('PCPU', 'pcpu'),
+    'mem': ('MEM', 'memoryuse'),
+    'vmem': ('VMEM', 'vmemoryuse'),
+    'swap': ('SWAP', 'swapuse'),
+    'procs': ('PROCS', 'maxproc'),
+    'threads': ('THR', 'nthr'),
+    'files': ('FILES', 'openfiles'),
+    'read_bps': ('READ/s', 'readbps'),
+    'write_bps': ('WRITE/s', 'writebps'),
+    'read_iops': ('RIOPS', 'readiops'),
+    'write_iops': ('WIOPS', 'writeiops'),
+}
+SIZE_COLUMNS = ('mem', 'vmem', 'swap', 'read_bps', 'write_bps')
+
+
+def human_size(value):
+    if value is None:
+        return '-'
+
+    for unit in ('B', 'K', 'M', 'G'):
+        if abs(value) < 1024:
+            return f'{value:.0f}{unit}' if unit == 'B' else f'{value:.1f}{unit}'
+        value /= 1024
+
+    return f'{value:.1f}T'
+
+
+class JailTop:
+
+    """
+    Samples the resource usage of every running jail, see racct.usage().
+    One jls finds the running jails, their usage is read in a single batch.
+
+    CPU% is worked out from how much cputime a jail used between two samples,
+    so the first sample has none. The kernel's own decaying pcpu is shown as
+    well. I/O is reported by the kernel as rates already.
+    """
+
+    def __init__(self):
+        self.previous = None
+
+    @staticmethod
+    def running():
+        """Returns {jls name: (jail name, jid)} of running iocage jails."""
+        import iocage_lib.ioc_common
+
+        jails = {}
+        for jls_name, jail in iocage_lib.ioc_common.get_active_jails().items():
+            if not jls_name.startswith('ioc-'):
+                continue
+
+            # <iocroot>/jails/<name>/root, the jls name mangles dots
+            path = jail.get('path', '').rstrip('/')
+            name = os.path.basename(os.path.dirname(path)) \
+                if path.endswith('/root') else jls_name[4:]
+            jails[jls_name] = (name, jail.get('jid'))
+
+        return jails
+
+    def sample(self):
+        """Returns a row per running jail, a dict keyed by COLUMNS."""
+        running = self.running()
+        usage = racct.usage(running)
+        now = time.monotonic()
+
+        previous_time, previous = self.previous or (None, {})
+        rows = []
+        for jls_name, jail_usage in usage.items():
+            name, jid = running[jls_name]
+            row = {'name': name, 'jid': jid, 'cpu': None}
+            for column, (_, resource) in COLUMNS.items():
+                if resource:
+                    row[column] = jail_usage.get(resource)
+
+            before = previous.get(jls_name, {}).get('cputime')
+            if before is not None and 'cputime' in jail_usage:
+                # cputime only has a resolution of seconds
+                row['cpu'] = round(
+                    max(jail_usage['cputime'] - before, 0) * 100
+                    / (now - previous_time), 1
+                )
+
+            rows.append(row)
+
+        self.previous = (now, usage)
+        return rows
+
+    @staticmethod
+    def sort(rows, column='cpu'):
+        """Sorts rows by column, names ascending, anything else descending."""
+        import iocage_lib.ioc_common
+
+        if column not in COLUMNS:
+            iocage_lib.ioc_common.logit({
+                'level': 'EXCEPTION',
+                'message': f'Invalid sort type specified: {column}\n'
+                f'Please use one of: {", ".join(COLUMNS)}'
+            })
+
+        if column == 'name':
+            return sorted(rows, key=lambda r: r['name'])
+
+        # Missing values last, ties by name
+        return sorted(rows, key=lambda r: (
+            r[column] is None, -(r[column] or 0), r['name']
+        ))
+
+    @staticmethod
+    def table(rows):
+        """Rows formatted for display, headers first."""
+        table = [[header for header, _ in COLUMNS.values()]]
+        for row in rows:
+            table.append([
+                human_size(row[c]) if c in SIZE_COLUMNS else
+                '-' if row[c] is None else str(row[c])
+                for c in COLUMNS
+            ])
+
+        return table
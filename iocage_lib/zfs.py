@@ -58,10 +58,13 @@ def properties(dataset, resource_type='zfs'):
 
 
 def all_properties(
-    paths=None, resource_type='zfs', depth=None, recursive=False, types=None
+    paths=None, resource_type='zfs', depth=None, recursive=False, types=None,
+    props=None, parsable=False
 ):
     paths = paths or []
     flags = []
+    if parsable:
+        flags.append('-p')
     if depth:
         flags.extend(['-d', str(depth)])
     if recursive:
@@ -70,7 +73,8 @@ def all_properties(
         flags.extend(['-t', ','.join(types)])
 
     data = run([
-        resource_type, 'get', '-H', '-o', 'name,property,value', *flags, 'all', *paths
+        resource_type, 'get', '-H', '-o', 'name,property,value', *flags,
+        ','.join(props) if props else 'all', *paths
     ]).stdout.split('\n')
     fs = defaultdict(dict)
     for line in filter(bool, data):
@@ -22,6 +22,7 @@
 # IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 import os
+import re
 import sys
 
 import fastentrypoints
@@ -29,10 +30,10 @@ import fastentrypoints
 from setuptools import find_packages, setup
 
 if os.path.isdir("/".join([sys.prefix, "etc/init.d"])):
-    _data = [('etc/init.d', ['rc.d/iocage']),
+    _data = [('etc/init.d', ['rc.d/iocage', 'rc.d/iocaged']),
              ('man/man8', ['iocage.8.gz'])]
 else:
-    _data = [('etc/rc.d', ['rc.d/iocage']),
+    _data = [('etc/rc.d', ['rc.d/iocage', 'rc.d/iocaged']),
              ('man/man8', ['iocage.8.gz'])]
 
 if os.path.isdir("/".join([sys.prefix, "share/zsh/site-functions/"])):
@@ -41,7 +42,10 @@ if os.path.isdir("/".join([sys.prefix, "share/zsh/site-functions/"])):
 if sys.version_info < (3, 8):
     exit("Only Python 3.8 and higher is supported.")
 
-VERSION = '1.2'
+with open(os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), 'iocage_lib', '__init__.py'
+), 'r') as f:
+    VERSION = re.search(r"__version__ = '(.*)'", f.read()).group(1)
 
 setup(
     name='iocage_lib',
@@ -61,7 +65,9 @@ setup(
         'jsonschema>=3.2.0'
     ],
     setup_requires=['pytest-runner'],
-    entry_points={'console_scripts': ['iocage = iocage_lib:cli']},
+    entry_points={'console_scripts': [
+        'iocage = iocage_lib:cli', 'iocaged = iocage_lib.daemon:main'
+    ]},
     data_files=_data,
     tests_require=['pytest', 'pytest-cov', 'pytest-pep8']
 )
@@ -1,6 +1,9 @@
 import pytest
 
-from iocage_lib.ioc_common import validate_plugin_manifest
+from iocage_lib.cache import cache
+from iocage_lib.ioc_common import (
+    validate_plugin_manifest, validate_plugin_manifests
+)
 
 VALID_MANIFEST = {
     "name": "test_plugin",
@@ -96,3 +99,19 @@ def test_valid_devfs_ruleset():
     }
 
     validate_plugin_manifest(manifest, None, None)
+
+
+def test_validator_is_compiled_once():
+    validator = cache.plugin_manifest_validator
+    cache.reset()
+
+    assert cache.plugin_manifest_validator is validator
+
+
+def test_validate_plugin_manifests():
+    invalid = VALID_MANIFEST.copy()
+    del invalid["artifact"]
+
+    assert validate_plugin_manifests({
+        "valid": VALID_MANIFEST, "invalid": invalid,
+    }) == {"invalid": ["'artifact' is a required property"]}
@@ -0,0 +1,184 @@
+import json
+import os
+
+import pytest
+
+from iocage_lib.cache import cache
+from iocage_lib.catalog import JailCatalog
+from iocage_lib.dataset import Dataset
+from iocage_lib.ioc_list import IOCList
+
+DEFAULTS = {
+    'type': 'jail', 'release': '13.1-RELEASE', 'boot': 0, 'priority': 99,
+    'depends': 'none', 'ip4_addr': 'none', 'ip6_addr': 'none', 'dhcp': 0,
+    'basejail': 0, 'interfaces': 'vnet0:bridge0',
+}
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+
+@pytest.fixture
+def iocroot(tmp_path, mocker):
+    cache = mocker.patch('iocage_lib.catalog.cache')
+    cache.datasets = {
+        'tank/iocage/jails/web/root': {
+            'origin': 'tank/iocage/templates/tmpl/root@web'
+        }
+    }
+    write_json(str(tmp_path / 'defaults.json'), DEFAULTS)
+    write_json(str(tmp_path / 'jails/web/config.json'), {
+        'host_hostuuid': 'web', 'boot': 'on', 'priority': '10',
+    })
+    write_json(str(tmp_path / 'templates/tmpl/config.json'), {
+        'host_hostuuid': 'tmpl', 'type': 'template',
+    })
+    return tmp_path
+
+
+def test_jails_indexes_config_over_defaults(iocroot):
+    jails = JailCatalog(str(iocroot), 'tank').jails()
+
+    assert set(jails) == {'web', 'tmpl'}
+    assert jails['web']['boot'] == 1
+    assert jails['web']['priority'] == 10
+    assert jails['web']['release'] == '13.1-RELEASE'
+    assert jails['web']['template'] == 'tmpl'
+    assert jails['tmpl']['location'] == 'templates'
+    assert os.path.isfile(iocroot / 'catalog.json')
+
+
+def test_jails_filters_by_location(iocroot):
+    jails = JailCatalog(str(iocroot), 'tank').jails('templates')
+
+    assert list(jails) == ['tmpl']
+
+
+def test_unchanged_configs_are_not_reread(iocroot, mocker):
+    catalog = JailCatalog(str(iocroot), 'tank')
+    catalog.jails()
+
+    index = mocker.spy(catalog, 'index')
+    catalog.jails()
+
+    index.assert_not_called()
+
+
+def test_changed_config_is_reindexed(iocroot):
+    catalog = JailCatalog(str(iocroot), 'tank')
+    catalog.jails()
+
+    config = iocroot / 'jails/web/config.json'
+    write_json(str(config), {'host_hostuuid': 'web', 'boot': 'off'})
+    os.utime(config, ns=(1, 1))
+
+    assert catalog.jails()['web']['boot'] == 0
+
+
+def test_defaults_change_invalidates_catalog(iocroot):
+    catalog = JailCatalog(str(iocroot), 'tank')
+    catalog.jails()
+
+    defaults = iocroot / 'defaults.json'
+    write_json(str(defaults), {**DEFAULTS, 'release': '13.2-RELEASE'})
+    os.utime(defaults, ns=(1, 1))
+
+    assert catalog.jails()['web']['release'] == '13.2-RELEASE'
+
+
+def test_removed_jail_is_dropped(iocroot):
+    catalog = JailCatalog(str(iocroot), 'tank')
+    catalog.jails()
+
+    os.remove(iocroot / 'jails/web/config.json')
+    os.rmdir(iocroot / 'jails/web')
+
+    assert 'web' not in catalog.jails()
+
+
+def test_corrupt_config_is_flagged(iocroot):
+    with open(iocroot / 'jails/web/config.json', 'w') as f:
+        f.write('{')
+
+    jail = JailCatalog(str(iocroot), 'tank').jails()['web']
+
+    assert jail['corrupt'] is True
+    assert jail['host_hostuuid'] == 'web'
+
+
+def test_update_and_remove(iocroot):
+    catalog = JailCatalog(str(iocroot), 'tank')
+    catalog.jails()
+
+    write_json(str(iocroot / 'jails/db/config.json'), {'host_hostuuid': 'db'})
+    catalog.update(str(iocroot / 'jails/db'))
+    assert 'db' in catalog.read()
+
+    catalog.remove('db')
+    assert 'db' not in catalog.read()
+
+
+def test_new_defaults_are_not_migrated_again(fake_host):
+    host = fake_host(2)
+    defaults = os.path.join(host.iocroot, 'defaults.json')
+    mtime = os.stat(defaults).st_mtime_ns
+
+    IOCList('all', silent=True).list_datasets()
+    cache.reset()
+
+    assert os.stat(defaults).st_mtime_ns == mtime
+    assert not os.path.exists(
+        os.path.join(host.iocroot, 'defaults_backup.json')
+    )
+
+
+@pytest.fixture
+def unmounted(fake_host):
+    """Host whose catalog is current but jail00001 got unmounted since."""
+    host = fake_host(3)
+    with open(host.state_path, 'r') as f:
+        state = json.load(f)
+    state['datasets']['tank/iocage/jails/jail00001']['mounted'] = 'no'
+    with open(host.state_path, 'w') as f:
+        json.dump(state, f)
+
+    config = os.path.join(host.iocroot, 'jails', 'jail00001', 'config.json')
+    hidden = f'{config}.unmounted'
+    os.rename(config, hidden)
+    return host, config, hidden
+
+
+@pytest.mark.parametrize('quick', [False, True])
+def test_unmounted_jail_is_mounted_and_listed(unmounted, mocker, quick):
+    host, config, hidden = unmounted
+    mount = mocker.patch.object(
+        Dataset, 'mount', autospec=True,
+        side_effect=lambda ds: os.rename(hidden, config)
+    )
+
+    uuids = IOCList('uuid', silent=True).list_datasets()
+    jails = IOCList(
+        'all', hdr=False, quick=quick, silent=True
+    ).list_datasets()
+
+    assert 'jail00001' in uuids
+    assert sorted(j[0] if quick else j[1] for j in jails) == [
+        'jail00000', 'jail00001', 'jail00002'
+    ]
+    assert [ds.name for (ds,), _ in mount.call_args_list] == [
+        'tank/iocage/jails/jail00001'
+    ]
+
+
+def test_jail_without_config_is_flagged(unmounted, mocker):
+    mocker.patch.object(Dataset, 'mount')
+
+    jails = IOCList('all', hdr=False, silent=True).list_datasets()
+
+    assert [j[1] for j in jails] == [
+        'jail00000', 'jail00001', 'jail00002'
+    ]
+    assert jails[1][2] == 'CORRUPT'
@@ -0,0 +1,273 @@
+import hashlib
+import http.server
+import io
+import os
+import re
+import tarfile
+import threading
+
+import pytest
+import requests
+
+from iocage_lib.download import Downloader
+
+
+def make_txz(members):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:xz') as tar:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+SET_MEMBERS = {
+    './bin/sh': os.urandom(300 * 1024), './usr/lib/libc.so': os.urandom(1024)
+}
+FILES = {
+    'base.txz': os.urandom(3 * 1024 * 1024 + 17),
+    'lib32.txz': os.urandom(1024 * 1024),
+    'src.txz': os.urandom(2 * 1024 * 1024 + 3),
+    'set.txz': make_txz(SET_MEMBERS),
+}
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def send_file(self, body):
+        data = FILES.get(self.path.lstrip('/'))
+        if data is None:
+            self.send_error(404)
+            return
+
+        self.server.requests.append((self.command, self.path, self.headers))
+        if_range = self.headers.get('If-Range')
+        match = re.match(
+            r'bytes=(\d+)-(\d*)', self.headers.get('Range', '')
+        ) if self.server.ranges and (
+            not if_range or if_range == self.server.etag
+        ) else None
+
+        if match:
+            start = int(match.group(1))
+            end = int(match.group(2) or len(data) - 1)
+            if start >= len(data):
+                self.send_error(416)
+                return
+            chunk = data[start:end + 1]
+            self.send_response(206)
+            self.send_header(
+                'Content-Range', f'bytes {start}-{end}/{len(data)}'
+            )
+        else:
+            chunk = data
+            self.send_response(200)
+
+        if self.server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        if self.server.etag:
+            self.send_header('ETag', self.server.etag)
+        self.send_header('Content-Length', str(len(chunk)))
+        self.end_headers()
+
+        if body:
+            self.wfile.write(chunk)
+
+    def do_HEAD(self):
+        self.send_file(False)
+
+    def do_GET(self):
+        self.send_file(True)
+
+
+@pytest.fixture
+def http_server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    server.requests = []
+    server.ranges = True
+    server.etag = None
+    server.url = f'http://127.0.0.1:{server.server_port}'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def targets(server, path, names):
+    return [(f'{server.url}/{n}', os.path.join(path, n)) for n in names]
+
+
+def test_download_all_fetches_files_concurrently(http_server, tmp_path):
+    progress = {}
+    Downloader(
+        jobs=3, progress=lambda n, d, t: progress.update({n: (d, t)})
+    ).download_all(targets(
+        http_server, str(tmp_path), ['base.txz', 'lib32.txz', 'src.txz']
+    ))
+
+    for name in ('base.txz', 'lib32.txz', 'src.txz'):
+        data = FILES[name]
+        assert (tmp_path / name).read_bytes() == data
+        assert progress[name] == (len(data), len(data))
+    assert not list(tmp_path.glob('*.part*'))
+
+
+def test_partial_file_is_resumed(http_server, tmp_path):
+    data = FILES['base.txz']
+    (tmp_path / 'base.txz.part').write_bytes(data[:1000])
+
+    Downloader().download_all(targets(http_server, str(tmp_path), ['base.txz']))
+
+    assert (tmp_path / 'base.txz').read_bytes() == data
+    assert http_server.requests[-1][2]['Range'] == 'bytes=1000-'
+
+
+def test_changed_file_is_not_resumed(http_server, tmp_path):
+    http_server.etag = '"new"'
+    (tmp_path / 'base.txz.part').write_bytes(b'old content')
+    (tmp_path / 'base.txz.part.validator').write_text('"old"')
+
+    Downloader().download_all(targets(http_server, str(tmp_path), ['base.txz']))
+
+    assert (tmp_path / 'base.txz').read_bytes() == FILES['base.txz']
+    assert http_server.requests[-1][2]['If-Range'] == '"old"'
+    assert not list(tmp_path.glob('*.part*'))
+
+
+def test_validator_is_kept_for_resuming(http_server, tmp_path, mocker):
+    http_server.etag = '"v1"'
+    data = FILES['base.txz']
+    mocker.patch.object(
+        Downloader, 'finish', side_effect=requests.ConnectionError
+    )
+
+    with pytest.raises(requests.ConnectionError):
+        Downloader().download_all(
+            targets(http_server, str(tmp_path), ['base.txz'])
+        )
+    mocker.stopall()
+    with open(tmp_path / 'base.txz.part', 'r+b') as f:
+        f.truncate(1000)
+
+    Downloader().download_all(targets(http_server, str(tmp_path), ['base.txz']))
+
+    assert (tmp_path / 'base.txz').read_bytes() == data
+    assert http_server.requests[-1][2]['Range'] == 'bytes=1000-'
+    assert http_server.requests[-1][2]['If-Range'] == '"v1"'
+
+
+@pytest.mark.parametrize('extra', [b'', b'garbage'])
+def test_unsatisfiable_range_checks_the_size(http_server, tmp_path, extra):
+    data = FILES['lib32.txz']
+    (tmp_path / 'lib32.txz.part').write_bytes(data + extra)
+
+    Downloader().download_all(
+        targets(http_server, str(tmp_path), ['lib32.txz'])
+    )
+
+    assert (tmp_path / 'lib32.txz').read_bytes() == data
+    assert ('HEAD', '/lib32.txz') in [r[:2] for r in http_server.requests]
+
+
+def test_requests_time_out(http_server, tmp_path, mocker):
+    head = mocker.spy(requests.Session, 'head')
+    get = mocker.spy(requests.Session, 'get')
+
+    Downloader(segments=2, segment_min_size=1, timeout=7).download_all(
+        targets(http_server, str(tmp_path), ['src.txz'])
+    )
+
+    assert head.call_args.kwargs['timeout'] == 7
+    assert {c.kwargs['timeout'] for c in get.call_args_list} == {7}
+
+
+def test_resume_without_range_support_restarts(http_server, tmp_path):
+    http_server.ranges = False
+    (tmp_path / 'src.txz.part').write_bytes(b'garbage')
+
+    Downloader().download_all(targets(http_server, str(tmp_path), ['src.txz']))
+
+    assert (tmp_path / 'src.txz').read_bytes() == FILES['src.txz']
+
+
+def test_complete_partial_file(http_server, tmp_path):
+    (tmp_path / 'lib32.txz.part').write_bytes(FILES['lib32.txz'])
+
+    Downloader().download_all(
+        targets(http_server, str(tmp_path), ['lib32.txz'])
+    )
+
+    assert (tmp_path / 'lib32.txz').read_bytes() == FILES['lib32.txz']
+
+
+def test_segmented_download(http_server, tmp_path):
+    data = FILES['base.txz']
+    # Pretend a previous segmented attempt got part of the second segment
+    step = -(-len(data) // 4)
+    (tmp_path / 'base.txz.part.1').write_bytes(data[step:step + 10])
+
+    Downloader(segments=4, segment_min_size=1).download_all(
+        targets(http_server, str(tmp_path), ['base.txz'])
+    )
+
+    assert (tmp_path / 'base.txz').read_bytes() == data
+    ranges = {
+        h['Range'] for c, _, h in http_server.requests if c == 'GET'
+    }
+    assert f'bytes={step + 10}-{2 * step - 1}' in ranges
+    assert not list(tmp_path.glob('*.part*'))
+
+
+def test_missing_file_raises(http_server, tmp_path):
+    with pytest.raises(requests.HTTPError):
+        Downloader().download_all(
+            targets(http_server, str(tmp_path), ['doc.txz'])
+        )
+
+
+@pytest.mark.parametrize('segments,partial', [(1, 0), (1, 4096), (3, 0)])
+def test_digest_is_computed_while_downloading(
+    http_server, tmp_path, segments, partial
+):
+    data = FILES['src.txz']
+    if partial:
+        (tmp_path / 'src.txz.part').write_bytes(data[:partial])
+
+    downloader = Downloader(segments=segments, segment_min_size=1)
+    downloader.download_all(targets(http_server, str(tmp_path), ['src.txz']))
+
+    assert downloader.digests[str(tmp_path / 'src.txz')] == \
+        hashlib.sha256(data).hexdigest()
+
+
+def test_stream_extracts_while_downloading(http_server, tmp_path):
+    downloader = Downloader()
+    path = str(tmp_path / 'set.txz')
+    dest = tmp_path / 'root'
+
+    with downloader.open(f'{http_server.url}/set.txz', path) as src:
+        with tarfile.open(fileobj=src, mode='r|*') as tar:
+            tar.extractall(str(dest))
+
+    for name, data in SET_MEMBERS.items():
+        assert (dest / name).read_bytes() == data
+    assert (tmp_path / 'set.txz').read_bytes() == FILES['set.txz']
+    assert downloader.digests[path] == \
+        hashlib.sha256(FILES['set.txz']).hexdigest()
+
+
+def test_stream_left_unfinished_stays_partial(http_server, tmp_path):
+    downloader = Downloader()
+    path = str(tmp_path / 'base.txz')
+
+    with pytest.raises(tarfile.TarError):
+        with downloader.open(f'{http_server.url}/base.txz', path) as src:
+            tarfile.open(fileobj=src, mode='r|*')
+
+    assert not os.path.exists(path)
+    assert path not in downloader.digests
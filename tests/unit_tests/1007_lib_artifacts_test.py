@@ -0,0 +1,161 @@
+import hashlib
+import http.server
+import os
+import threading
+
+import pytest
+import requests
+
+from iocage_lib.artifacts import ArtifactStore, parse_size
+
+
+class ETagHandler(http.server.BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, body):
+        data = self.server.files.get(self.path.lstrip('/'))
+        if data is None:
+            self.send_error(404)
+            return
+
+        self.server.requests.append((self.command, self.path))
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        if self.server.validators:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+    def do_HEAD(self):
+        self.respond(False)
+
+    def do_GET(self):
+        self.respond(True)
+
+
+@pytest.fixture
+def http_server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), ETagHandler)
+    server.files = {'MANIFEST': b'base.txz\tabc\n', 'page': b'<html/>'}
+    server.requests = []
+    server.validators = True
+    server.url = f'http://127.0.0.1:{server.server_port}'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_read_caches_and_revalidates(http_server, tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    url = f'{http_server.url}/page'
+
+    assert store.read(url) == b'<html/>'
+    assert store.read(url) == b'<html/>'
+
+    assert http_server.requests == [('GET', '/page'), ('HEAD', '/page')]
+    sha256 = hashlib.sha256(b'<html/>').hexdigest()
+    assert os.path.isfile(store.object_path(sha256))
+
+
+def test_read_without_validators_is_not_stored(http_server, tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    http_server.validators = False
+
+    assert store.read(f'{http_server.url}/page') == b'<html/>'
+    assert store.read_index()['urls'] == {}
+
+
+def test_store_is_opt_in(tmp_path, monkeypatch):
+    monkeypatch.delenv('IOCAGE_ARTIFACTS', raising=False)
+    assert ArtifactStore.default() is None
+
+    monkeypatch.setenv('IOCAGE_ARTIFACTS', str(tmp_path))
+    monkeypatch.setenv('IOCAGE_ARTIFACTS_MAX_SIZE', '1G')
+    store = ArtifactStore.default()
+    assert (store.path, store.max_size) == (str(tmp_path), 1024 ** 3)
+
+
+def test_changed_content_is_refetched(http_server, tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    url = f'{http_server.url}/page'
+    store.read(url)
+    old = store.object_path(hashlib.sha256(b'<html/>').hexdigest())
+
+    http_server.files['page'] = b'<html>new</html>'
+
+    assert store.read(url) == b'<html>new</html>'
+    assert not os.path.exists(old)
+
+
+def test_stale_copy_is_used_offline(http_server, tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    url = f'{http_server.url}/page'
+    store.read(url)
+
+    http_server.shutdown()
+    http_server.server_close()
+
+    assert store.read(url) == b'<html/>'
+
+
+def test_copy_and_forget(http_server, tmp_path):
+    store = ArtifactStore(str(tmp_path / 'store'))
+    url = f'{http_server.url}/MANIFEST'
+    src = tmp_path / 'MANIFEST'
+    src.write_bytes(http_server.files['MANIFEST'])
+    r = requests.head(url)
+    sha256 = store.add(url, str(src), headers=r.headers)
+
+    dest = tmp_path / 'copy'
+    assert store.copy(url, str(dest)) == sha256
+    assert dest.read_bytes() == http_server.files['MANIFEST']
+
+    store.forget(url)
+    assert store.copy(url, str(dest)) is None
+    assert not os.path.exists(store.object_path(sha256))
+
+
+def test_lru_eviction(tmp_path):
+    store = ArtifactStore(str(tmp_path / 'store'), max_size=10)
+    for name, data in (('a', b'123456'), ('b', b'abcdef')):
+        path = tmp_path / name
+        path.write_bytes(data)
+        store.add(f'http://localhost/{name}', str(path))
+
+    index = store.read_index()
+    assert list(index['urls']) == ['http://localhost/b']
+    assert list(index['objects']) == [hashlib.sha256(b'abcdef').hexdigest()]
+
+
+def test_readonly_store_is_not_written(http_server, tmp_path, mocker):
+    store = ArtifactStore(str(tmp_path))
+    url = f'{http_server.url}/page'
+    store.read(url)
+    index = store.read_index()
+
+    mocker.patch.object(
+        ArtifactStore, 'readonly', new_callable=mocker.PropertyMock,
+        return_value=True
+    )
+    http_server.files['page'] = b'changed'
+
+    assert store.read(url) == b'changed'
+    assert store.read_index() == index
+
+
+@pytest.mark.parametrize('value,expected', [
+    ('1024', 1024), ('512M', 512 * 1024 ** 2), ('1.5g', 3 * 1024 ** 3 // 2),
+])
+def test_parse_size(value, expected):
+    assert parse_size(value) == expected
@@ -0,0 +1,107 @@
+import gzip
+import hashlib
+import io
+import lzma
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+import iocage_lib.archive
+
+from iocage_lib.archive import (
+    ArchiveWriter, BlockCompressor, CODECS, HashingWriter, read_streams
+)
+
+STREAMS = {
+    'iocroot/images/web_2024-01-01': os.urandom(2500),
+    'iocroot/images/web_2024-01-01_root': os.urandom(1000),
+    'iocroot/images/web_2024-01-01_data': b'',
+}
+
+
+def write_image(path, compression_algo, threads=2):
+    with open(path, 'wb') as raw:
+        output = HashingWriter(raw)
+        with ArchiveWriter.open(output, compression_algo, threads) as archive:
+            for name, data in STREAMS.items():
+                archive.add_stream(name, io.BytesIO(data))
+    return output.hexdigest()
+
+
+@pytest.fixture(autouse=True)
+def small_members(mocker):
+    mocker.patch.object(iocage_lib.archive, 'MEMBER_SIZE', 1024)
+
+
+@pytest.mark.parametrize('compression_algo,extension', [
+    ('zip', 'zip'), ('lzma', 'tar.xz'), ('gzip', 'tar.gz'),
+    pytest.param('zstd', 'tar.zst', marks=pytest.mark.skipif(
+        not CODECS['zstd'].available(), reason='zstd is not installed'
+    )),
+])
+def test_streams_round_trip(tmp_path, compression_algo, extension):
+    path = str(tmp_path / f'web_2024-01-01.{extension}')
+    digest = write_image(path, compression_algo)
+
+    with open(path, 'rb') as f:
+        assert digest == hashlib.sha256(f.read()).hexdigest()
+
+    assert {
+        name: b''.join(chunks) for name, chunks in read_streams(path)
+    } == STREAMS
+
+
+def test_large_streams_span_tar_members(tmp_path):
+    path = str(tmp_path / 'web_2024-01-01.tar.xz')
+    write_image(path, 'lzma')
+
+    with tarfile.open(path) as tar:
+        names = [m.name for m in tar.getmembers()]
+
+    assert names.count('iocroot/images/web_2024-01-01') == 3
+    assert names.count('iocroot/images/web_2024-01-01_data') == 1
+
+
+def test_zip_is_readable_by_zipfile(tmp_path):
+    path = str(tmp_path / 'web_2024-01-01.zip')
+    write_image(path, 'zip')
+
+    with zipfile.ZipFile(path) as z:
+        assert z.testzip() is None
+        assert z.namelist() == list(STREAMS)
+
+
+def test_unconsumed_streams_are_skipped(tmp_path):
+    path = str(tmp_path / 'web_2024-01-01.tar.xz')
+    write_image(path, 'lzma')
+
+    assert [name for name, _ in read_streams(path)] == list(STREAMS)
+
+
+@pytest.mark.parametrize('compress,decompress', [
+    (gzip.compress, gzip.decompress), (lzma.compress, lzma.decompress),
+])
+def test_blocks_decompress_as_one_file(compress, decompress):
+    data = os.urandom(5000) + b'iocage' * 3000
+    out = io.BytesIO()
+    compressor = BlockCompressor(out, compress, 1000, threads=3)
+    for i in range(0, len(data), 700):
+        compressor.write(data[i:i + 700])
+    compressor.close()
+
+    assert decompress(out.getvalue()) == data
+
+
+def test_old_single_stream_images_are_read(tmp_path):
+    path = tmp_path / 'web_2024-01-01.tar.xz'
+    data = os.urandom(3000)
+    with tarfile.open(str(path), 'w:xz') as tar:
+        info = tarfile.TarInfo('iocroot/images/web_2024-01-01')
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+    assert [
+        (name, b''.join(chunks)) for name, chunks in read_streams(str(path))
+    ] == [('iocroot/images/web_2024-01-01', data)]
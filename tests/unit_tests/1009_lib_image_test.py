@@ -0,0 +1,394 @@
+import datetime
+import io
+import json
+import os
+import subprocess
+
+import pytest
+
+import iocage_lib.ioc_image
+
+from iocage_lib.archive import EXTENSIONS, read_streams
+from iocage_lib.ioc_image import IOCImage
+
+DATASETS = ['tank/iocage/jails/web', 'tank/iocage/jails/web/root']
+ORIGINS = {
+    'tank/iocage/jails/web': '-',
+    'tank/iocage/jails/web/root':
+        'tank/iocage/releases/13.1-RELEASE/root@web',
+    'tank/iocage/jails/db': '-',
+    'tank/iocage/jails/db/root': 'tank/iocage/releases/13.1-RELEASE/root@db',
+}
+
+
+class FakeZFS:
+
+    def __init__(self):
+        self.commands = []
+        self.received = {}
+        self.fail = set()
+        self.snapshots = {
+            'tank/iocage/releases/13.1-RELEASE/root': {
+                'db': '111', 'other': '222', 'web': '333'
+            },
+        }
+
+    def popen(self, cmd, **kwargs):
+        self.commands.append(cmd)
+        proc = FakeProc()
+        if cmd[1] == 'list':
+            proc.output = '\n'.join(DATASETS).encode()
+        elif cmd[1] == 'recv':
+            proc.stdin = Recv(self.received, cmd[-1])
+            proc.returncode = int(cmd[-1] in self.fail)
+        else:
+            proc.stdout = io.BytesIO(' '.join(cmd).encode())
+        return proc
+
+    def run(self, cmd, **kwargs):
+        self.commands.append(cmd)
+        if cmd[:2] == ['zfs', 'list'] and 'name,origin' in cmd:
+            stdout = '\n'.join(
+                f'{ds}\t{origin}' for ds, origin in ORIGINS.items()
+                if ds.startswith(cmd[-1])
+            )
+        elif cmd[:2] == ['zfs', 'list']:
+            stdout = '\n'.join(
+                f'{cmd[-1]}@{snap}\t{guid}'
+                for snap, guid in self.snapshots.get(cmd[-1], {}).items()
+            )
+        else:
+            stdout = '1-token\n'
+        return subprocess.CompletedProcess(cmd, 0, stdout=stdout.encode())
+
+
+class Recv(io.BytesIO):
+
+    def __init__(self, received, dataset):
+        super().__init__()
+        self.received = received
+        self.dataset = dataset
+
+    def close(self):
+        self.received[self.dataset] = self.getvalue()
+        super().close()
+
+
+class FakeProc:
+
+    returncode = 0
+    output = b''
+
+    def __init__(self):
+        self.stdout = io.BytesIO()
+        self.stderr = io.BytesIO()
+        self.args = []
+
+    def communicate(self):
+        return self.output, b''
+
+    def wait(self):
+        return self.returncode
+
+    def kill(self):
+        pass
+
+
+@pytest.fixture
+def zfs(mocker):
+    fake = FakeZFS()
+    mocker.patch.object(iocage_lib.ioc_image.su, 'Popen', fake.popen)
+    mocker.patch.object(iocage_lib.ioc_image.su, 'run', fake.run)
+    mocker.patch('iocage_lib.ioc_common.checkoutput')
+    return fake
+
+
+@pytest.fixture
+def image(tmp_path, mocker):
+    ioc_json = mocker.patch('iocage_lib.ioc_json.IOCJson')
+    ioc_json.return_value.json_get_value.side_effect = ['tank', str(tmp_path)]
+    (tmp_path / 'images').mkdir()
+    return IOCImage(silent=True)
+
+
+def export(image, date, **kwargs):
+    image.date = date or image.date
+    image.export_jail(
+        'web', f'{image.iocroot}/jails/web', compression_algo='lzma', **kwargs
+    )
+    with open(f'{image.iocroot}/images/web_{image.date}.json') as f:
+        return json.load(f)
+
+
+def test_incremental_export_points_at_base(image, zfs, mocker):
+    full = export(image, '2024-01-01', keep_snapshot=True)
+    assert full['keep_snapshot'] is True
+    assert full['incremental'] is None
+
+    mocker.patch.object(
+        iocage_lib.ioc_image, 'list_snapshots',
+        return_value=['tank/iocage/jails/web@ioc-export-2024-01-01']
+    )
+    incremental = export(
+        image, '2024-01-02', incremental_from='ioc-export-2024-01-01'
+    )
+
+    assert incremental['incremental'] == {
+        'from': 'ioc-export-2024-01-01',
+        'intermediate': False,
+        'image': 'web_2024-01-01.tar.xz',
+        'sha256': full['sha256'],
+    }
+    streams = dict(
+        (name, b''.join(chunks)) for name, chunks in read_streams(
+            f'{image.iocroot}/images/web_2024-01-02.tar.xz'
+        )
+    )
+    # root didn't exist at the base snapshot and is sent in full
+    assert list(streams.values()) == [
+        b'zfs send -i tank/iocage/jails/web@ioc-export-2024-01-01 '
+        b'tank/iocage/jails/web@ioc-export-2024-01-02',
+        b'zfs send tank/iocage/jails/web/root@ioc-export-2024-01-02',
+    ]
+    assert not any(c[:2] == ['zfs', 'destroy'] for c in zfs.commands)
+
+
+def test_import_chain_walks_back_to_present_base(image, zfs, mocker):
+    export(image, '2024-01-01', keep_snapshot=True)
+    mocker.patch.object(
+        iocage_lib.ioc_image, 'list_snapshots',
+        side_effect=lambda **kwargs: [
+            f'tank/iocage/jails/web@ioc-export-{d}'
+            for d in ('2024-01-01', '2024-01-02')
+        ]
+    )
+    export(image, '2024-01-02', incremental_from='ioc-export-2024-01-01')
+    export(image, '2024-01-03', incremental_from='ioc-export-2024-01-02')
+    images = f'{image.iocroot}/images'
+
+    exists = mocker.patch.object(
+        iocage_lib.ioc_image.Snapshot, 'exists',
+        new_callable=mocker.PropertyMock, return_value=False
+    )
+    assert [
+        f for f, _ in image.__import_chain__(images, 'web_2024-01-03.tar.xz')
+    ] == [
+        'web_2024-01-01.tar.xz', 'web_2024-01-02.tar.xz',
+        'web_2024-01-03.tar.xz'
+    ]
+
+    exists.return_value = True
+    assert [
+        f for f, _ in image.__import_chain__(images, 'web_2024-01-03.tar.xz')
+    ] == ['web_2024-01-03.tar.xz']
+
+
+def test_import_chain_rejects_replaced_base(image, zfs, mocker):
+    export(image, '2024-01-01', keep_snapshot=True)
+    mocker.patch.object(
+        iocage_lib.ioc_image, 'list_snapshots',
+        return_value=['tank/iocage/jails/web@ioc-export-2024-01-01']
+    )
+    export(image, '2024-01-02', incremental_from='ioc-export-2024-01-01')
+    images = f'{image.iocroot}/images'
+    with open(f'{images}/web_2024-01-01.sha256', 'w') as f:
+        f.write('0' * 64)
+
+    mocker.patch.object(
+        iocage_lib.ioc_image.Snapshot, 'exists',
+        new_callable=mocker.PropertyMock, return_value=False
+    )
+    with pytest.raises(RuntimeError, match='checksums differ'):
+        image.__import_chain__(images, 'web_2024-01-02.tar.xz')
+
+
+def test_exports_of_the_same_day_get_their_own_names(tmp_path, zfs, mocker):
+    ioc_json = mocker.patch('iocage_lib.ioc_json.IOCJson')
+    ioc_json.return_value.json_get_value.side_effect = [
+        'tank', str(tmp_path)
+    ] * 2
+    (tmp_path / 'images').mkdir()
+    clock = mocker.patch.object(iocage_lib.ioc_image, 'datetime')
+    clock.datetime.utcnow.side_effect = [
+        datetime.datetime(2024, 1, 1, 2, 0, 0),
+        datetime.datetime(2024, 1, 1, 14, 30, 5),
+    ]
+
+    full = export(IOCImage(silent=True), None, keep_snapshot=True)
+    mocker.patch.object(
+        iocage_lib.ioc_image, 'list_snapshots',
+        return_value=['tank/iocage/jails/web@ioc-export-2024-01-01T020000']
+    )
+    incremental = export(
+        IOCImage(silent=True), None,
+        incremental_from='ioc-export-2024-01-01T020000'
+    )
+
+    assert full['snapshot'] == 'ioc-export-2024-01-01T020000'
+    assert incremental['snapshot'] == 'ioc-export-2024-01-01T143005'
+    assert incremental['incremental']['image'] == \
+        'web_2024-01-01T020000.tar.xz'
+    assert incremental['incremental']['sha256'] == full['sha256']
+
+
+@pytest.mark.parametrize('bundle', [False, True])
+def test_export_refuses_to_overwrite_an_image(image, zfs, bundle):
+    image.date = '2024-01-01T020000'
+    images = f'{image.iocroot}/images'
+    name = 'group' if bundle else 'web'
+    with open(f'{images}/{name}_2024-01-01T020000.json', 'w') as f:
+        f.write('{}')
+
+    with pytest.raises(RuntimeError, match='already exists'):
+        if bundle:
+            image.export_bundle(
+                [('web', f'{image.iocroot}/jails/web')], 'group',
+                compression_algo='lzma'
+            )
+        else:
+            image.export_jail(
+                'web', f'{image.iocroot}/jails/web', compression_algo='lzma'
+            )
+
+    assert os.listdir(images) == [f'{name}_2024-01-01T020000.json']
+    # Not even snapshotted
+    iocage_lib.ioc_common.checkoutput.assert_not_called()
+
+
+@pytest.fixture
+def exported(image, zfs, mocker):
+    mocker.patch.object(
+        iocage_lib.ioc_image.Snapshot, 'exists',
+        new_callable=mocker.PropertyMock, return_value=True
+    )
+    dataset = mocker.patch.object(iocage_lib.ioc_image, 'Dataset')
+    dataset.return_value.exists = False
+    return image
+
+
+@pytest.mark.parametrize('compression_algo', ['lzma', 'zip'])
+def test_import_streams_into_resumable_recv(exported, zfs, compression_algo):
+    exported.date = '2024-01-01'
+    exported.export_jail(
+        'web', f'{exported.iocroot}/jails/web',
+        compression_algo=compression_algo
+    )
+    filename = f'web_2024-01-01.{EXTENSIONS[compression_algo]}'
+
+    exported.__import_image__(f'{exported.iocroot}/images', filename)
+
+    assert zfs.received == {
+        'tank/iocage/jails/web':
+            b'zfs send tank/iocage/jails/web@ioc-export-2024-01-01',
+        'tank/iocage/jails/web/root':
+            b'zfs send tank/iocage/jails/web/root@ioc-export-2024-01-01',
+    }
+    assert all(
+        c[:4] == ['zfs', 'recv', '-s', '-F']
+        for c in zfs.commands if c[1] == 'recv'
+    )
+    assert not os.path.exists(exported.__import_state_path__(filename))
+
+
+def test_failed_import_continues_where_it_stopped(exported, zfs):
+    exported.date = '2024-01-01'
+    exported.export_jail(
+        'web', f'{exported.iocroot}/jails/web', compression_algo='lzma'
+    )
+    images = f'{exported.iocroot}/images'
+    zfs.fail.add('tank/iocage/jails/web/root')
+
+    with pytest.raises(RuntimeError, match='1-token'):
+        exported.__import_image__(images, 'web_2024-01-01.tar.xz')
+
+    with open(exported.__import_state_path__('web_2024-01-01.tar.xz')) as f:
+        state = json.load(f)
+    assert state['done'] == ['web']
+    assert state['tokens'] == {'web/root': '1-token'}
+
+    zfs.fail.clear()
+    zfs.received.clear()
+    exported.__import_image__(images, 'web_2024-01-01.tar.xz')
+
+    assert list(zfs.received) == ['tank/iocage/jails/web/root']
+    assert ['zfs', 'recv', '-A', 'tank/iocage/jails/web/root'] in zfs.commands
+
+
+def test_corrupt_image_is_discarded(exported, zfs, mocker):
+    exported.date = '2024-01-01'
+    exported.export_jail(
+        'web', f'{exported.iocroot}/jails/web', compression_algo='lzma'
+    )
+    images = f'{exported.iocroot}/images'
+    with open(f'{images}/web_2024-01-01.sha256', 'w') as f:
+        f.write('0' * 64)
+
+    with pytest.raises(RuntimeError, match='does not match its checksum'):
+        exported.__import_image__(images, 'web_2024-01-01.tar.xz')
+
+    iocage_lib.ioc_image.Dataset.return_value.destroy.assert_called_once_with(
+        recursive=True, force=True
+    )
+
+
+def test_bundle_sends_shared_release_once(exported, zfs, mocker):
+    exported.date = '2024-01-01'
+    exported.export_bundle(
+        [(j, f'{exported.iocroot}/jails/{j}') for j in ('web', 'db')],
+        'group', compression_algo='lzma'
+    )
+    images = f'{exported.iocroot}/images'
+    with open(f'{images}/group_2024-01-01.json') as f:
+        manifest = json.load(f)
+
+    assert [
+        (s['kind'], s['dataset'], s.get('from'), s.get('origin'))
+        for s in manifest['streams']
+    ] == [
+        ('base', 'releases/13.1-RELEASE/root', None, None),
+        ('base', 'releases/13.1-RELEASE/root', 'db', None),
+        ('jail', '', None, None),
+        ('jail', '/root', None, 'releases/13.1-RELEASE/root@web'),
+        ('jail', '', None, None),
+        ('jail', '/root', None, 'releases/13.1-RELEASE/root@db'),
+    ]
+
+    mocker.patch.object(IOCImage, '__import_as_jail__')
+    exported.import_jail('group', path=images)
+
+    release = 'tank/iocage/releases/13.1-RELEASE/root'
+    assert list(zfs.received) == [
+        release, 'tank/iocage/jails/web', 'tank/iocage/jails/web/root',
+        'tank/iocage/jails/db', 'tank/iocage/jails/db/root',
+    ]
+    assert zfs.received['tank/iocage/jails/db/root'] == (
+        f'zfs send -i {release}@db '
+        f'tank/iocage/jails/db/root@ioc-bundle-2024-01-01'
+    ).encode()
+    assert [
+        'zfs', 'recv', '-s', '-F', '-o', f'origin={release}@web',
+        'tank/iocage/jails/web/root'
+    ] in zfs.commands
+    assert IOCImage.__import_as_jail__.call_count == 2
+
+
+def test_bundle_bases_avoid_unrelated_datasets(exported, zfs):
+    manifest = {'streams': [{
+        'kind': 'base', 'dataset': 'releases/13.1-RELEASE/root',
+        'snapshot': 'web', 'from': None, 'guid': '999',
+    }]}
+    iocage_lib.ioc_image.Dataset.return_value.exists = True
+
+    assert exported.__bundle_bases__(manifest, 'group_2024-01-01') == {
+        'releases/13.1-RELEASE/root': (
+            'tank/iocage/bundles/group_2024-01-01/releases/13.1-RELEASE/root',
+            True
+        )
+    }
+
+    manifest['streams'][0]['guid'] = '333'
+    assert exported.__bundle_bases__(manifest, 'group_2024-01-01') == {
+        'releases/13.1-RELEASE/root': (
+            'tank/iocage/releases/13.1-RELEASE/root', False
+        )
+    }
@@ -0,0 +1,171 @@
+import time
+
+import pytest
+
+import iocage_lib.ioc_exec
+
+from iocage_lib.ioc_exec import (
+    CaptureExec, IOCExec, OutputBuffer, SilentExec
+)
+from iocage_lib.iocage import IOCage
+
+SCRIPT = 'echo one; echo two >&2; printf three; exit 3'
+
+
+def test_capture_exec_collects_lines_and_exit_code():
+    lines = []
+    _exec = CaptureExec(
+        ['/bin/sh', '-c', SCRIPT], '', uuid='',
+        on_line=lambda stream, line: lines.append((stream, line))
+    )
+
+    assert _exec.run() == 3
+    assert _exec.stdout == b'one\nthree'
+    assert _exec.stderr == b'two\n'
+    assert sorted(lines) == [
+        ('stderr', b'two'), ('stdout', b'one'), ('stdout', b'three')
+    ]
+    assert not _exec.truncated
+
+
+def test_capture_exec_keeps_the_tail():
+    _exec = CaptureExec(
+        ['/bin/sh', '-c', 'seq 1 1000'], '', uuid='', max_output=9
+    )
+
+    assert _exec.run() == 0
+    assert _exec.stdout == b'\n999\n1000\n'[-9:]
+    assert _exec.truncated
+
+
+def test_capture_exec_spills_everything(tmp_path):
+    spill = str(tmp_path / 'out')
+    _exec = CaptureExec(
+        ['/bin/sh', '-c', 'seq 1 1000'], '', uuid='', max_output=5,
+        spill_path=spill
+    )
+
+    assert _exec.run() == 0
+    assert _exec.stdout == b'1000\n'
+    with open(f'{spill}.stdout', 'rb') as f:
+        assert f.read().split() == [str(i).encode() for i in range(1, 1001)]
+
+
+def test_output_buffer_ring():
+    buffer = OutputBuffer(4)
+    for chunk in (b'ab', b'cdef', b'g'):
+        buffer.write(chunk)
+
+    assert buffer.getvalue() == b'defg'
+    assert buffer.size == 7
+    assert buffer.truncated
+
+
+def test_exec_line_buffered_and_decoded():
+    script = "printf 'h\\303'; sleep 0.1; printf '\\251llo\\nwor'; " \
+        "sleep 0.1; printf 'ld\\n'"
+    with IOCExec(
+        ['/bin/sh', '-c', script], '', uuid='', decode=True,
+        line_buffered=True
+    ) as _exec:
+        output = [o for o, _ in _exec]
+
+    assert output == ['h\xe9llo\n', 'world\n']
+
+
+def test_exec_does_not_wait_for_inherited_pipes():
+    started = time.monotonic()
+    silent = SilentExec(
+        ['/bin/sh', '-c', 'sleep 5 & echo started'], '', uuid='',
+        decode=True
+    )
+
+    assert silent.stdout == 'started\n'
+    assert time.monotonic() - started < 2
+
+
+class FakeCapture:
+
+    running = 0
+    peak = 0
+
+    def __init__(self, command, path, uuid, on_line=None, **kwargs):
+        self.uuid = uuid
+        self.on_line = on_line
+        self.stdout = bytearray(f'{uuid}\n'.encode())
+        self.stderr = bytearray()
+        self.truncated = False
+
+    def run(self):
+        FakeCapture.running += 1
+        FakeCapture.peak = max(FakeCapture.peak, FakeCapture.running)
+        time.sleep(0.05)
+        FakeCapture.running -= 1
+        if self.on_line:
+            self.on_line('stdout', self.uuid.encode())
+        return 1 if self.uuid == 'db' else 0
+
+
+@pytest.fixture
+def ioc(tmp_path, mocker):
+    ioc_json = mocker.patch('iocage_lib.ioc_json.IOCJson')
+    ioc_json.return_value.json_get_value.side_effect = \
+        lambda key: {'pool': 'tank', 'iocroot': str(tmp_path)}.get(
+            key, {'exec_clean': 1, 'release': '13.1-RELEASE'}
+        )
+    mocker.patch.object(iocage_lib.ioc_exec, 'CaptureExec', FakeCapture)
+    mocker.patch.object(
+        IOCage, 'list', side_effect=lambda *a, uuid=None: (uuid != 'off', 1)
+    )
+    FakeCapture.peak = 0
+
+    ioc = IOCage(jail='ALL', skip_jails=True, silent=True)
+    ioc.jails = {j: f'{tmp_path}/jails/{j}' for j in ('web', 'db', 'off')}
+    return ioc
+
+
+def test_exec_many_runs_concurrently(ioc):
+    lines = []
+    done = []
+    results = ioc.exec_many(
+        ['true'], jobs=2,
+        on_output=lambda jail, stream, line: lines.append(jail),
+        on_result=lambda r: done.append(r['jail'])
+    )
+
+    assert [r['jail'] for r in results] == ['web', 'db', 'off']
+    assert [r['rc'] for r in results] == [0, 1, None]
+    assert results[0]['stdout'] == b'web\n'
+    assert results[2]['error'] == 'off is not running'
+    assert sorted(lines) == ['db', 'web']
+    assert sorted(done) == ['db', 'off', 'web']
+    assert FakeCapture.peak == 2
+
+
+@pytest.mark.parametrize('conf,filters,expected', [
+    ({'boot': 1}, {'boot': 'on'}, True),
+    ({'boot': 0}, {'boot': 'yes'}, False),
+    ({'release': '13.1-RELEASE'}, {'release': '13.*'}, True),
+    ({'release': '13.1-RELEASE', 'boot': 1}, {
+        'release': '13.*', 'boot': 'off'
+    }, False),
+    ({'type': 'jail'}, {'notes': 'x'}, False),
+])
+def test_match_filters(conf, filters, expected):
+    assert IOCage.__match_filters__(conf, filters) is expected
+
+
+@pytest.mark.parametrize('args,output', [
+    (['-o', 'grouped'], 'grouped'),
+    (['-j', '2'], 'interleaved'),
+])
+def test_cli_output_runs_in_parallel(mocker, args, output):
+    from click.testing import CliRunner
+
+    import iocage_cli.exec
+
+    exec_parallel = mocker.patch.object(iocage_cli.exec, 'exec_parallel')
+    result = CliRunner().invoke(iocage_cli.exec.cli, [*args, 'ALL', 'true'])
+
+    assert result.exit_code == 0, result.output
+    assert exec_parallel.call_args[0][-1] == output
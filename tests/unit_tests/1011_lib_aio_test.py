@@ -0,0 +1,111 @@
+import asyncio
+import json
+import os
+import stat
+import time
+
+import pytest
+
+import iocage_lib.ioc_exec
+
+from iocage_lib.aio import AsyncIOCage
+from iocage_lib.catalog import JailCatalog
+
+JLS = '''#!/bin/sh
+echo call >> "{calls}"
+sleep 0.1
+echo '{output}'
+'''
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+
+@pytest.fixture
+def aio(tmp_path, mocker, monkeypatch):
+    cache = mocker.patch('iocage_lib.catalog.cache')
+    cache.datasets = {}
+    mocker.patch.object(
+        iocage_lib.ioc_json.IOCConfiguration, 'retrieve_default_props',
+        return_value={'type': 'jail', 'exec_fib': '0', 'exec_clean': 1}
+    )
+    for jail in ('web', 'db'):
+        write_json(str(tmp_path / f'jails/{jail}/config.json'), {
+            'host_hostuuid': jail, 'release': '13.1-RELEASE',
+        })
+
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    jls = bin_dir / 'jls'
+    jls.write_text(JLS.format(calls=tmp_path / 'jls.calls', output=json.dumps(
+        {'jail-information': {'jail': [{'jid': 3, 'name': 'ioc-web'}]}}
+    )))
+    jls.chmod(jls.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('PATH', f'{bin_dir}:{os.environ["PATH"]}')
+
+    # No jexec here, run the command itself
+    mocker.patch.object(
+        iocage_lib.ioc_exec, 'jexec_command',
+        lambda uuid, fib, command, *args: list(command)
+    )
+    mocker.patch(
+        'iocage_lib.ioc_json.IOCJson'
+    ).return_value.json_get_value.return_value = {
+        'exec_fib': '0', 'exec_clean': 1
+    }
+
+    aio = AsyncIOCage(concurrency=8)
+    aio.pool = 'tank'
+    aio.iocroot = str(tmp_path)
+    aio.catalog = JailCatalog(str(tmp_path), 'tank')
+    aio.calls = tmp_path / 'jls.calls'
+    return aio
+
+
+def test_status_queries_share_one_jls(aio):
+    async def main():
+        return await asyncio.gather(
+            *(aio.jid(j) for j in ['web', 'db'] * 500)
+        )
+
+    results = asyncio.run(main())
+
+    assert results[:2] == [(True, '3'), (False, '-')]
+    assert aio.calls.read_text().count('call') == 1
+
+
+def test_list_adds_state(aio):
+    jails = asyncio.run(aio.list())
+
+    assert [(j['name'], j['state'], j['jid']) for j in jails] == [
+        ('db', 'down', None), ('web', 'up', '3')
+    ]
+    assert jails[1]['release'] == '13.1-RELEASE'
+
+
+def test_exec_captures_output(aio):
+    result = asyncio.run(aio.exec(
+        'web', ['/bin/sh', '-c', 'echo out; echo err >&2; exit 2']
+    ))
+
+    assert result['rc'] == 2
+    assert result['stdout'] == b'out\n'
+    assert result['stderr'] == b'err\n'
+    assert result['error'] is None
+
+    result = asyncio.run(aio.exec('db', ['true']))
+    assert result['rc'] is None
+    assert result['error'] == 'db is not running'
+
+
+def test_exec_does_not_wait_for_inherited_pipes(aio):
+    started = time.monotonic()
+    result = asyncio.run(aio.exec(
+        'web', ['/bin/sh', '-c', 'sleep 5 & echo started']
+    ))
+
+    assert result['stdout'] == b'started\n'
+    assert time.monotonic() - started < 2
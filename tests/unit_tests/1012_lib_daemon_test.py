@@ -0,0 +1,95 @@
+import asyncio
+import threading
+
+import pytest
+
+import iocage_lib.daemon
+import iocage_lib.iocage
+
+from iocage_lib.daemon import Client, Daemon, RemoteIOCage
+from iocage_lib.ioc_exceptions import DaemonUnavailable
+
+
+class FakeIOCage:
+
+    calls = []
+
+    def __init__(self, jail=None, skip_jails=False, **kwargs):
+        self.jail = jail
+
+    def get(self, prop, recursive=False, plugin=False, pool=False, **kwargs):
+        FakeIOCage.calls.append(('get', self.jail, prop))
+        if prop == 'missing':
+            raise RuntimeError(f'{prop} is not a valid property!')
+        return {'jail': self.jail, 'prop': prop}
+
+    def list(self, lst_type, *args, **kwargs):
+        FakeIOCage.calls.append(('list', self.jail, lst_type))
+        return [['1', 'web', 'up']]
+
+
+@pytest.fixture
+def iocaged(tmp_path, mocker, monkeypatch):
+    path = str(tmp_path / 'iocaged.sock')
+    monkeypatch.setenv('IOCAGE_SOCKET', path)
+    mocker.patch.object(iocage_lib.iocage, 'IOCage', FakeIOCage)
+    mocker.patch.object(Daemon, 'warm_up')
+    reset = mocker.patch('iocage_lib.cache.cache.reset')
+    FakeIOCage.calls = []
+
+    daemon = Daemon(path, cache_ttl=3600)
+    ready = threading.Event()
+    handle = {}
+
+    def on_ready(stop):
+        handle['loop'] = asyncio.get_running_loop()
+        handle['stop'] = stop
+        ready.set()
+
+    thread = threading.Thread(
+        target=lambda: asyncio.run(daemon.serve(on_ready)), daemon=True
+    )
+    thread.start()
+    assert ready.wait(5)
+    daemon.reset = reset
+    yield daemon
+
+    handle['loop'].call_soon_threadsafe(handle['stop'].set)
+    thread.join(5)
+
+
+def test_read_only_calls_are_served(iocaged):
+    ioc = iocage_lib.daemon.IOCage(jail='web', skip_jails=True)
+
+    assert isinstance(ioc, RemoteIOCage)
+    assert ioc.get('release') == {'jail': 'web', 'prop': 'release'}
+    assert ioc.list('all') == [['1', 'web', 'up']]
+    assert FakeIOCage.calls == [
+        ('get', 'web', 'release'), ('list', 'web', 'all')
+    ]
+
+
+def test_errors_are_raised_by_the_client(iocaged):
+    with pytest.raises(RuntimeError, match='not a valid property'):
+        Client().call(
+            'get', jail='web', skip_jails=True, args=['missing'], kwargs={}
+        )
+
+    with pytest.raises(RuntimeError, match='Method not found'):
+        Client().call('destroy', jail='web')
+
+
+def test_invalidate_resets_the_cache(iocaged):
+    Client().invalidate()
+    assert iocaged.reset.called
+
+
+def test_fallback_without_daemon(tmp_path, monkeypatch, mocker):
+    monkeypatch.setenv('IOCAGE_SOCKET', str(tmp_path / 'none.sock'))
+    mocker.patch.object(iocage_lib.iocage, 'IOCage', FakeIOCage)
+
+    with pytest.raises(DaemonUnavailable):
+        Client().call('ping')
+    assert isinstance(iocage_lib.daemon.IOCage(jail='web'), FakeIOCage)
+    # Nothing to tell
+    Client().invalidate()
@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+# Only the commands using them may import these
+HEAVY = ('coloredlogs', 'dns.resolver', 'git', 'jsonschema', 'requests')
+# Cumulative import time in milliseconds. Both take well under 100ms on
+# an idle machine, this leaves room for slow CI runners.
+BUDGETS = {
+    'iocage_cli': 300,
+    'iocage_lib.iocage': 400,
+}
+
+
+def importtime(module):
+    """Returns {module: cumulative microseconds} for importing module."""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, cwd=ROOT, check=True,
+        env={**os.environ, 'PYTHONPATH': ROOT},
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize('module', sorted(BUDGETS))
+def test_import_time_budget(module):
+    times = importtime(module)
+
+    assert times[module] / 1000 < BUDGETS[module]
+    assert not set(HEAVY) & set(times)
@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+import iocage_lib
+
+from iocage_lib.cache import cache
+from iocage_lib.ioc_check import DATASETS, IOCCheck
+
+
+@pytest.fixture
+def zfs(tmp_path, mocker, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    ioc_json = mocker.patch('iocage_lib.ioc_json.IOCJson')
+    ioc_json.return_value.json_get_value.return_value = 'tank'
+    mocker.patch.object(os.path, 'ismount', return_value=True)
+    mocker.patch.object(IOCCheck, '__clean_files__')
+    check = mocker.patch.object(IOCCheck, '__check_datasets__')
+
+    cache.reset()
+    cache.pool_data = {'tank': {'guid': '1'}}
+    cache.dataset_data = {
+        'tank': {'org.freebsd.ioc:active': 'yes'},
+        **{
+            f'tank/{ds}': {
+                'guid': str(i), 'exec': 'on',
+                'mountpoint': str(tmp_path / ds),
+            } for i, ds in enumerate(DATASETS, 10)
+        }
+    }
+    os.makedirs(tmp_path / 'iocage')
+
+    yield check, cache.dataset_data
+    cache.reset()
+
+
+def test_check_is_skipped_while_stamp_is_valid(zfs):
+    check, datasets = zfs
+
+    assert IOCCheck(silent=True).checked
+    assert not IOCCheck(silent=True).checked
+    assert IOCCheck(silent=True, force=True).checked
+    assert check.call_count == 2
+
+
+@pytest.mark.parametrize('change', [
+    lambda datasets, pool: datasets['tank/iocage/jails'].update(guid='99'),
+    lambda datasets, pool: datasets['tank/iocage/jails'].update(
+        mountpoint='/mnt/tank/iocage/jails'
+    ),
+    lambda datasets, pool: datasets.pop('tank/iocage/log'),
+    lambda datasets, pool: pool['tank'].update(guid='2'),
+    lambda datasets, pool: setattr(iocage_lib, '__version__', '0'),
+])
+def test_check_runs_again_after_changes(zfs, monkeypatch, change):
+    check, datasets = zfs
+    monkeypatch.setattr(iocage_lib, '__version__', iocage_lib.__version__)
+    IOCCheck(silent=True)
+
+    change(datasets, cache.pool_data)
+
+    assert IOCCheck(silent=True).checked
+    assert check.call_count == 2
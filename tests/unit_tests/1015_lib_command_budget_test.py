@@ -0,0 +1,72 @@
+import pytest
+
+from iocage_lib.cache import cache
+from iocage_lib.ioc_list import IOCList
+from iocage_lib.iocage import IOCage
+
+# The number of commands must not grow with the number of jails or
+# snapshots, so every budget is checked on a small and a larger host.
+SIZES = [10, 200]
+
+
+@pytest.mark.parametrize('jails', SIZES)
+@pytest.mark.parametrize('full', [False, True])
+def test_list(fake_host, command_budget, jails, full):
+    host = fake_host(jails, running=jails // 10)
+
+    with command_budget(host, total=8, zfs=4, jls=1):
+        jail_list = IOCList(
+            'all', hdr=False, full=full, silent=True
+        ).list_datasets()
+
+    assert len(jail_list) == jails
+
+
+@pytest.mark.parametrize('jails', SIZES)
+def test_get_all_recursive(fake_host, command_budget, jails):
+    host = fake_host(jails, running=jails // 10)
+
+    with command_budget(host, total=7, zfs=4, jls=1):
+        IOCage(silent=True).get('all', recursive=True)
+
+
+@pytest.mark.parametrize('jails', SIZES)
+def test_df(fake_host, command_budget, jails):
+    host = fake_host(jails)
+
+    with command_budget(host, total=5, zfs=4, jls=0):
+        assert len(IOCage(silent=True).df()) == jails
+
+
+@pytest.mark.parametrize('snapshots', [2, 50])
+def test_snaplist(fake_host, command_budget, snapshots):
+    host = fake_host(10, snapshots=snapshots)
+
+    with command_budget(host, total=6, zfs=5):
+        snaps = IOCage(jail='jail00001', silent=True).snap_list()
+
+    assert len(snaps) == snapshots * 2
+
+
+def test_command_budget_reports_commands(fake_host, command_budget):
+    host = fake_host(10)
+    cache.reset()
+
+    with pytest.raises(AssertionError, match='zfs: [0-9]+ > 0'):
+        with command_budget(host, zfs=0):
+            IOCList('all', silent=True).list_datasets()
+
+
+def test_resolve_name_from_catalog(fake_host, command_budget):
+    host = fake_host(11)
+    # Finds the pool and iocroot
+    IOCage(skip_jails=True, silent=True)
+
+    # No dataset walk while the catalog is current
+    with command_budget(host, total=0):
+        assert len(IOCList('uuid', silent=True).list_datasets()) == 11
+        uuid, _ = IOCage(
+            jail='jail0001', skip_jails=True, silent=True
+        ).__check_jail_existence__()
+
+    assert uuid == 'jail00010'
@@ -0,0 +1,95 @@
+import threading
+import urllib.request
+
+import pytest
+
+import iocage_lib.metrics as metrics
+
+
+@pytest.mark.parametrize('jails', [10, 200])
+def test_collect_does_not_fork_per_jail(fake_host, command_budget, jails):
+    host = fake_host(jails, running=5)
+    collector = metrics.Collector()
+
+    # rctl only runs where libc lacks rctl_get_racct, once per running jail
+    with command_budget(host, total=7, zfs=1, jls=1, rctl=5):
+        samples = collector.get()
+
+    assert len(samples['iocage_jail_info']) == jails
+    assert sum(v for _, v in samples['iocage_jail_running']) == 5
+    assert {
+        labels['jail'] for labels, _ in samples['iocage_jail_jid']
+    } == {host.jail_name(i) for i in range(5)}
+    assert len(samples['iocage_jail_zfs_used_bytes']) == jails
+    assert len(samples['iocage_jail_zfs_referenced_bytes']) == jails
+
+
+def test_collection_is_reused_within_interval(fake_host, command_budget):
+    host = fake_host(10, running=2)
+    collector = metrics.Collector(interval=3600)
+    collector.get()
+
+    with command_budget(host, total=0):
+        collector.render()
+
+    collector.interval = 0
+    with command_budget(host, zfs=1, jls=1):
+        collector.render()
+
+
+def test_last_start(fake_host):
+    host = fake_host(3)
+    collector = metrics.Collector()
+    metrics.record_start(collector.iocroot, host.jail_name(1), 1700000000, 2.5)
+
+    samples = collector.get()
+
+    assert samples['iocage_jail_last_start_duration_seconds'] == [
+        ({'jail': host.jail_name(1)}, 2.5)
+    ]
+    assert samples['iocage_jail_last_start_timestamp_seconds'] == [
+        ({'jail': host.jail_name(1)}, 1700000000)
+    ]
+
+
+def test_render():
+    samples = {
+        'iocage_jail_running': [({'jail': 'a"b\\c'}, 1)],
+        'iocage_collect_duration_seconds': [({}, 0.5)],
+    }
+
+    assert metrics.render(samples) == (
+        '# HELP iocage_jail_running Whether the jail is running.\n'
+        '# TYPE iocage_jail_running gauge\n'
+        'iocage_jail_running{jail="a\\"b\\\\c"} 1\n'
+        '# HELP iocage_collect_duration_seconds How long collecting these '
+        'metrics took.\n'
+        '# TYPE iocage_collect_duration_seconds gauge\n'
+        'iocage_collect_duration_seconds 0.5\n'
+    )
+    assert metrics.render(samples, openmetrics=True).endswith('\n# EOF\n')
+
+
+def test_serve(fake_host):
+    fake_host(3, running=1)
+    server = metrics.server(metrics.Collector(), '127.0.0.1', 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/metrics'
+
+    try:
+        with urllib.request.urlopen(url) as response:
+            assert response.headers['Content-Type'] == metrics.PROMETHEUS_TYPE
+            body = response.read().decode()
+
+        request = urllib.request.Request(
+            url, headers={'Accept': 'application/openmetrics-text'}
+        )
+        with urllib.request.urlopen(request) as response:
+            assert response.headers['Content-Type'] == \
+                metrics.OPENMETRICS_TYPE
+            assert response.read().decode().endswith('# EOF\n')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert 'iocage_jail_running{jail="jail00000"} 1' in body
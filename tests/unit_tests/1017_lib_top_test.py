@@ -0,0 +1,71 @@
+import pytest
+
+import iocage_lib.top as top
+
+
+@pytest.mark.parametrize('jails', [10, 200])
+def test_sample_is_one_batch(fake_host, command_budget, jails):
+    host = fake_host(jails, running=5)
+    jail_top = top.JailTop()
+
+    # rctl only runs where libc lacks rctl_get_racct, once per running jail
+    with command_budget(host, total=6, zfs=0, jls=1, rctl=5):
+        rows = jail_top.sample()
+
+    assert sorted(r['name'] for r in rows) == [
+        host.jail_name(i) for i in range(5)
+    ]
+    assert all(r['cpu'] is None for r in rows)
+    assert all(r['mem'] == r['jid'] * 2 ** 20 for r in rows)
+
+
+def test_cpu_from_cputime_delta(monkeypatch):
+    clock = iter([100.0, 102.0])
+    usage = iter([
+        {'ioc-a': {'cputime': 10}, 'ioc-b': {'cputime': 5}},
+        {'ioc-a': {'cputime': 13}, 'ioc-b': {'cputime': 5}, 'ioc-c': {}},
+    ])
+    monkeypatch.setattr(top.time, 'monotonic', lambda: next(clock))
+    monkeypatch.setattr(top.racct, 'usage', lambda names: next(usage))
+    monkeypatch.setattr(top.JailTop, 'running', staticmethod(lambda: {
+        'ioc-a': ('a', 1), 'ioc-b': ('b', 2), 'ioc-c': ('c', 3),
+    }))
+
+    jail_top = top.JailTop()
+    jail_top.sample()
+    rows = {r['name']: r for r in jail_top.sample()}
+
+    assert rows['a']['cpu'] == 150.0
+    assert rows['b']['cpu'] == 0.0
+    assert rows['c']['cpu'] is None
+
+
+def test_sort():
+    rows = [
+        {'name': 'b', 'cpu': 1.0, 'mem': None},
+        {'name': 'a', 'cpu': 1.0, 'mem': 10},
+        {'name': 'c', 'cpu': 50.0, 'mem': 5},
+    ]
+
+    assert [r['name'] for r in top.JailTop.sort(rows, 'cpu')] == [
+        'c', 'a', 'b'
+    ]
+    assert [r['name'] for r in top.JailTop.sort(rows, 'mem')] == [
+        'a', 'c', 'b'
+    ]
+    assert [r['name'] for r in top.JailTop.sort(rows, 'name')] == [
+        'a', 'b', 'c'
+    ]
+    with pytest.raises(RuntimeError):
+        top.JailTop.sort(rows, 'bogus')
+
+
+def test_table():
+    row = dict.fromkeys(top.COLUMNS)
+    row.update(name='a', jid=1, cpu=12.5, mem=3 * 2 ** 20, read_bps=512)
+
+    header, line = top.JailTop.table([row])
+
+    assert header[:3] == ['NAME', 'JID', 'CPU%']
+    assert line[:5] == ['a', '1', '12.5', '-', '3.0M']
+    assert line[list(top.COLUMNS).index('read_bps')] == '512B'
@@ -0,0 +1,83 @@
+import json
+import os
+
+import pytest
+
+from iocage_lib.ioc_plugin import IOCPlugin
+from iocage_lib.plugin_index import PluginIndex, git_head
+
+HEAD_1 = 'a' * 40
+HEAD_2 = 'b' * 40
+
+
+@pytest.fixture
+def repo(tmp_path):
+    path = tmp_path / 'github_com_freenas_iocage-ix-plugins_git'
+    (path / '.git' / 'refs' / 'heads').mkdir(parents=True)
+    (path / '.git' / 'HEAD').write_text('ref: refs/heads/master\n')
+    (path / '.git' / 'refs' / 'heads' / 'master').write_text(HEAD_1 + '\n')
+    (path / 'INDEX').write_text(json.dumps({
+        'plex': {'MANIFEST': 'plex.json', 'primary_pkg': 'plexmediaserver'},
+        'gone': {'MANIFEST': 'gone.json'},
+    }))
+    (path / 'plex.json').write_text(json.dumps({
+        'name': 'plex', 'release': '13.1-RELEASE',
+        'packagesite': 'http://pkg.FreeBSD.org/${ABI}/latest',
+    }))
+    PluginIndex.memory.clear()
+    yield path
+    PluginIndex.memory.clear()
+
+
+def test_git_head(repo):
+    assert git_head(str(repo)) == HEAD_1
+
+    os.remove(repo / '.git' / 'refs' / 'heads' / 'master')
+    (repo / '.git' / 'packed-refs').write_text(
+        f'# pack-refs with: peeled\n{HEAD_2} refs/heads/master\n'
+    )
+    assert git_head(str(repo)) == HEAD_2
+
+    (repo / '.git' / 'HEAD').write_text(HEAD_1 + '\n')
+    assert git_head(str(repo)) == HEAD_1
+    assert git_head(str(repo / 'missing')) is None
+
+
+def test_index_is_parsed_once_per_revision(repo, monkeypatch):
+    index = PluginIndex(str(repo))
+    assert set(index.index) == {'plex', 'gone'}
+    assert set(index.manifests) == {'plex.json'}
+    assert os.path.exists(f'{repo}.index.json')
+
+    def parse(self):
+        raise AssertionError('parsed again')
+
+    # Another process finds the cache on disk
+    PluginIndex.memory.clear()
+    monkeypatch.setattr(PluginIndex, 'parse', parse)
+    assert PluginIndex(str(repo)).manifests['plex.json']['name'] == 'plex'
+
+    # A pull moves HEAD
+    (repo / '.git' / 'refs' / 'heads' / 'master').write_text(HEAD_2 + '\n')
+    with pytest.raises(AssertionError, match='parsed again'):
+        PluginIndex(str(repo)).index
+
+
+def test_retrieve_plugin_index_data(repo):
+    data = IOCPlugin.retrieve_plugin_index_data(str(repo))
+
+    assert list(data) == ['plex']
+    assert data['plex']['primary_pkg'] == 'plexmediaserver'
+    assert data['plex']['packagesite'] == \
+        'http://pkg.FreeBSD.org/FreeBSD:13:amd64/latest'
+    # Expanding the ABI left the cached manifest alone
+    assert IOCPlugin.retrieve_plugin_index_data(
+        str(repo), expand_abi=False
+    )['plex']['packagesite'] == 'http://pkg.FreeBSD.org/${ABI}/latest'
+
+
+def test_validate_plugin_index(repo):
+    invalid = IOCPlugin.validate_plugin_index(str(repo))
+
+    assert invalid['gone'] == ['Manifest gone.json not found']
+    assert "'artifact' is a required property" in invalid['plex']
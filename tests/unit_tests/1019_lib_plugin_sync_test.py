@@ -0,0 +1,104 @@
+import json
+import os
+import subprocess
+import threading
+
+import pytest
+
+from iocage_lib.ioc_plugin import IOCPlugin
+from iocage_lib.plugin_index import git_head
+
+
+def git(*args, cwd=None):
+    return subprocess.run(
+        ['git', *args], cwd=cwd, check=True, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE, encoding='utf8', env={
+            **os.environ, 'GIT_AUTHOR_NAME': 'test',
+            'GIT_AUTHOR_EMAIL': 'test@example.com',
+            'GIT_COMMITTER_NAME': 'test',
+            'GIT_COMMITTER_EMAIL': 'test@example.com',
+        }
+    ).stdout.strip()
+
+
+def commit(upstream, plugins):
+    with open(os.path.join(upstream, 'INDEX'), 'w') as f:
+        json.dump(plugins, f)
+    git('add', 'INDEX', cwd=upstream)
+    git('commit', '-q', '-m', 'INDEX', cwd=upstream)
+    return git('rev-parse', 'HEAD', cwd=upstream)
+
+
+@pytest.fixture
+def upstream(tmp_path):
+    path = str(tmp_path / 'upstream')
+    git('init', '-q', '-b', 'master', path)
+    commit(path, {'plex': {}})
+    return path
+
+
+@pytest.fixture
+def plugin(fake_host, tmp_path, upstream):
+    fake_host(1)
+
+    def plugin(**kwargs):
+        return IOCPlugin(
+            branch='master', git_repository=f'file://{upstream}',
+            git_destination=str(tmp_path / 'plugins' / 'upstream'), **kwargs
+        )
+
+    return plugin
+
+
+def test_sync_respects_ttl(plugin, upstream):
+    repo = plugin()
+    repo.pull_clone_git_repo()
+    first = git_head(repo.git_destination)
+
+    # Shallow, so only the tips of the branches were fetched
+    assert git(
+        'rev-parse', '--is-shallow-repository', cwd=repo.git_destination
+    ) == 'true'
+
+    second = commit(upstream, {'plex': {}, 'gitea': {}})
+    plugin().pull_clone_git_repo()
+    assert git_head(repo.git_destination) == first
+
+    plugin(refresh=True).pull_clone_git_repo()
+    assert git_head(repo.git_destination) == second
+
+
+def test_sync_after_ttl(plugin, upstream):
+    plugin().pull_clone_git_repo()
+    second = commit(upstream, {'gitea': {}})
+
+    repo = plugin(sync_ttl=0)
+    repo.pull_clone_git_repo()
+
+    assert git_head(repo.git_destination) == second
+    with open(os.path.join(repo.git_destination, 'INDEX')) as f:
+        assert json.load(f) == {'gitea': {}}
+
+
+def test_concurrent_callers_clone_once(plugin, monkeypatch):
+    clones = []
+    clone_repo = IOCPlugin._clone_repo
+
+    def counting_clone_repo(*args, **kwargs):
+        clones.append(args)
+        return clone_repo(*args, **kwargs)
+
+    monkeypatch.setattr(
+        IOCPlugin, '_clone_repo', staticmethod(counting_clone_repo)
+    )
+    repos = [plugin() for _ in range(4)]
+    threads = [
+        threading.Thread(target=r.pull_clone_git_repo) for r in repos
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(clones) == 1
+    assert os.path.exists(os.path.join(repos[0].git_destination, 'INDEX'))
@@ -0,0 +1,103 @@
+import http.server
+import io
+import json
+import tarfile
+import threading
+
+import pytest
+
+from iocage_lib.ioc_plugin import IOCPlugin
+from iocage_lib.packagesite import PackageSite
+
+
+def packagesite_txz(packages):
+    yaml = ''.join(
+        json.dumps({'name': name, 'path': f'All/{name}-{version}.txz'},
+                   separators=(',', ':')) + '\n'
+        for name, version in packages.items()
+    ).encode()
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:xz') as tar:
+        for name, data in (('meta', b'version = 1;\n'),
+                           ('packagesite.yaml', yaml)):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+    return buf.getvalue()
+
+
+@pytest.fixture
+def repository():
+    served = {'archive': None, 'etag': '"1"', 'requests': []}
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            served['requests'].append(self.headers.get('If-None-Match'))
+            if self.headers.get('If-None-Match') == served['etag']:
+                self.send_response(304)
+                self.end_headers()
+                return
+
+            self.send_response(200)
+            self.send_header('ETag', served['etag'])
+            self.send_header('Content-Length', str(len(served['archive'])))
+            self.end_headers()
+            self.wfile.write(served['archive'])
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    served['url'] = f'http://127.0.0.1:{server.server_address[1]}/latest/'
+    yield served
+    server.shutdown()
+    server.server_close()
+
+
+def test_parse_archive(repository):
+    repository['archive'] = packagesite_txz({
+        'plexmediaserver': '1.32.5.7349,1', 'gitea': '1.20.4_2',
+    })
+
+    assert PackageSite(repository['url']).packages() == {
+        'plexmediaserver': {'version': '1.32.5.7349', 'revision': '0',
+                            'epoch': '1'},
+        'gitea': {'version': '1.20.4', 'revision': '2', 'epoch': '0'},
+    }
+
+
+def test_cached_until_changed(repository, tmp_path):
+    repository['archive'] = packagesite_txz({'gitea': '1.20.4'})
+    PackageSite(repository['url'], str(tmp_path)).packages()
+
+    # Not downloaded again, the server says nothing changed
+    repository['archive'] = None
+    assert PackageSite(repository['url'], str(tmp_path)).packages() == {
+        'gitea': {'version': '1.20.4', 'revision': '0', 'epoch': '0'}
+    }
+    assert repository['requests'] == [None, '"1"']
+
+    repository.update(archive=packagesite_txz({'gitea': '1.21.0'}), etag='"2"')
+    assert PackageSite(repository['url'], str(tmp_path)).packages()[
+        'gitea'
+    ]['version'] == '1.21.0'
+
+
+def test_unreachable(repository, tmp_path):
+    repository['archive'] = packagesite_txz({'gitea': '1.20.4'})
+    url = repository['url']
+    PackageSite(url, str(tmp_path)).packages()
+
+    with open(PackageSite(url, str(tmp_path)).cache_path) as f:
+        cache = json.load(f)
+    cache['url'] = 'http://127.0.0.1:1/latest'
+    with open(PackageSite(cache['url'], str(tmp_path)).cache_path, 'w') as f:
+        json.dump(cache, f)
+
+    # The cached result beats nothing
+    assert PackageSite(cache['url'], str(tmp_path)).packages()['gitea']
+    assert IOCPlugin.fetch_plugin_packagesites(
+        ['http://127.0.0.1:1/other/']
+    ) == {'http://127.0.0.1:1/other': {}}
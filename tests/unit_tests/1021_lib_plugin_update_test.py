@@ -0,0 +1,203 @@
+import collections
+import json
+import os
+import threading
+
+import pytest
+
+import iocage_lib.iocage as ioc
+from iocage_lib.cache import cache
+
+REPOSITORIES = (
+    'https://github.com/ix-plugin-hub/iocage-plugin-index.git',
+    'https://example.com/plugins.git',
+)
+
+
+class FakePlugin:
+
+    pulls = collections.Counter()
+    updated = []
+    rolled_back = []
+    fail = set()
+    lock = threading.Lock()
+
+    def __init__(self, jail=None, plugin=None, git_repository=None,
+                 artifacts=None, **kwargs):
+        self.jail = jail
+        self.git_repository = git_repository
+        self.artifacts = artifacts
+        self.rolled_back = False
+
+    def pull_clone_git_repo(self, depth=1, refresh=None):
+        with self.lock:
+            self.pulls[self.git_repository] += 1
+
+    def update(self, jid, pull=True):
+        assert not pull and jid is not None and self.artifacts == {}
+        if self.jail in self.fail:
+            raise RuntimeError('PKG error')
+        with self.lock:
+            self.updated.append(self.jail)
+
+    def upgrade(self, jid, pull=True):
+        assert not pull
+        # The RELEASE is upgraded, then update() fails and rolls back to
+        # its own snapshot only
+        try:
+            self.update(jid, pull=False)
+        except RuntimeError:
+            self.__rollback_jail__('update')
+            raise
+
+    def __rollback_jail__(self, name):
+        self.rolled_back = True
+        with self.lock:
+            FakePlugin.rolled_back.append((self.jail, name))
+
+
+@pytest.fixture
+def plugin_host(fake_host, monkeypatch):
+    host = fake_host(5, running=2)
+    # Jails 0 to 3 are plugins, 0 and 1 of them running
+    for i in range(4):
+        path = os.path.join(
+            host.iocroot, 'jails', host.jail_name(i), 'config.json'
+        )
+        with open(path) as f:
+            config = json.load(f)
+        config.update(
+            type='pluginv2', plugin_name=f'plugin{i % 2}',
+            plugin_repository=REPOSITORIES[i % 2],
+        )
+        with open(path, 'w') as f:
+            json.dump(config, f)
+    cache.reset()
+
+    started = []
+    stopped = []
+    monkeypatch.setattr(
+        ioc.IOCage, 'start', lambda self, jail=None, **kw: started.append(jail)
+    )
+    monkeypatch.setattr(
+        ioc.IOCage, 'stop', lambda self, *a, **kw: stopped.append(self.jail)
+    )
+    monkeypatch.setattr(ioc.ioc_plugin, 'IOCPlugin', FakePlugin)
+    FakePlugin.pulls.clear()
+    FakePlugin.updated.clear()
+    FakePlugin.rolled_back.clear()
+    FakePlugin.fail = set()
+    host.started, host.stopped = started, stopped
+    return host
+
+
+def test_update_plugins(plugin_host):
+    host = plugin_host
+    FakePlugin.fail = {host.jail_name(1), host.jail_name(2)}
+    seen = []
+
+    results = ioc.IOCage(jail='ALL').update_plugins(
+        jobs=3, on_result=seen.append
+    )
+
+    # Only plugin jails, each repository pulled once for all of them
+    assert [r['jail'] for r in results] == [host.jail_name(i) for i in range(4)]
+    assert len(seen) == 4
+    assert FakePlugin.pulls == dict.fromkeys(REPOSITORIES, 1)
+
+    assert [r['ok'] for r in results] == [True, False, False, True]
+    assert sorted(FakePlugin.updated) == [host.jail_name(0), host.jail_name(3)]
+    assert sorted(FakePlugin.rolled_back) == [
+        (host.jail_name(1), 'update'), (host.jail_name(2), 'update')
+    ]
+    assert results[1]['rolled_back'] and results[1]['error'] == 'PKG error'
+
+    # Stopped jails are started for the update, the fake start leaves them
+    # stopped, so there is nothing to stop again
+    assert sorted(host.started) == [host.jail_name(2), host.jail_name(3)]
+    assert host.stopped == []
+
+
+def test_upgrade_rolls_back_to_before_the_upgrade(plugin_host):
+    host = plugin_host
+    FakePlugin.fail = {host.jail_name(1)}
+
+    results = ioc.IOCage(jail='ALL').update_plugins(upgrade=True)
+
+    assert [r['ok'] for r in results] == [True, False, True, True]
+    assert results[1]['rolled_back']
+    assert FakePlugin.rolled_back == [
+        (host.jail_name(1), 'update'), (host.jail_name(1), 'upgrade')
+    ]
+
+
+def test_update_single_plugin(plugin_host):
+    results = ioc.IOCage(
+        jail=plugin_host.jail_name(0), skip_jails=True
+    ).update_plugins()
+
+    assert [(r['jail'], r['ok']) for r in results] == [
+        (plugin_host.jail_name(0), True)
+    ]
+    assert FakePlugin.pulls == {REPOSITORIES[0]: 1}
+
+
+def test_artifact_is_cloned_once(fake_host, monkeypatch):
+    import iocage_lib.ioc_plugin as ioc_plugin
+
+    fake_host(1)
+    clones = []
+
+    def clone_repo(ref, repo_url, destination, depth=None, callback=None):
+        clones.append(repo_url)
+        os.makedirs(destination)
+        return True
+
+    monkeypatch.setattr(
+        ioc_plugin.IOCPlugin, '_clone_repo', staticmethod(clone_repo)
+    )
+    artifacts = {}
+    artifact = 'https://github.com/ix-plugin-hub/plex.git'
+    paths = {
+        ioc_plugin.IOCPlugin(
+            jail=f'plex{i}', plugin='plex', branch='master',
+            artifacts=artifacts
+        ).__shared_artifact__(artifact) for i in range(3)
+    }
+
+    assert clones == [artifact]
+    assert len(paths) == 1 and os.path.isdir(paths.pop())
+    assert ioc_plugin.IOCPlugin(
+        jail='plex', plugin='plex', branch='master'
+    ).__shared_artifact__(artifact) is None
+
+
+def test_failed_artifact_clone_fails_its_jails(fake_host, monkeypatch, mocker):
+    import iocage_lib.ioc_plugin as ioc_plugin
+
+    fake_host(1)
+    clones = []
+
+    def clone_repo(ref, repo_url, destination, depth=None, callback=None):
+        clones.append(repo_url)
+        return False
+
+    monkeypatch.setattr(
+        ioc_plugin.IOCPlugin, '_clone_repo', staticmethod(clone_repo)
+    )
+    logit = mocker.spy(ioc_plugin.iocage_lib.ioc_common, 'logit')
+    artifacts = {}
+    artifact = 'https://github.com/ix-plugin-hub/plex.git'
+
+    for i in range(3):
+        with pytest.raises(RuntimeError, match=f'plex{i}: .* not be cloned'):
+            ioc_plugin.IOCPlugin(
+                jail=f'plex{i}', plugin='plex', branch='master',
+                artifacts=artifacts, silent=True
+            ).__shared_artifact__(artifact)
+
+    assert clones == [artifact]
+    assert [
+        c.args[0]['message'] for c in logit.call_args_list
+        if c.args[0]['level'] == 'ERROR'
+    ] == [f'Cloning {artifact} failed, the plugins using it are not updated.']
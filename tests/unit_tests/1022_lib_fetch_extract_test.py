@@ -0,0 +1,144 @@
+import contextlib
+import hashlib
+import io
+import os
+import tarfile
+
+import pytest
+import requests
+
+from iocage_lib.dataset import Dataset
+from iocage_lib.ioc_fetch import IOCFetch
+
+RELEASE = '14.0-RELEASE'
+SETS = {
+    'base.txz': {'./bin/sh': b'sh', './usr/lib/libc.so': b'libc'},
+    'lib32.txz': {'./usr/lib32/libc.so': b'libc32', './usr/lib/lib32': b''},
+    'src.txz': {'./usr/src/Makefile': b'all:'},
+}
+
+
+def write_txz(path, members):
+    with tarfile.open(path, mode='w:xz') as tar:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+@pytest.fixture
+def fetch(fake_host):
+    host = fake_host(1)
+    download = os.path.join(host.iocroot, 'download', RELEASE)
+    os.makedirs(download)
+    for name, members in SETS.items():
+        write_txz(os.path.join(download, name), members)
+
+    fetch = IOCFetch(RELEASE, silent=True)
+    fetch.dest = os.path.join(host.iocroot, 'releases', RELEASE, 'root')
+    return fetch
+
+
+def extracted(dest):
+    return {
+        f'./{os.path.relpath(os.path.join(root, name), dest)}':
+            open(os.path.join(root, name), 'rb').read()
+        for root, _, names in os.walk(dest) for name in names
+    }
+
+
+def test_nothing_to_extract(fetch):
+    fetch.fetch_extract_all([])
+
+    assert not os.path.exists(fetch.dest)
+
+
+def test_fresh_release_extracts_concurrently(fetch, monkeypatch):
+    def remove(tar):
+        raise AssertionError('nothing to remove in a fresh RELEASE')
+
+    monkeypatch.setattr(fetch, '__fetch_extract_remove__', remove)
+    fetch.fetch_extract_all(list(SETS))
+
+    assert fetch.fresh_release
+    assert extracted(fetch.dest) == {
+        name: data for members in SETS.values()
+        for name, data in members.items()
+    }
+
+
+def test_extract_over_existing_release(fetch):
+    os.makedirs(os.path.join(fetch.dest, 'bin'))
+    with open(os.path.join(fetch.dest, 'bin', 'sh'), 'wb') as f:
+        f.write(b'old sh')
+    with open(os.path.join(fetch.dest, 'bin', 'local'), 'wb') as f:
+        f.write(b'kept')
+
+    fetch.fetch_extract_all(['base.txz'])
+
+    assert not fetch.fresh_release
+    assert extracted(fetch.dest) == {
+        './bin/sh': b'sh', './bin/local': b'kept',
+        './usr/lib/libc.so': b'libc',
+    }
+
+
+class StreamingDownloader:
+
+    """Serves the sets from memory, failing the ones in fail."""
+
+    def __init__(self, sets, fail):
+        self.sets = sets
+        self.fail = fail
+        self.digests = {}
+        self.headers = {}
+
+    @contextlib.contextmanager
+    def open(self, url, path):
+        name = url.rsplit('/', 1)[-1]
+        if name in self.fail:
+            raise requests.ConnectionError(name)
+
+        with open(path, 'wb') as f:
+            f.write(self.sets[name])
+        self.digests[path] = hashlib.sha256(self.sets[name]).hexdigest()
+        yield io.BytesIO(self.sets[name])
+
+
+@pytest.mark.parametrize('failure', ['stream', 'verify'])
+def test_failed_stream_downloads_the_set_again(fetch, mocker, failure):
+    download = os.path.join(fetch.iocroot, 'download', RELEASE)
+    sets = {}
+    with open(os.path.join(download, 'MANIFEST'), 'w') as manifest:
+        for name in SETS:
+            path = os.path.join(download, name)
+            with open(path, 'rb') as f:
+                sets[name] = f.read()
+            os.remove(path)
+
+            digest = hashlib.sha256(sets[name]).hexdigest()
+            if failure == 'verify' and name == 'src.txz':
+                digest = '0' * 64
+            manifest.write(f'{name}\t{digest}\t1\n')
+
+    fetch.files = ('MANIFEST', *SETS)
+    fetch.files_left = list(fetch.files)
+    mocker.patch.object(
+        fetch, '__fetch_downloader__', return_value=StreamingDownloader(
+            sets, ['src.txz'] if failure == 'stream' else []
+        )
+    )
+    fetch_download = mocker.patch.object(fetch, 'fetch_download')
+    destroy = mocker.spy(Dataset, 'destroy')
+
+    fetch.fetch_stream()
+
+    assert fetch_download.call_args_list == [
+        mocker.call(['MANIFEST'], missing=True),
+        mocker.call(['src.txz'], missing=True),
+    ]
+    assert [ds.name for (ds,), _ in destroy.call_args_list] == [
+        f'tank/iocage/releases/{RELEASE}/root'
+    ]
+    assert not fetch.fresh_release
+    assert fetch.files_left == list(fetch.files)
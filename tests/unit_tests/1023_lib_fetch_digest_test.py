@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+
+import pytest
+
+from iocage_lib.download import Downloader
+from iocage_lib.ioc_fetch import IOCFetch
+
+RELEASE = '14.0-RELEASE'
+SETS = {'base.txz': b'base set', 'src.txz': b'src set'}
+
+
+@pytest.fixture
+def fetch(fake_host, mocker):
+    host = fake_host(1)
+    download = os.path.join(host.iocroot, 'download', RELEASE)
+    os.makedirs(download)
+    with open(os.path.join(download, 'MANIFEST'), 'w') as f:
+        for name, data in SETS.items():
+            f.write(f'{name}\t{hashlib.sha256(data).hexdigest()}\t1\n')
+            with open(os.path.join(download, name), 'wb') as s:
+                s.write(data)
+
+    fetch = IOCFetch(RELEASE, silent=True, files=('MANIFEST', *SETS))
+    mocker.patch.object(fetch, 'fetch_extract_all')
+    fetch.download = download
+    return fetch
+
+
+@pytest.fixture
+def hash_file(mocker):
+    return mocker.patch.object(
+        Downloader, 'hash_file', side_effect=Downloader.hash_file
+    )
+
+
+def sidecar(fetch):
+    with open(os.path.join(fetch.download, '.sha256.json'), 'r') as f:
+        return json.load(f)
+
+
+def test_verified_file_is_not_read_again(fetch, hash_file):
+    assert fetch.__fetch_check__(list(SETS)) == []
+    assert hash_file.call_count == 2
+    assert sidecar(fetch)['base.txz']['sha256'] == \
+        hashlib.sha256(SETS['base.txz']).hexdigest()
+
+    fetch.files_left = list(fetch.files)
+    assert fetch.__fetch_check__(list(SETS)) == []
+    assert hash_file.call_count == 2
+    fetch.fetch_extract_all.assert_called_with(list(SETS))
+
+
+def test_changed_file_is_hashed_again(fetch, hash_file):
+    fetch.__fetch_check__(list(SETS))
+    with open(os.path.join(fetch.download, 'base.txz'), 'wb') as f:
+        f.write(b'truncated')
+
+    fetch.files_left = list(fetch.files)
+    assert fetch.__fetch_check__(list(SETS)) == ['base.txz']
+    assert hash_file.call_count == 3
+    assert sidecar(fetch)['base.txz']['sha256'] == \
+        hashlib.sha256(b'truncated').hexdigest()
+
+
+@pytest.mark.parametrize('content', [
+    '{"base.txz": ', json.dumps({'base.txz': {'sha256': '0' * 64}}),
+])
+def test_stale_sidecar_is_not_trusted(fetch, hash_file, content):
+    with open(os.path.join(fetch.download, '.sha256.json'), 'w') as f:
+        f.write(content)
+
+    assert fetch.__fetch_check__(list(SETS)) == []
+    assert hash_file.call_count == 2
+    assert sidecar(fetch)['base.txz']['sha256'] == \
+        hashlib.sha256(SETS['base.txz']).hexdigest()
+
+
+def test_sidecar_mismatching_the_file_redownloads(fetch, hash_file):
+    path = os.path.join(fetch.download, 'src.txz')
+    st = os.stat(path)
+    # Same size and mtime, but a digest recorded for other content
+    with open(os.path.join(fetch.download, '.sha256.json'), 'w') as f:
+        json.dump({'src.txz': {
+            'size': st.st_size, 'mtime': st.st_mtime_ns, 'sha256': '0' * 64
+        }}, f)
+
+    assert fetch.__fetch_check__(list(SETS)) == ['src.txz']
+    fetch.fetch_extract_all.assert_called_with(['base.txz'])
@@ -0,0 +1,72 @@
+import collections
+import contextlib
+import os
+import sys
+
+import pytest
+
+from iocage_lib.cache import cache
+from iocage_lib.ioc_list import IOCList
+
+# The synthetic hosts and tool stand-ins the scaling benchmarks run on
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'benchmarks'
+))
+import fakehost  # noqa: E402
+
+
+@pytest.fixture
+def fake_host(tmp_path, monkeypatch):
+    """
+    Returns a function generating a fakehost.FakeHost, which iocage_lib
+    then manages for the rest of the test. Every command the test runs
+    from then on is recorded in the host's calls.
+    """
+    stack = contextlib.ExitStack()
+    monkeypatch.setenv('IOCAGE_SOCKET', str(tmp_path / 'iocaged.sock'))
+
+    def generate(jails, snapshots=0, running=0, boot=0):
+        host = fakehost.FakeHost(tmp_path / 'host')
+        host.generate(jails, snapshots, running, boot)
+        host.calls = stack.enter_context(fakehost.emulate(host))
+
+        # Creates defaults.json and the jail catalog
+        IOCList('all', silent=True).list_datasets()
+        cache.reset()
+        return host
+
+    cache.reset()
+    with stack:
+        yield generate
+    cache.reset()
+
+
+@pytest.fixture
+def command_budget():
+    """
+    Context manager failing the test if the code it wraps ran a tool more
+    often than its keyword argument allows, or more than total commands.
+
+        with command_budget(host, total=8, zfs=4, jls=1):
+            IOCList('all').list_datasets()
+    """
+    @contextlib.contextmanager
+    def budget(host, total=None, **tools):
+        start = len(host.calls)
+        yield
+        calls = host.calls[start:]
+        counts = collections.Counter(os.path.basename(c[0]) for c in calls)
+
+        exceeded = [
+            f'{tool}: {counts[tool]} > {limit}'
+            for tool, limit in tools.items() if counts[tool] > limit
+        ]
+        if total is not None and len(calls) > total:
+            exceeded.append(f'total: {len(calls)} > {total}')
+
+        assert not exceeded, '\n'.join([
+            'Command budget exceeded', *exceeded, 'Commands run:',
+            *(' '.join(c) for c in calls)
+        ])
+
+    return budget